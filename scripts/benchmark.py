@@ -0,0 +1,249 @@
+
+# python benchmark.py --preset medium --output bench.json
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+from bgeolib.geo_info import BoneCaptureInfo
+from bgeolib.geo_info import CurvePrimInfo
+from bgeolib.geo_info import PackedGeoInfo
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.bgeo_converter import BgeoConverter
+
+# ケースごとの規模
+PRESETS = {
+    "small": {"grid_points": 10000, "soup_triangles": 10000, "curves": 100, "skin_points": 10000, "packed": 100},
+    "medium": {"grid_points": 1000000, "soup_triangles": 300000, "curves": 10000, "skin_points": 300000, "packed": 5000},
+    "huge": {"grid_points": 10000000, "soup_triangles": 3000000, "curves": 100000, "skin_points": 3000000, "packed": 20000},
+}
+
+
+class NullSink:
+    """ 書き込まれたバイト数だけ数える出力先 """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        length = memoryview(data).nbytes
+        self.size += length
+        return length
+
+
+def make_grid(point_count):
+    """ 四角ポリゴンのグリッド(P, N, uv) """
+    side = max(2, int(np.sqrt(point_count)))
+
+    x, z = np.meshgrid(np.arange(side, dtype=np.float32), np.arange(side, dtype=np.float32))
+    positions = np.stack([x.ravel(), np.zeros(side*side, dtype=np.float32), z.ravel()], axis=1)
+
+    # 四角形ごとの頂点番号
+    corner = (np.arange(side-1)[None, :] + side*np.arange(side-1)[:, None]).ravel()
+    indices = np.stack([corner, corner+side, corner+side+1, corner+1], axis=1).ravel()
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+
+    n_attrib = GeometryAttribute.normal()
+    n_attrib.set_array(np.tile(np.array([0.0, 1.0, 0.0], dtype=np.float32), (len(indices), 1)))
+    geo.vertex_attributes.append(n_attrib)
+
+    uv_attrib = GeometryAttribute.texturecoord("uv")
+    uv_attrib.set_array(positions[indices] / side)
+    geo.vertex_attributes.append(uv_attrib)
+
+    geo.indices = indices
+    geo.loop_counts = np.full(len(corner), 4, dtype=np.int32)
+    return geo
+
+
+def make_polygon_soup(triangle_count):
+    """ 点を共有しない三角形の集まり(primitive attributeつき) """
+    rng = np.random.default_rng(0)
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(rng.random((triangle_count*3, 3), dtype=np.float32))
+    geo.point_attributes.append(p_attrib)
+
+    material_attrib = GeometryAttribute.string("material_name")
+    material_attrib.values.extend_codes(rng.integers(0, 8, triangle_count), [ "material{}".format(i) for i in range(8) ])
+    geo.primitive_attributes.append(material_attrib)
+
+    geo.indices = np.arange(triangle_count*3)
+    geo.loop_counts = np.full(triangle_count, 3, dtype=np.int32)
+    return geo
+
+
+def make_curves(curve_count, points_per_curve=16):
+    """ たくさんのNURBSカーブ """
+    geo = GeometryInfo()
+
+    point_count = curve_count * points_per_curve
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(np.random.default_rng(0).random((point_count, 3), dtype=np.float32))
+    geo.point_attributes.append(p_attrib)
+
+    order = 4
+    knots_count = points_per_curve + order
+    knots = [0.0]*order + [ (i+1.0)/(knots_count-2*order+1) for i in range(0, knots_count-2*order) ] + [1.0]*order
+
+    for i in range(0, curve_count):
+        curve = CurvePrimInfo()
+        curve.type = "NURBCurve"
+        curve.vertices = list(range(i*points_per_curve, (i+1)*points_per_curve))
+        curve.basis = "NURBS"
+        curve.knots = knots
+        curve.order = order
+        curve.endinterpolation = True
+        geo.curves.append(curve)
+
+    geo.indices = np.arange(point_count)
+    return geo
+
+
+def make_skin_capture(point_count, influence_count=4, bone_count=64):
+    """ 各pointがinfluence_count個のboneに影響されるBoneCaptureInfo """
+    rng = np.random.default_rng(0)
+    weights = rng.random((point_count, influence_count))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    capture = BoneCaptureInfo()
+    capture.bone_names = [ "bone{}".format(i) for i in range(bone_count) ]
+    capture.bone_matrices = np.tile(np.eye(4), (bone_count, 1, 1))
+    capture.set_csr(np.full(point_count, influence_count), rng.integers(0, bone_count, point_count*influence_count), weights.ravel())
+    return capture
+
+
+def make_packed(packed_count):
+    """ 小さなジオメトリを参照するPackedGeometryの集まり """
+    bgeo = BgeoConverter().convert(make_grid(64))
+
+    packed_geo_list = list()
+    for i in range(0, packed_count):
+        packed_geo = PackedGeoInfo()
+        packed_geo.embed_id = "{:016x}".format(i+1)
+        packed_geo.bgeo = bgeo
+        packed_geo.type = "MESH"
+        packed_geo.name = "/packed/obj{}".format(i)
+        packed_geo.position = [float(i), 0.0, 0.0]
+        packed_geo_list.append(packed_geo)
+    return packed_geo_list
+
+
+def measure(func, memory):
+    """ funcを実行して(秒数, 結果, tracemallocでのピークメモリ)を返す """
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return seconds, result, peak
+
+
+def run_case(name, func, point_count, repeat, memory):
+    """ 一つのケースを計測して結果をdictで返す """
+    best_seconds = None
+    byte_count = 0
+    for _ in range(0, repeat):
+        seconds, byte_count, _ = measure(func, False)
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+
+    result = {
+        "case": name,
+        "seconds": best_seconds,
+        "bytes": byte_count,
+        "points": point_count,
+        "mb_per_second": byte_count / (1 << 20) / best_seconds if best_seconds>0 else None,
+        "points_per_second": point_count / best_seconds if best_seconds>0 and point_count else None,
+    }
+
+    if memory:
+        _, _, peak = measure(func, True)
+        result["peak_memory_bytes"] = peak
+
+    print("{:<28} {:>9.3f} s {:>10.1f} MB/s".format(name, best_seconds, result["mb_per_second"] or 0.0), file=sys.stderr)
+    return result
+
+
+def run_benchmark(preset, repeat, memory):
+    sizes = PRESETS[preset]
+    results = list()
+
+    def convert_case(geo):
+        def func():
+            sink = NullSink()
+            BgeoConverter().convert(geo, sink)
+            return sink.size
+        return func
+
+    grid = make_grid(sizes["grid_points"])
+    results.append( run_case("convert/grid", convert_case(grid), grid.point_count(), repeat, memory) )
+    del grid
+
+    soup = make_polygon_soup(sizes["soup_triangles"])
+    results.append( run_case("convert/polygon_soup", convert_case(soup), soup.point_count(), repeat, memory) )
+    del soup
+
+    curves = make_curves(sizes["curves"])
+    results.append( run_case("convert/curves", convert_case(curves), curves.point_count(), repeat, memory) )
+    del curves
+
+    skin_point_count = sizes["skin_points"]
+    capture = make_skin_capture(skin_point_count)
+    def skin_func():
+        writer = BgeoConverter.MeshWriter(NullSink())
+        writer.capture_attrib_values(capture)
+        return writer.io.size
+    results.append( run_case("bonecapture/skin", skin_func, skin_point_count, repeat, memory) )
+    del capture
+
+    packed_geo_list = make_packed(sizes["packed"])
+    def pack_func():
+        sink = NullSink()
+        BgeoConverter().pack(packed_geo_list, sink)
+        return sink.size
+    results.append( run_case("pack/packed", pack_func, None, repeat, memory) )
+
+    return results
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="bgeo serialization benchmark (does not need Blender)")
+    parser.add_argument("--preset", choices=sorted(PRESETS.keys()), default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="run each case this many times and keep the fastest")
+    parser.add_argument("--memory", action="store_true", help="measure peak memory with tracemalloc (extra run per case)")
+    parser.add_argument("--output", default=None, help="write results as JSON to this path (default: stdout)")
+    args = parser.parse_args()
+
+    report = {
+        "preset": args.preset,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "results": run_benchmark(args.preset, args.repeat, args.memory),
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
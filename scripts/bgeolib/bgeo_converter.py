@@ -1,157 +1,166 @@
-import itertools
+from collections import OrderedDict
+
+import numpy as np
 
 from .bgeo_writer import BinaryJsonWriter
 from .geo_info import StringList
+from .geo_info import BoneCaptureInfo
 from .geo_info import GeometryInfo
+from .paged_data import PAGE_SIZE
+from .paged_data import iter_packed_pages
+from .paged_data import packed_length
+from .paged_data import page_flags
+from .profiler import NULL_PROFILER
+from .profiler import profiled
 
 GEO_FILE_VER = GeometryInfo.GEO_FILE_VER
 
+# indexのstringentriesに書き込むkeyの接頭辞
+# (Houdiniが書き込むentryの決まりはわからないので、重ならないようにこのスクリプトの名前空間をつける)
+INDEX_EMBED_PREFIX = "blender_bgeo_script:embed:"
+INDEX_NAME_PREFIX = "blender_bgeo_script:name:"
+
 class BgeoConverter:
     """ GeometryInfoからbgeoデータに変換 """
 
     class MeshWriter(BinaryJsonWriter):
 
-        def __init__(self):
-            super().__init__()
+        def __init__(self, stream=None, constant_pages=True, index=False, need_position=False):
+            super().__init__(stream, need_position=index or need_position)
+            self.constant_pages = constant_pages # 値がすべて同じpageを一つのタプルにまとめる
+
+            # indexに書き込む名前 -> 位置(indexを書き込まない場合はNone)
+            self.index_entries = OrderedDict() if index else None
+
+            # (attribute class, 名前) -> rawpagedataの(位置, バイト数, storage)を記録するもの(記録しない場合はNone)
+            self.slots = None
+
+        def mark(self, key):
+            """ 現在の位置をindexに記録する """
+            if self.index_entries is not None:
+                self.index_entries[key] = self.tell()
+
+        def write_index(self):
+            """ 末尾のindexとindexpositionを書き込む
+                indexpositionは固定長のint64で書き込むので、ファイルの末尾から読める """
+            self.write_string("index")
+            index_position = self.tell()
+            with self.array_block():
+                self.write_string("integerentries")
+                with self.map_block():
+                    pass
+                self.write_string("stringentries")
+                with self.map_block():
+                    for key, position in self.index_entries.items():
+                        self.write_string(key)
+                        self.write_int64(position)
+                self.write_string("integerkeyentries")
+                with self.map_block():
+                    pass
+                self.write_string("stringkeyentries")
+                with self.map_block():
+                    pass
+            self.write_string("indexposition")
+            self.write_int64(index_position)
 
         def attrib_info(self, geo_attrib):
             with self.array_block():
                 self.write_attribute_info("public", geo_attrib.type, geo_attrib.name)
                 self.write_attribute_options(geo_attrib.options)
 
-        def float_attrib_values(self, values):
-            with self.array_block():
-                self.write_attribute_size_storage(1, "fpreal32")
+        def paged_data(self, values, size, storage, pagesize=PAGE_SIZE, packing=None, slot=None):
+            """ pagesize, packing, constantpageflags, rawpagedataを書き込む
+                slotsにslotが含まれていれば、後から値を差し替えられるようにすべてのpageをそのまま書き込んで位置を記録する """
+            record = self.slots is not None and slot in self.slots
 
-                self.write_idstring("defaults")
-                with self.array_block():
+            # 値の変換と並べ替えはpage単位で少しずつ行う(attribute全体のコピーを作らない)
+            _, dtype = BinaryJsonWriter.STORAGE_TYPES[storage]
+            values = np.asarray(values)
+            count = values.size // size if size>0 else 0
+            flags = page_flags(values, size, pagesize, packing, dtype) if self.constant_pages and not record else None
 
-                    self.write_attribute_size_storage(1, "fpreal64")
+            self.write_idstring("pagesize")
+            self.write_int(pagesize)
 
-                    self.write_idstring("values")
-                    self.write_fpreal64_uniform_array([0.0,])
+            if packing is not None:
+                self.write_idstring("packing")
+                self.write_uint8_uniform_array(packing)
 
-                self.write_idstring("values")
+            if flags is not None:
+                self.write_idstring("constantpageflags")
                 with self.array_block():
-                    self.write_attribute_size_storage(1, "fpreal32")
+                    for subvector_flags in flags:
+                        self.write_bool_uniform_array(subvector_flags)
 
-                    self.write_idstring("pagesize")
-                    self.write_int(1024)
+            self.write_idstring("rawpagedata")
+            length = packed_length(count, size, pagesize, packing, flags)
+            self.write_storage_uniform_array_chunks(storage, length, iter_packed_pages(values, size, pagesize, packing, flags, dtype))
 
-                    self.write_idstring("rawpagedata")
-                    self.write_fpreal32_uniform_array( values )
+            if record:
+                nbytes = length*np.dtype(dtype).itemsize
+                self.slots[slot] = (self.tell() - nbytes, nbytes, storage)
+
+        def numeric_attrib_values(self, values, size, storage="fpreal32", pagesize=PAGE_SIZE, slot=None):
+            """ valuesはタプルのlistか(要素数, size)の配列 """
+            is_float = storage.startswith("fpreal")
 
-        def vector2_attrib_values(self, values):
             with self.array_block():
-                self.write_attribute_size_storage(2, "fpreal32")
+                self.write_attribute_size_storage(size, storage)
 
                 self.write_idstring("defaults")
                 with self.array_block():
 
-                    self.write_attribute_size_storage(1, "fpreal64")
+                    if is_float:
+                        self.write_attribute_size_storage(1, "fpreal64")
 
-                    self.write_idstring("values")
-                    self.write_fpreal64_uniform_array([0.0,])
+                        self.write_idstring("values")
+                        self.write_fpreal64_uniform_array([0.0,])
+                    else:
+                        self.write_attribute_size_storage(1, "int64")
+
+                        self.write_idstring("values")
+                        self.write_int64_uniform_array([0,])
 
                 self.write_idstring("values")
                 with self.array_block():
-                    self.write_attribute_size_storage(2, "fpreal32")
+                    self.write_attribute_size_storage(size, storage)
+                    self.paged_data(values, size, storage, pagesize, slot=slot)
 
-                    self.write_idstring("pagesize")
-                    self.write_int(1024)
+        def float_attrib_values(self, values):
+            self.numeric_attrib_values(values, 1)
 
-                    self.write_idstring("rawpagedata")
-                    self.write_fpreal32_uniform_array( list( itertools.chain.from_iterable(values) ) )
+        def vector2_attrib_values(self, values):
+            self.numeric_attrib_values(values, 2)
 
         def vector3_attrib_values(self, values):
-            with self.array_block():
-                self.write_attribute_size_storage(3, "fpreal32")
-
-                self.write_idstring("defaults")
-                with self.array_block():
-
-                    self.write_attribute_size_storage(1, "fpreal64")
-
-                    self.write_idstring("values")
-                    self.write_fpreal64_uniform_array([0.0,])
-
-                self.write_idstring("values")
-                with self.array_block():
-                    self.write_attribute_size_storage(3, "fpreal32")
-
-                    self.write_idstring("pagesize")
-                    self.write_int(1024)
-
-                    self.write_idstring("rawpagedata")
-                    self.write_fpreal32_uniform_array( list( itertools.chain.from_iterable(values) ) )
+            self.numeric_attrib_values(values, 3)
 
         def transform_attrib_values(self, values):
-            with self.array_block():
-                self.write_attribute_size_storage(9, "fpreal32")
-
-                self.write_idstring("defaults")
-                with self.array_block():
-
-                    self.write_attribute_size_storage(1, "fpreal64")
-
-                    self.write_idstring("values")
-                    self.write_fpreal64_uniform_array([0.0,])
+            self.numeric_attrib_values(values, 9)
 
-                self.write_idstring("values")
-                with self.array_block():
-                    self.write_attribute_size_storage(9, "fpreal32")
+        def bonecapture_attrib_values(self, bone_names, bone_matrices, weights):
+            """ weightsは各pointの(bone番号, weight, bone番号, weight...)のリスト """
+            capture = BoneCaptureInfo()
+            capture.bone_names = bone_names
+            capture.bone_matrices = bone_matrices
+            capture.set_pairs(weights)
+            self.capture_attrib_values(capture)
 
-                    self.write_idstring("pagesize")
-                    self.write_int(1024)
+        def capture_attrib_values(self, capture, pagesize=PAGE_SIZE):
+            """ BoneCaptureInfoを書き込む """
 
-                    self.write_idstring("rawpagedata")
-                    self.write_fpreal32_uniform_array( list( itertools.chain.from_iterable(values) ) )
+            bone_names = capture.bone_names
 
-        def bonecapture_attrib_values(self, bone_names, bone_matrices, weights):
+            # boneCapture_pCaptData 
+            # 行列を転置して並べ、後ろに1.0を4つ足したものをそれぞれの要素ごとの配列にする 
+            matrices = np.asarray(capture.bone_matrices, dtype=np.float32).reshape(-1, 4, 4)
+            captdata = np.ones( (len(matrices), 20), dtype=np.float32 )
+            captdata[:, :16] = matrices.transpose(0, 2, 1).reshape(-1, 16)
+            captdata = captdata.T
 
-            pagesize = 1024
-
-            # boneCapture_pCaptData
-            captdata = [ list() for i in range(0, 20) ]
-            for matrix in bone_matrices:
-                for i in range(0, 16):
-                    captdata[i].append( matrix[i%4][i//4] ) # transpose 
-                captdata[16].append(1.0)
-                captdata[17].append(1.0)
-                captdata[18].append(1.0)
-                captdata[19].append(1.0)
-
-            # boneのinfluence数の最大値を調べる 
-            # weightsはbone_index, weightのリストのリスト  
-            point_count = len(weights)
-            max_influence_count = 0
-            for point_weight in weights:
-                max_influence_count = max( max_influence_count, len(point_weight)//2 )
-
-            bone_indices = [-1] * point_count * max_influence_count
-            
-            # ページごとにデータをパックする 
-            page_num = (point_count + pagesize - 1) // pagesize
-            for pagei in range(0, page_num):
-                inputi = pagei * pagesize
-                page_offset = max_influence_count * inputi
-                num_page_elements = min(pagesize, point_count-inputi)
-                for i in range(0, num_page_elements):
-                    point_weight = weights[inputi + i]
-                    weight_count = len(point_weight)//2
-                    for wi in range(0, weight_count):
-                        bone_indices[page_offset + wi*num_page_elements + i ] = point_weight[2*wi]
-
-            bone_weights = list()
-            for i in range(0, max_influence_count):
-                bone_weight_data = list()
-                for point_weight in weights:
-                    if (2*i+1) < len(point_weight):
-                        bone_weight_data.append(point_weight[ 2*i + 1 ])
-                    else:
-                        bone_weight_data.append(-1.0)
-                bone_weights.append(bone_weight_data)
+            point_count, max_influence_count = capture.indices.shape
 
+            bone_weights = capture.weights.T
 
             with self.array_block():
                 self.write_idstring("idefault")
@@ -248,7 +257,7 @@ class BgeoConverter:
                 self.write_int(1)
 
                 self.write_idstring("vstorage")
-                self.write_idstring("fpreal32")
+                self.write_idstring(capture.weight_storage)
 
                 self.write_idstring("entries")
                 self.write_int(max_influence_count)
@@ -256,30 +265,18 @@ class BgeoConverter:
                 self.write_idstring("index")
                 with self.array_block():
                     self.write_attribute_size_storage(max_influence_count, "int32")
-
-                    self.write_idstring("pagesize")
-                    self.write_int(pagesize)
-                    
-                    self.write_idstring("packing")
-                    self.write_uint8_uniform_array([1]*max_influence_count)
-                    
-                    self.write_idstring("rawpagedata")
-                    self.write_int32_uniform_array(bone_indices)
+                    # ページごとにinfluenceが外側になるように並べる 
+                    self.paged_data(capture.indices, max_influence_count, "int32", pagesize, [1]*max_influence_count)
 
                 self.write_idstring("value")
                 with self.array_block():
                     for bone_weight in bone_weights:
                         with self.array_block():
-                            self.write_attribute_size_storage(1, "fpreal32")
-
-                            self.write_idstring("pagesize")
-                            self.write_int(1024)
-
-                            self.write_idstring("rawpagedata")
-                            self.write_fpreal32_uniform_array(bone_weight)
+                            self.write_attribute_size_storage(1, capture.weight_storage)
+                            self.paged_data(bone_weight, 1, capture.weight_storage, pagesize)
 
         
-        def string_attrib_values(self, name_list, name_indices):
+        def string_attrib_values(self, name_list, name_indices, pagesize=PAGE_SIZE):
             with self.array_block():
                 self.write_attribute_size_storage(1, "int32")
                 self.write_idstring("strings")
@@ -290,28 +287,51 @@ class BgeoConverter:
                 self.write_idstring("indices")
                 with self.array_block():
                     self.write_attribute_size_storage(1, "int32")
+                    self.paged_data(np.asarray(name_indices, dtype=np.int32), 1, "int32", pagesize)
 
-                    self.write_idstring("pagesize")
-                    self.write_int(1024)
-
-                    self.write_idstring("rawpagedata")
-                    self.write_int32_uniform_array(name_indices)
-
-        def attrib_values(self, geo_attrib):
+        def attrib_values(self, geo_attrib, slot=None):
 
             if geo_attrib.type=="string":
-                self.string_attrib_values(geo_attrib.values.string_list, geo_attrib.values.index_list)
+                self.string_attrib_values(geo_attrib.values.string_list, geo_attrib.values.index_list, geo_attrib.pagesize)
+            elif geo_attrib.type=="numeric":
+                self.numeric_attrib_values(geo_attrib.values, geo_attrib.size, geo_attrib.storage, geo_attrib.pagesize, slot)
+            elif geo_attrib.type=="indexpair":
+                self.capture_attrib_values(geo_attrib.values, geo_attrib.pagesize)
             else:
-                if isinstance(geo_attrib.values[0], float):
-                    self.float_attrib_values(geo_attrib.values)
-                elif len(geo_attrib.values[0])==2:
-                    self.vector2_attrib_values(geo_attrib.values)
-                elif len(geo_attrib.values[0])==3:
-                    self.vector3_attrib_values(geo_attrib.values)
-                elif len(geo_attrib.values[0])==9:
-                    self.transform_attrib_values(geo_attrib.values)
-                else:
-                    raise NotImplementedError()
+                raise NotImplementedError()
+
+
+        def element_group(self, group):
+            """ pointグループ、primitiveグループ(要素ごとのbitを詰めた配列で書き込む) """
+            with self.array_block():
+                with self.array_block():
+                    self.write_idstring("name")
+                    self.write_idstring(group.name)
+
+                with self.array_block():
+                    self.write_idstring("selection")
+                    with self.array_block():
+                        self.write_idstring("defaults")
+                        with self.array_block():
+                            self.write_attribute_size_storage(1, "int8")
+                            self.write_idstring("values")
+                            self.write_int8_uniform_array([0,])
+
+                        self.write_idstring("unordered")
+                        with self.array_block():
+                            self.write_idstring("i8")
+                            self.write_bool_uniform_array(group.selection)
+
+        def edge_group(self, group):
+            """ エッジグループ(両端のpoint番号を一つの整数の配列で書き込む) """
+            with self.array_block():
+                with self.array_block():
+                    self.write_idstring("name")
+                    self.write_idstring(group.name)
+
+                with self.array_block():
+                    self.write_idstring("points")
+                    self.write_auto_int_uniform_array(group.points)
 
 
         def global_capt_name_values(self, bone_names):
@@ -338,10 +358,8 @@ class BgeoConverter:
 
         def global_capt_xforms_values(self, bone_matrices):
 
-            float_arrays = list()
-            for matrix in bone_matrices:
-                for i in range(0, 16):
-                    float_arrays.append( matrix[i%4][i//4] ) # transpose 
+            matrices = np.asarray(bone_matrices, dtype=np.float32).reshape(-1, 4, 4)
+            float_arrays = matrices.transpose(0, 2, 1) # transpose 
 
             with self.array_block():
                 self.write_attribute_size_storage(16, "fpreal32")
@@ -351,13 +369,19 @@ class BgeoConverter:
                     self.write_fpreal32_uniform_array(float_arrays)
 
 
-    def __init__(self):
-        pass
+    def __init__(self, constant_pages=True, index=False, profiler=None):
+        self.constant_pages = constant_pages
+        self.index = index # 各部分やembedの位置を記録したindexを末尾に書き込む
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
 
-    def convert(self, geo_info):
-        writer = BgeoConverter.MeshWriter()
+    @profiled("convert")
+    def convert(self, geo_info, stream=None, slots=None):
+        """ streamを指定した場合はそこへ直接書き出してNoneを返す
+            slots((attribute class, 名前) -> None のdict)を指定すると、そのattributeのrawpagedataの(位置, バイト数, storage)を記録する """
+        writer = BgeoConverter.MeshWriter(stream, self.constant_pages, self.index, slots is not None)
+        writer.slots = slots
 
-        hasindex = False
+        hasindex = self.index
 
         with writer.array_block():
 
@@ -401,7 +425,7 @@ class BgeoConverter:
                         for attrib in geo_info.vertex_attributes:
                             with writer.array_block():
                                 writer.attrib_info(attrib)
-                                writer.attrib_values(attrib)
+                                writer.attrib_values(attrib, ("vertex", attrib.name))
 
 
                 if len(geo_info.point_attributes)>0:
@@ -411,7 +435,7 @@ class BgeoConverter:
                         for attrib in geo_info.point_attributes:
                             with writer.array_block():
                                 writer.attrib_info(attrib)
-                                writer.attrib_values(attrib)
+                                writer.attrib_values(attrib, ("point", attrib.name))
 
 
                 if len(geo_info.primitive_attributes)>0:
@@ -421,7 +445,7 @@ class BgeoConverter:
                         for attrib in geo_info.primitive_attributes:
                             with writer.array_block():
                                 writer.attrib_info(attrib)
-                                writer.attrib_values(attrib)
+                                writer.attrib_values(attrib, ("primitive", attrib.name))
       
 
             writer.write_idstring("primitives")
@@ -435,8 +459,8 @@ class BgeoConverter:
                         with writer.array_block():
                             writer.write_idstring("s_v") # startvertex
                             writer.write_int(0)
-                            writer.write_idstring("n_p") # nprimitives
-                            writer.write_int(geo_info.primitive_count())
+                            writer.write_idstring("n_p") # nprimitives(カーブは別のblock)
+                            writer.write_int(geo_info.polygon_count())
                             writer.write_idstring("r_v") # nvertices_rle
                             writer.write_auto_int_uniform_array(geo_info.nvertices_rle())
                 # カーブ 
@@ -447,7 +471,7 @@ class BgeoConverter:
                             writer.write_idstring(curve.type)
                         with writer.array_block():
                             writer.write_idstring("vertex")
-                            writer.write_int16_uniform_array(curve.vertices)
+                            writer.write_auto_int_uniform_array(curve.vertices)
                             writer.write_idstring("closed")
                             writer.write_bool(curve.closed)
                             writer.write_idstring("basis")
@@ -463,47 +487,40 @@ class BgeoConverter:
                                 writer.write_fpreal64_uniform_array(curve.knots)
 
 
+            if len(geo_info.point_groups)>0:
+                writer.write_idstring("pointgroups")
+                with writer.array_block():
+                    for point_group in geo_info.point_groups:
+                        writer.element_group(point_group)
+
+            if len(geo_info.primitive_groups)>0:
+                writer.write_idstring("primitivegroups")
+                with writer.array_block():
+                    for primitive_group in geo_info.primitive_groups:
+                        writer.element_group(primitive_group)
+
             if len(geo_info.edge_groups)>0:
                 writer.write_idstring("edgegroups")
                 with writer.array_block():
-
                     for edge_group in geo_info.edge_groups:
-                        with writer.array_block():
+                        writer.edge_group(edge_group)
 
-                            with writer.array_block():
-                                writer.write_idstring("name")
-                                writer.write_idstring(edge_group.name)
-                                
-                            with writer.array_block():
-                                writer.write_idstring("points")
-                                with writer.array_block():
-                                    for i in edge_group.points:
-                                        writer.write_int(i)
+            if hasindex:
+                writer.write_index()
 
-            if hasindex: # 詳細不明だけどなくても動く
-                writer.write_string("index")
-                with writer.array_block():
-                    writer.write_string("integerentries")
-                    with writer.map_block():
-                        pass
-                    writer.write_string("stringentries")
-                    with writer.map_block():
-                        pass
-                    writer.write_string("integerkeyentries")
-                    with writer.map_block():
-                        pass
-                    writer.write_string("stringkeyentries")
-                    with writer.map_block():
-                        pass
-                writer.write_string("indexposition")
-                writer.write_int64(102)
-
-        return writer.getvalue()
-
-    def pack(self, packed_geo_list):
-        writer = BgeoConverter.MeshWriter()
-
-        hasindex = False
+        if self.profiler.enabled and writer.origin is not None:
+            self.profiler.count("convert_bytes", writer.tell())
+
+        return writer.getvalue() if stream is None else None
+
+    @profiled("pack")
+    def pack(self, packed_geo_list, stream=None):
+        """ PackedGeoInfo.bgeoはbytesか読み込み可能なfile(先頭からbgeoが入っているもの)
+            同じembed_idを持つものはbgeoを一つだけ持っていればよい(他はNoneでよい)
+            streamを指定した場合はそこへ直接書き出してNoneを返す """
+        writer = BgeoConverter.MeshWriter(stream, self.constant_pages, self.index)
+
+        hasindex = self.index
 
         type_list = StringList()
         name_list = StringList()
@@ -540,7 +557,7 @@ class BgeoConverter:
                 writer.write_idstring("pointref")
                 with writer.array_block():
 
-                    indices = list(range(0, len(packed_geo_list)))
+                    indices = np.arange(len(packed_geo_list), dtype=np.int64)
                     writer.write_idstring("indices")
                     writer.write_auto_int_uniform_array( indices )
 
@@ -601,10 +618,16 @@ class BgeoConverter:
                             writer.write_idstring("viewportlod")
                             writer.write_idstring("full")
 
+            # 同じembed idを参照するPackedGeometryがあってもデータは一つだけ書き込む 
+            embedded_geo_list = OrderedDict()
+            for packed_geo in packed_geo_list:
+                if packed_geo.bgeo is not None and packed_geo.embed_id not in embedded_geo_list:
+                    embedded_geo_list[packed_geo.embed_id] = packed_geo
+
             writer.write_idstring("sharedprimitivedata")
             with writer.array_block():
 
-                for packed_geo in packed_geo_list:
+                for packed_geo in embedded_geo_list.values():
                     bytes_array = "PackedGeometry".encode('utf-8')
                     writer.io.write(b'+') # 0x2b
                     writer.write_length( 0 )
@@ -616,7 +639,20 @@ class BgeoConverter:
                     with writer.array_block():
                         writer.write_string("gu:embeddedgeo")
                         writer.write_string("embed:"+packed_geo.embed_id)
-                        writer.io.write(packed_geo.bgeo[5:])
+                        writer.mark(INDEX_EMBED_PREFIX + packed_geo.embed_id)
+                        writer.write_document(packed_geo.bgeo, 5) # UT_JID_MAGICを除く 
+
+            if hasindex:
+                # 名前からも参照しているembedを引けるようにする 
+                for packed_geo in packed_geo_list:
+                    position = writer.index_entries.get(INDEX_EMBED_PREFIX + packed_geo.embed_id)
+                    if packed_geo.name is not None and position is not None:
+                        writer.index_entries[INDEX_NAME_PREFIX + packed_geo.name] = position
+
+                writer.write_index()
+
+        if self.profiler.enabled and writer.origin is not None:
+            self.profiler.count("pack_bytes", writer.tell())
 
-        return writer.getvalue()
+        return writer.getvalue() if stream is None else None
                         
\ No newline at end of file
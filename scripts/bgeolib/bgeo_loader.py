@@ -0,0 +1,446 @@
+import mmap
+import struct
+
+import numpy as np
+
+from .bgeo_converter import INDEX_EMBED_PREFIX
+from .bgeo_converter import INDEX_NAME_PREFIX
+from .bgeo_reader import BinaryJsonReader
+from .bgeo_reader import to_dict
+from .geo_info import StringList
+from .geo_info import CurvePrimInfo
+from .geo_info import PackedGeoInfo
+from .geo_info import BoneCaptureInfo
+from .geo_info import GeometryAttribute
+from .geo_info import EdgeGroup
+from .geo_info import ElementGroup
+from .geo_info import GeometryInfo
+from .paged_data import PAGE_SIZE
+from .paged_data import unpack_pages
+
+# 長い名前で書かれたprimitive runの型
+PRIMITIVE_RUN_TYPES = {
+    "Polygon_run": "p_r",
+    "PolygonCurve_run": "c_r",
+}
+
+def read_document(source):
+    """ bgeoを読み込む(sourceはbytesなどのbuffer、またはfileのpath。fileはmmapする) """
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        reader = BinaryJsonReader(source)
+    else:
+        reader = BinaryJsonReader.open(source)
+    return reader.read()
+
+
+class BgeoLoader:
+    """ bgeoデータからGeometryInfoに変換(BgeoConverterの逆)
+        数値の配列は可能な限り元のbuffer(mmap)を参照したままにする """
+
+    def __init__(self):
+        pass
+
+    def load(self, source):
+        """ Polygon, カーブのジオメトリを読み込んでGeometryInfoを返す """
+        geo_info, _ = self.geometry( read_document(source) )
+        return geo_info
+
+    def load_packed(self, source):
+        """ PackedGeometryのジオメトリを読み込んで(PackedGeoInfoのリスト, embed id -> GeometryInfo)を返す
+            PackedGeoInfo.bgeoはNone """
+        return self.packed( read_document(source) )
+
+    def packed(self, doc):
+        """ 読み込んだ文書から(PackedGeoInfoのリスト, embed id -> GeometryInfo)を作る """
+        doc = to_dict(doc)
+        _, packed_geo_list = self.geometry(doc)
+
+        embedded = dict()
+        shared = doc.get("sharedprimitivedata", [])
+        for shared_type, shared_data in zip(shared[0::2], shared[1::2]):
+            if shared_type!="PackedGeometry" or shared_data[0]!="gu:embeddedgeo":
+                continue
+            embed_id = shared_data[1][len("embed:"):]
+            embedded[embed_id], _ = self.geometry(shared_data[2])
+
+        return packed_geo_list, embedded
+
+    def geometry(self, doc):
+        """ 読み込んだ文書から(GeometryInfo, PackedGeoInfoのリスト)を作る """
+        doc = to_dict(doc)
+        geo_info = GeometryInfo()
+
+        counts = {
+            "point": doc["pointcount"],
+            "vertex": doc["vertexcount"],
+            "primitive": doc["primitivecount"],
+        }
+
+        topology = to_dict(doc["topology"])
+        pointref = to_dict(topology["pointref"])
+        geo_info.indices = np.asarray(pointref["indices"])
+
+        attributes = to_dict(doc.get("attributes", []))
+        for key, attrib_class, attrib_list in ( ("vertexattributes", "vertex", geo_info.vertex_attributes),
+            ("pointattributes", "point", geo_info.point_attributes), ("primitiveattributes", "primitive", geo_info.primitive_attributes) ):
+
+            for info, values in attributes.get(key, []):
+                attrib_list.append( self.attribute(info, values, counts[attrib_class]) )
+
+        loop_counts = list()
+        packed_primitives = list()
+        for primitive_index, (header, data) in enumerate(doc.get("primitives", [])):
+            primitive_type = to_dict(header)["type"]
+            data = to_dict(data)
+
+            if primitive_type in ("p_r", "c_r") or primitive_type in PRIMITIVE_RUN_TYPES:
+                geo_info.primitive_type = PRIMITIVE_RUN_TYPES.get(primitive_type, primitive_type)
+                if "r_v" in data:
+                    rle = np.asarray(data["r_v"], dtype=np.int64)
+                    loop_counts.append( np.repeat(rle[0::2], rle[1::2]) )
+                else:
+                    loop_counts.append( np.asarray(data["n_v"], dtype=np.int64) )
+            elif primitive_type in ("NURBCurve", "BezierCurve"):
+                geo_info.curves.append( self.curve(primitive_type, data) )
+            elif primitive_type=="PackedGeometry":
+                packed_primitives.append( (primitive_index, data) )
+            else:
+                raise NotImplementedError("Primitive type {} is not supported.".format(primitive_type))
+
+        if len(loop_counts)>0:
+            geo_info.loop_counts = np.concatenate(loop_counts)
+
+        for edge_group_data in doc.get("edgegroups", []):
+            edge_group = EdgeGroup()
+            edge_group.name = to_dict(edge_group_data[0])["name"]
+            edge_group.points = np.asarray(to_dict(edge_group_data[1])["points"], dtype=np.int64)
+            geo_info.edge_groups.append(edge_group)
+
+        for key, groups, count in ( ("pointgroups", geo_info.point_groups, geo_info.point_count()),
+            ("primitivegroups", geo_info.primitive_groups, geo_info.primitive_count()) ):
+            for group_data in doc.get(key, []):
+                groups.append( self.element_group(group_data, count) )
+
+        packed_geo_list = [ self.packed_geometry(geo_info, primitive_index, data) for primitive_index, data in packed_primitives ]
+
+        return geo_info, packed_geo_list
+
+    def paged_values(self, data, count, size):
+        """ 値の配列を(要素数, size)の配列にする """
+        if "rawpagedata" in data:
+            packing = data.get("packing")
+            return unpack_pages(data["rawpagedata"], count, size, data.get("pagesize", PAGE_SIZE),
+                None if packing is None else [ int(p) for p in packing ], data.get("constantpageflags"))
+
+        if "tuples" in data:
+            return np.asarray(data["tuples"]).reshape(count, size)
+
+        if "arrays" in data:
+            return np.stack([ np.asarray(array) for array in data["arrays"] ], axis=1).reshape(count, size)
+
+        raise NotImplementedError("Unknown attribute value layout {}.".format(sorted(data.keys())))
+
+    def attribute(self, info, values, count):
+        info = to_dict(info)
+        values = to_dict(values)
+
+        attrib = GeometryAttribute()
+        attrib.type = info["type"]
+        attrib.name = info["name"]
+        attrib.options = to_dict(info.get("options", {})).get("type", {}).get("value")
+
+        if attrib.type=="string":
+            indices = to_dict(values["indices"])
+            attrib.pagesize = indices.get("pagesize", PAGE_SIZE)
+            attrib.storage = values["storage"]
+            attrib.values = StringList.from_codes(self.paged_values(indices, count, 1).reshape(-1), values["strings"])
+
+        elif attrib.type=="numeric":
+            data = to_dict(values["values"])
+            attrib.size = values["size"]
+            attrib.storage = values["storage"]
+            attrib.pagesize = data.get("pagesize", PAGE_SIZE)
+            array = self.paged_values(data, count, attrib.size)
+            attrib.values = array if attrib.size>1 else array.reshape(-1)
+
+        elif attrib.type=="indexpair":
+            attrib.values = self.capture(values, count)
+            attrib.pagesize = to_dict(values["index"]).get("pagesize", PAGE_SIZE)
+
+        else:
+            raise NotImplementedError("Attribute type {} is not supported.".format(attrib.type))
+
+        return attrib
+
+    def capture(self, values, count):
+        """ boneCaptureからBoneCaptureInfoを作る """
+        capture = BoneCaptureInfo()
+
+        for objectset in values.get("objectsets", []):
+            objectset = to_dict(objectset)
+            for prop in objectset.get("properties", []):
+                prop = to_dict(prop)
+                if prop["name"]=="pCaptPath":
+                    capture.bone_names = list(prop["value"][0])
+                elif prop["name"]=="pCaptData":
+                    # 要素ごとの配列 -> 行列を転置して並べ、後ろに1.0を4つ足したもの
+                    captdata = np.stack([ np.asarray(data, dtype=np.float32) for data in prop["value"] ], axis=1)
+                    capture.bone_matrices = captdata[:, :16].reshape(-1, 4, 4).transpose(0, 2, 1)
+
+        influence_count = values["entries"]
+        capture.indices = self.paged_values(to_dict(values["index"]), count, influence_count).astype(np.int32, copy=False)
+
+        capture.weight_storage = values.get("vstorage", "fpreal32")
+        weights = [ self.paged_values(to_dict(weight), count, 1).reshape(-1) for weight in values["value"] ]
+        if len(weights)>0:
+            capture.weights = np.stack(weights, axis=1).astype(np.float32, copy=False)
+        else:
+            capture.weights = np.zeros( (count, 0), dtype=np.float32 )
+
+        return capture
+
+    def element_group(self, group_data, count):
+        """ pointグループ、primitiveグループからElementGroupを作る """
+        group = ElementGroup()
+        group.name = to_dict(group_data[0])["name"]
+
+        selection = to_dict( to_dict(group_data[1])["selection"] )
+        if "unordered" in selection:
+            unordered = to_dict(selection["unordered"])
+            if "i8" in unordered:
+                group.selection = np.asarray(unordered["i8"]).astype(bool)
+            elif "boolRLE" in unordered:
+                # (個数, 値)の繰り返し
+                rle = np.asarray(unordered["boolRLE"], dtype=np.int64)
+                group.selection = np.repeat(rle[1::2].astype(bool), rle[0::2])
+            else:
+                raise NotImplementedError("Group encoding {} is not supported.".format(sorted(unordered.keys())))
+        elif "ordered" in selection:
+            group.selection = np.zeros(count, dtype=bool)
+            group.selection[ np.asarray(selection["ordered"], dtype=np.int64) ] = True
+        else:
+            raise NotImplementedError("Group selection {} is not supported.".format(sorted(selection.keys())))
+
+        return group
+
+    def curve(self, curve_type, data):
+        curve = CurvePrimInfo()
+        curve.type = curve_type
+        curve.vertices = np.asarray(data["vertex"], dtype=np.int64)
+        curve.closed = data.get("closed", False)
+
+        basis = to_dict(data["basis"])
+        curve.basis = basis["type"]
+        curve.order = basis["order"]
+        curve.endinterpolation = basis.get("endinterpolation")
+        curve.knots = np.asarray(basis["knots"], dtype=np.float64)
+        return curve
+
+    def packed_geometry(self, geo_info, primitive_index, data):
+        packed_geo = PackedGeoInfo()
+
+        parameters = to_dict(data.get("parameters", {}))
+        packed_geo.embed_id = parameters.get("embedded", "")[len("embed:"):]
+
+        if "pivot" in data:
+            packed_geo.pivot = np.asarray(data["pivot"], dtype=np.float64)
+        if "transform" in data:
+            packed_geo.transform = np.asarray(data["transform"], dtype=np.float64)
+
+        p_attrib = geo_info.find_point_attributes("P")
+        if p_attrib is not None:
+            packed_geo.position = np.asarray(p_attrib.values)[ geo_info.indices[data["vertex"]] ]
+
+        for key in ("type", "name"):
+            attrib = geo_info.find_primitive_attributes(key)
+            if attrib is not None:
+                index = attrib.values.index_list[primitive_index]
+                setattr(packed_geo, key, attrib.values.string_list[index] if index>=0 else None)
+
+        return packed_geo
+
+
+class IndexedBgeoFile:
+    """ indexつきで書き出したbgeo(BgeoConverter(index=True))から必要な部分だけを読み込む
+        fileはmmapし、要求されたembedだけを解釈する """
+
+    def __init__(self, source):
+        """ sourceはfileのpath、またはbytesなどのbuffer """
+        if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            self.buffer = source
+        else:
+            with open(source, "rb") as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # 末尾は indexposition(固定長のint64) ]
+        if len(self.buffer)<10 or self.buffer[-1]!=0x5d or self.buffer[-10]!=0x14:
+            raise ValueError("The file has no index.")
+        index_position = struct.unpack_from('<q', self.buffer, len(self.buffer) - 9)[0]
+
+        index = to_dict( BinaryJsonReader(self.buffer, index_position).read() )
+        self.entries = index.get("stringentries", {})
+
+    def embed_ids(self):
+        return [ key[len(INDEX_EMBED_PREFIX):] for key in self.entries if key.startswith(INDEX_EMBED_PREFIX) ]
+
+    def names(self):
+        return [ key[len(INDEX_NAME_PREFIX):] for key in self.entries if key.startswith(INDEX_NAME_PREFIX) ]
+
+    def position(self, key):
+        """ PackedGeometryの名前(path)かembed idに対応する埋め込まれたbgeoの位置 """
+        position = self.entries.get(INDEX_NAME_PREFIX + key)
+        if position is None:
+            position = self.entries.get(INDEX_EMBED_PREFIX + key)
+        if position is None:
+            raise KeyError(key)
+        return position
+
+    def read(self, key):
+        """ 埋め込まれたbgeoを解釈したもの """
+        return BinaryJsonReader(self.buffer, self.position(key)).read()
+
+    def load(self, key):
+        """ 埋め込まれたbgeoのGeometryInfo """
+        geo_info, _ = BgeoLoader().geometry( self.read(key) )
+        return geo_info
+
+    def bgeo(self, key):
+        """ 埋め込まれたbgeoを単独のbgeoとして取り出す """
+        position = self.position(key)
+        reader = BinaryJsonReader(self.buffer, position)
+        reader.read()
+        return struct.pack('<BL', 0x7f, BinaryJsonReader.MAGIC) + bytes(self.buffer[position:reader.pos])
+
+
+def resolve_strings(string_list):
+    """ StringListを要素ごとの文字列の配列にする(番号が範囲外なら空文字列) """
+    strings = np.array(list(string_list.string_list) + [""], dtype=object)
+    indices = np.asarray(string_list.index_list, dtype=np.int64)
+    return strings[ np.where(indices>=0, indices, len(strings) - 1) ]
+
+
+def compare_arrays(expected, actual, dtype):
+    """ dtypeに変換してビット単位で比較 """
+    expected = np.ascontiguousarray(expected, dtype=dtype).reshape(-1)
+    actual = np.ascontiguousarray(actual, dtype=dtype).reshape(-1)
+    if expected.shape!=actual.shape:
+        return False
+    bits = "u{}".format(dtype.itemsize)
+    return np.array_equal(expected.view(bits), actual.view(bits))
+
+
+def compare_geometry(expected, actual):
+    """ 二つのGeometryInfoを比較して違いの説明のリストを返す(同じなら空) """
+    differences = list()
+
+    for attrib_class, expected_list, actual_list in ( ("point", expected.point_attributes, actual.point_attributes),
+        ("vertex", expected.vertex_attributes, actual.vertex_attributes), ("primitive", expected.primitive_attributes, actual.primitive_attributes) ):
+
+        expected_names = [ attrib.name for attrib in expected_list ]
+        actual_names = [ attrib.name for attrib in actual_list ]
+        if expected_names!=actual_names:
+            differences.append("{} attributes: {} != {}".format(attrib_class, expected_names, actual_names))
+
+        for expected_attrib in expected_list:
+            actual_attrib = actual_list.find(expected_attrib.name)
+            if actual_attrib is None:
+                continue
+            name = "{} attribute {}".format(attrib_class, expected_attrib.name)
+
+            expected_info = (expected_attrib.type, expected_attrib.options, expected_attrib.size)
+            actual_info = (actual_attrib.type, actual_attrib.options, actual_attrib.size)
+            if expected_info!=actual_info:
+                differences.append("{}: {} != {}".format(name, expected_info, actual_info))
+                continue
+
+            if expected_attrib.type=="string":
+                expected_strings = resolve_strings(expected_attrib.values)
+                actual_strings = resolve_strings(actual_attrib.values)
+                if expected_strings.shape!=actual_strings.shape or not (expected_strings==actual_strings).all():
+                    differences.append("{}: strings differ".format(name))
+
+            elif expected_attrib.type=="indexpair":
+                expected_capture = expected_attrib.values
+                actual_capture = actual_attrib.values
+                if list(expected_capture.bone_names)!=list(actual_capture.bone_names):
+                    differences.append("{}: bone names differ".format(name))
+                if not compare_arrays(expected_capture.bone_matrices, actual_capture.bone_matrices, np.dtype(np.float32)):
+                    differences.append("{}: bone matrices differ".format(name))
+                if not compare_arrays(expected_capture.indices, actual_capture.indices, np.dtype(np.int32)):
+                    differences.append("{}: bone indices differ".format(name))
+                if not compare_arrays(expected_capture.weights, actual_capture.weights, np.dtype(np.float32)):
+                    differences.append("{}: bone weights differ".format(name))
+
+            elif not compare_arrays(expected_attrib.values, actual_attrib.values, np.asarray(actual_attrib.values).dtype):
+                differences.append("{}: values differ".format(name))
+
+    if expected.primitive_type!=actual.primitive_type and len(expected.loop_counts)>0:
+        differences.append("primitive type: {} != {}".format(expected.primitive_type, actual.primitive_type))
+    if not compare_arrays(expected.indices, actual.indices, np.dtype(np.int64)):
+        differences.append("vertex indices differ")
+    if not compare_arrays(expected.loop_counts, actual.loop_counts, np.dtype(np.int64)):
+        differences.append("loop counts differ")
+
+    if len(expected.curves)!=len(actual.curves):
+        differences.append("curves: {} != {}".format(len(expected.curves), len(actual.curves)))
+    else:
+        for i, (expected_curve, actual_curve) in enumerate(zip(expected.curves, actual.curves)):
+            expected_info = (expected_curve.type, bool(expected_curve.closed), expected_curve.basis, expected_curve.order, expected_curve.endinterpolation)
+            actual_info = (actual_curve.type, bool(actual_curve.closed), actual_curve.basis, actual_curve.order, actual_curve.endinterpolation)
+            if expected_info!=actual_info:
+                differences.append("curve {}: {} != {}".format(i, expected_info, actual_info))
+            if not compare_arrays(expected_curve.vertices, actual_curve.vertices, np.dtype(np.int64)):
+                differences.append("curve {}: vertices differ".format(i))
+            if not compare_arrays(expected_curve.knots, actual_curve.knots, np.dtype(np.float64)):
+                differences.append("curve {}: knots differ".format(i))
+
+    expected_groups = [ (group.name, list(np.asarray(group.points).tolist())) for group in expected.edge_groups ]
+    actual_groups = [ (group.name, list(np.asarray(group.points).tolist())) for group in actual.edge_groups ]
+    if expected_groups!=actual_groups:
+        differences.append("edge groups differ")
+
+    for group_class, expected_list, actual_list in ( ("point", expected.point_groups, actual.point_groups),
+        ("primitive", expected.primitive_groups, actual.primitive_groups) ):
+        if [ group.name for group in expected_list ]!=[ group.name for group in actual_list ]:
+            differences.append("{} groups: {} != {}".format(group_class, [ group.name for group in expected_list ], [ group.name for group in actual_list ]))
+            continue
+        for expected_group, actual_group in zip(expected_list, actual_list):
+            if not compare_arrays(expected_group.selection, actual_group.selection, np.dtype(bool)):
+                differences.append("{} group {}: selection differs".format(group_class, expected_group.name))
+
+    return differences
+
+
+def check_geometry(geo_info):
+    """ GeometryInfoの整合性を調べて問題の説明のリストを返す(問題なければ空) """
+    problems = list()
+
+    point_count = geo_info.point_count()
+    vertex_count = geo_info.vertex_count()
+    primitive_count = geo_info.primitive_count()
+
+    indices = np.asarray(geo_info.indices, dtype=np.int64)
+    if len(indices)>0 and (indices.min()<0 or indices.max()>=point_count):
+        problems.append("vertex indices out of range (point count {})".format(point_count))
+
+    used_vertex_count = int(np.sum(geo_info.loop_counts, dtype=np.int64)) + sum( len(curve.vertices) for curve in geo_info.curves )
+    if used_vertex_count!=vertex_count:
+        problems.append("primitives use {} vertices (vertex count {})".format(used_vertex_count, vertex_count))
+
+    for attrib_class, attributes, count in ( ("point", geo_info.point_attributes, point_count),
+        ("vertex", geo_info.vertex_attributes, vertex_count), ("primitive", geo_info.primitive_attributes, primitive_count) ):
+        for attrib in attributes:
+            if attrib.element_count()!=count:
+                problems.append("{} attribute {} has {} elements (expected {})".format(attrib_class, attrib.name, attrib.element_count(), count))
+
+    for group_class, groups, count in ( ("point", geo_info.point_groups, point_count), ("primitive", geo_info.primitive_groups, primitive_count) ):
+        for group in groups:
+            if len(group.selection)!=count:
+                problems.append("{} group {} has {} elements (expected {})".format(group_class, group.name, len(group.selection), count))
+
+    for group in geo_info.edge_groups:
+        points = np.asarray(group.points, dtype=np.int64)
+        if len(points)%2!=0 or (len(points)>0 and (points.min()<0 or points.max()>=point_count)):
+            problems.append("edge group {} has invalid points".format(group.name))
+
+    return problems
@@ -0,0 +1,189 @@
+# coding: utf-8
+
+import mmap
+import struct
+
+import numpy as np
+
+class BinaryJsonReader:
+    """ BinaryJsonWriterで書き出したデータ(Houdiniのbinary JSON)を読み込む
+        配列はlist、mapはdict、uniform arrayはbufferを参照するnumpy配列(コピーしない)になる """
+
+    MAGIC = 0x624a534e
+
+    # 数値のtoken
+    SCALAR_TYPES = {
+        0x11: struct.Struct('<b'),
+        0x12: struct.Struct('<h'),
+        0x13: struct.Struct('<l'),
+        0x14: struct.Struct('<q'),
+        0x19: struct.Struct('<f'),
+        0x1a: struct.Struct('<d'),
+        0x21: struct.Struct('<B'),
+        0x22: struct.Struct('<H'),
+    }
+
+    # uniform arrayの要素の型
+    UNIFORM_TYPES = {
+        0x11: np.dtype('<i1'),
+        0x12: np.dtype('<i2'),
+        0x13: np.dtype('<i4'),
+        0x14: np.dtype('<i8'),
+        0x18: np.dtype('<f2'),
+        0x19: np.dtype('<f4'),
+        0x1a: np.dtype('<f8'),
+        0x21: np.dtype('u1'),
+        0x22: np.dtype('<u2'),
+    }
+
+    LENGTH_TYPES = {
+        0xf2: struct.Struct('<H'),
+        0xf4: struct.Struct('<L'),
+        0xf8: struct.Struct('<Q'),
+    }
+
+    # 配列、mapの終わり
+    END = object()
+
+    def __init__(self, buffer, offset=0):
+        """ bufferはbytes, bytearray, mmapなど(読み込んだ配列はbufferを参照し続ける) """
+        self.buffer = buffer
+        self.pos = offset
+        self.string_map = dict()
+
+        # UT_JID_MAGIC
+        if len(buffer)>=offset+5 and buffer[offset]==0x7f and struct.unpack_from('<L', buffer, offset+1)[0]==BinaryJsonReader.MAGIC:
+            self.pos += 5
+
+    @staticmethod
+    def open(path):
+        """ fileをmmapして読み込む(配列を使っている間はmmapが残る) """
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return BinaryJsonReader(buffer)
+
+    def read(self):
+        """ 値を一つ読み込む """
+        value = self.read_value()
+        if value is BinaryJsonReader.END:
+            raise ValueError("Unexpected end of array or map at {}.".format(self.pos - 1))
+        return value
+
+    def read_byte(self):
+        value = self.buffer[self.pos]
+        self.pos += 1
+        return value
+
+    def read_length(self):
+        length = self.read_byte()
+        if length<0xf1:
+            return length
+
+        length_type = BinaryJsonReader.LENGTH_TYPES.get(length)
+        if length_type is None:
+            raise ValueError("Unknown length type 0x{:02x} at {}.".format(length, self.pos - 1))
+
+        value = length_type.unpack_from(self.buffer, self.pos)[0]
+        self.pos += length_type.size
+        return value
+
+    def read_bytes(self, length):
+        value = bytes(self.buffer[self.pos:self.pos+length])
+        self.pos += length
+        return value
+
+    def read_value(self):
+        token = self.read_byte()
+
+        # id def (定義の後に値が続く)
+        while token==0x2b:
+            string_id = self.read_length()
+            self.string_map[string_id] = self.read_bytes(self.read_length()).decode('utf-8')
+            token = self.read_byte()
+
+        # id ref
+        if token==0x26:
+            return self.string_map[self.read_length()]
+
+        if token==0x27:
+            return self.read_bytes(self.read_length()).decode('utf-8')
+
+        if token==0x5b:
+            return self.read_array()
+
+        if token==0x7b:
+            return self.read_map()
+
+        if token==0x5d or token==0x7d:
+            return BinaryJsonReader.END
+
+        if token==0x40:
+            return self.read_uniform_array()
+
+        scalar_type = BinaryJsonReader.SCALAR_TYPES.get(token)
+        if scalar_type is not None:
+            value = scalar_type.unpack_from(self.buffer, self.pos)[0]
+            self.pos += scalar_type.size
+            return value
+
+        if token==0x30:
+            return False
+        if token==0x31:
+            return True
+        if token==0x10:
+            return self.read_byte()!=0
+        if token==0x18:
+            value = float(np.frombuffer(self.buffer, BinaryJsonReader.UNIFORM_TYPES[0x18], 1, self.pos)[0])
+            self.pos += 2
+            return value
+        if token==0x00:
+            return None
+
+        raise ValueError("Unknown token 0x{:02x} at {}.".format(token, self.pos - 1))
+
+    def read_array(self):
+        values = list()
+        while True:
+            value = self.read_value()
+            if value is BinaryJsonReader.END:
+                return values
+            values.append(value)
+
+    def read_map(self):
+        values = dict()
+        while True:
+            key = self.read_value()
+            if key is BinaryJsonReader.END:
+                return values
+            values[key] = self.read()
+
+    def read_uniform_array(self):
+        type_code = self.read_byte()
+        length = self.read_length()
+
+        # 32個ずつuint32のwordに詰めたbool
+        if type_code==0x10:
+            if length==0:
+                return np.zeros(0, dtype=bool)
+            word_count = (length + 31) // 32
+            words = np.frombuffer(self.buffer, np.uint8, word_count*4, self.pos)
+            self.pos += word_count*4
+            return np.unpackbits(words, count=length, bitorder="little").astype(bool)
+
+        dtype = BinaryJsonReader.UNIFORM_TYPES.get(type_code)
+        if dtype is None:
+            raise ValueError("Unknown uniform array type 0x{:02x} at {}.".format(type_code, self.pos - 1))
+
+        if length==0:
+            return np.zeros(0, dtype=dtype)
+
+        values = np.frombuffer(self.buffer, dtype, length, self.pos)
+        self.pos += length * dtype.itemsize
+        return values
+
+
+def to_dict(items):
+    """ ["key", value, "key", value...]の配列をdictにする(mapならそのまま) """
+    if isinstance(items, dict):
+        return items
+    return dict( zip(items[0::2], items[1::2]) )
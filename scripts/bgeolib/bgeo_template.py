@@ -0,0 +1,58 @@
+import hashlib
+import io
+
+import numpy as np
+
+from .bgeo_converter import BgeoConverter
+from .bgeo_writer import BinaryJsonWriter
+
+
+class BgeoTemplate:
+    """ 一度書き出したbgeoの一部のattributeの値だけを差し替えて使い回す
+        (トポロジーが変わらず形だけが変わるアニメーション用)
+        差し替えるattributeはpageをまとめずに書き出すので、値が変わってもバイト数は変わらない """
+
+    def __init__(self, geo_info, varying=( ("point", "P"), ("vertex", "N"), ("point", "N"), ("primitive", "N") )):
+        """ varyingは差し替える(attribute class, 名前)のリスト(geo_infoにないものは無視する) """
+        slots = { key: None for key in varying }
+        self.data = BgeoConverter().convert(geo_info, slots=slots)
+
+        # (attribute class, 名前) -> rawpagedataの(位置, バイト数, storage)
+        self.slots = { key: slot for key, slot in slots.items() if slot is not None }
+
+        self.digest = hashlib.sha1(self.data).digest()
+
+    def render(self, values, stream=None):
+        """ values((attribute class, 名前) -> 配列)で値を差し替えたbgeoを書き出す
+            valuesにないattributeは書き出した時の値のまま
+            streamを指定した場合はそこへ直接書き出してNoneを返す """
+        out = io.BytesIO() if stream is None else stream
+        data = memoryview(self.data)
+
+        position = 0
+        for key, (offset, length, storage) in sorted( self.slots.items(), key=lambda item: item[1][0] ):
+            if key not in values:
+                continue
+
+            _, dtype = BinaryJsonWriter.STORAGE_TYPES[storage]
+            array = np.ascontiguousarray(values[key], dtype=dtype).reshape(-1)
+            if array.nbytes!=length:
+                raise ValueError("{} has {} bytes (template has {}).".format(key, array.nbytes, length))
+
+            out.write(data[position:offset])
+            out.write(array.data)
+            position = offset + length
+
+        out.write(data[position:])
+
+        return out.getvalue() if stream is None else None
+
+    def fingerprint(self, values):
+        """ テンプレートと差し替える値から作るkey(render結果が同じなら同じ) """
+        h = hashlib.sha1(self.digest)
+        for key, (_, _, storage) in sorted(self.slots.items()):
+            if key in values:
+                _, dtype = BinaryJsonWriter.STORAGE_TYPES[storage]
+                h.update( repr(key).encode('utf-8') )
+                h.update( np.ascontiguousarray(values[key], dtype=dtype).tobytes() )
+        return h.hexdigest()
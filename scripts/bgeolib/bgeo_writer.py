@@ -2,6 +2,26 @@
 
 import struct
 import io
+import shutil
+
+import numpy as np
+
+class CountingStream:
+    """ 書き込んだバイト数を数えるstream(tell()できない出力先用) """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def write(self, data):
+        length = memoryview(data).nbytes
+        self.stream.write(data)
+        self.size += length
+        return length
+
+    def tell(self):
+        return self.size
+
 
 class BinaryJsonWriter:
 
@@ -28,16 +48,54 @@ class BinaryJsonWriter:
             self.writer.end_map()
 
 
-    def __init__(self):
+    COPY_CHUNK_SIZE = 1 << 20
+
+    # storageごとのuniform arrayの型 
+    STORAGE_TYPES = {
+        "int8": (0x11, '<i1'),
+        "int16": (0x12, '<i2'),
+        "int32": (0x13, '<i4'),
+        "int64": (0x14, '<i8'),
+        "fpreal16": (0x18, '<f2'),
+        "fpreal32": (0x19, '<f4'),
+        "fpreal64": (0x1a, '<f8'),
+        "uint8": (0x21, 'u1'),
+    }
+
+    def __init__(self, stream=None, magic=True, need_position=False):
+        """ streamを指定するとメモリに溜めずにそのまま書き出す(file, pipe, 圧縮フィルタなど)
+            need_positionがTrueならtell()で書き込んだ位置がわかるようにする """
+
+        # 出力先が指定されていなければメモリ上に構築する 
+        self.owns_io = stream is None
+        self.io = io.BytesIO() if stream is None else stream
+
+        # 書き始めた位置 
+        try:
+            self.origin = self.io.tell()
+        except (AttributeError, OSError):
+            self.origin = None
+            if need_position:
+                self.io = CountingStream(self.io)
+                self.origin = 0
+
         # UT_JID_MAGIC
-        self.io = io.BytesIO()
-        self.io.write(struct.pack('B', 0x7f))
-        self.io.write(struct.pack('<L', 0x624a534e))
+        if magic:
+            self.io.write(struct.pack('B', 0x7f))
+            self.io.write(struct.pack('<L', 0x624a534e))
 
         self.string_map = dict()
 
     def __del__(self):
-        self.io.close()
+        # 外から渡されたstreamは閉じない 
+        if self.owns_io:
+            self.io.close()
+
+    def tell(self):
+        """ 書き始めてからのバイト数(UT_JID_MAGICを含む) """
+        if self.origin is None:
+            raise Exception('tell() needs a seekable stream or need_position=True.')
+        return self.io.tell() - self.origin
 
     def begin_array(self):
         self.io.write(b'[')
@@ -131,55 +189,91 @@ class BinaryJsonWriter:
     def write_real64(self, value):
         self.io.write(struct.pack('<Bd', 0x1a, value))
 
+    @staticmethod
+    def array_chunks(values, dtype):
+        """ valuesをdtypeの1次元配列として少しずつ返す
+            変換が要らなければそのまま一つだけ返し、要る場合もCOPY_CHUNK_SIZE程度ずつ変換する """
+        dtype = np.dtype(dtype)
+        if values.dtype==dtype and values.flags.c_contiguous:
+            yield values.reshape(-1)
+            return
+        if values.ndim==0 or len(values)==0:
+            yield np.asarray(values, dtype=dtype).reshape(-1)
+            return
+
+        # 先頭の次元で区切る
+        row_bytes = max(1, values.size // len(values) * dtype.itemsize)
+        rows = max(1, BinaryJsonWriter.COPY_CHUNK_SIZE // row_bytes)
+        for start in range(0, len(values), rows):
+            yield np.ascontiguousarray(values[start:start+rows], dtype=dtype).reshape(-1)
+
+    def write_uniform_array(self, type_code, dtype, values):
+        """ numpy配列, array.array, memoryview, listをまとめてbufferとして書き込む
+            多次元の配列は平坦化して書き込む """
+        data = np.asarray(values)
+        self.write_uniform_array_chunks(type_code, dtype, data.size, BinaryJsonWriter.array_chunks(data, dtype))
+
+    def write_uniform_array_chunks(self, type_code, dtype, length, chunks):
+        """ 合わせてlength個になる配列(chunks)を一つのuniform arrayとして順番に書き込む
+            全体を一つの配列にまとめなくてよいので、streamに書き出す時にメモリを使わない """
+        self.io.write(struct.pack('<BB', 0x40, type_code))
+        self.write_length(length)
+
+        written = 0
+        for chunk in chunks:
+            data = np.ascontiguousarray(chunk, dtype=dtype).reshape(-1)
+            if data.size>0:
+                self.io.write(data.data)
+            written += data.size
+
+        if written!=length:
+            raise ValueError("Wrote {} values to a uniform array of length {}.".format(written, length))
+
+    def write_storage_uniform_array(self, storage, values):
+        """ Attributeのstorage名に対応する型でuniform arrayを書き込む """
+        type_code, dtype = BinaryJsonWriter.STORAGE_TYPES[storage]
+        self.write_uniform_array(type_code, dtype, values)
+
+    def write_storage_uniform_array_chunks(self, storage, length, chunks):
+        type_code, dtype = BinaryJsonWriter.STORAGE_TYPES[storage]
+        self.write_uniform_array_chunks(type_code, dtype, length, chunks)
+
     def write_bool_uniform_array(self, values):
+        """ 32個ずつ下位bitから詰めたuint32のwordとして書き込む """
+        bits = np.ascontiguousarray(values, dtype=bool).reshape(-1)
+
         self.io.write(struct.pack('<BB', 0x40, 0x10))
-        self.write_length(len(values))
+        self.write_length(bits.size)
 
-        bool_list = values[:]
-        while len(bool_list)>0:
-            current_list = bool_list[:32]
-            word = 0
-            for i, v in enumerate(current_list):
-                if v:
-                    word |= (1<<i)
-            self.io.write(struct.pack('<L', word))
+        word_count = (bits.size + 31) // 32
+        if word_count>0:
+            words = np.zeros(word_count*4, dtype=np.uint8)
+            packed = np.packbits(bits, bitorder="little")
+            words[:len(packed)] = packed
+            self.io.write(words.data)
 
     def write_int8_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x11))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}b'.format(length), *values))
+        self.write_uniform_array(0x11, '<i1', values)
 
     def write_int16_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x12))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}h'.format(length), *values))
+        self.write_uniform_array(0x12, '<i2', values)
 
     def write_int32_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x13))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}l'.format(length), *values))
+        self.write_uniform_array(0x13, '<i4', values)
 
     def write_int64_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x14))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}q'.format(length), *values))
+        self.write_uniform_array(0x14, '<i8', values)
 
     def write_auto_int_uniform_array(self, values):
+        """ 値の範囲(最小値と最大値)が収まる一番小さい整数型で書き込む """
+        values = np.asarray(values)
 
-        if len(values)==0:
+        if values.size==0:
             self.write_int8_uniform_array( values )
             return
 
-        min_value = max( values )
-        max_value = max( values )
+        min_value = int( values.min() )
+        max_value = int( values.max() )
 
         # int8_t 
         if -128<=min_value and max_value<=127:
@@ -191,31 +285,21 @@ class BinaryJsonWriter:
         elif -2147483648<=min_value and max_value<=2147483647:
             self.write_int32_uniform_array( values )
         # int64_t
-        else:
+        elif -9223372036854775808<=min_value and max_value<=9223372036854775807:
             self.write_int64_uniform_array( values )
+        else:
+            raise OverflowError("Values {}..{} do not fit in int64.".format(min_value, max_value))
 
 
     def write_fpreal32_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x19))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}f'.format(length), *values))
+        self.write_uniform_array(0x19, '<f4', values)
         
 
     def write_fpreal64_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x1a))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}d'.format(length), *values))
+        self.write_uniform_array(0x1a, '<f8', values)
 
     def write_uint8_uniform_array(self, values):
-        self.io.write(struct.pack('<BB', 0x40, 0x21))
-        length = len(values)
-        self.write_length(length)
-        if length>0:
-            self.io.write(struct.pack('<{}B'.format(length), *values))
+        self.write_uniform_array(0x21, 'u1', values)
             
     def write_attribute_info(self, scope, typeinfo, name):
         self.write_idstring('scope')
@@ -251,6 +335,16 @@ class BinaryJsonWriter:
         for i in range(0, count):
             self.io.write(v)
 
+    def write_document(self, source, skip=0):
+        """ 別に書き出したbgeoデータ(bytesまたは読み込み可能なfile)をそのまま書き込む """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.io.write(memoryview(source)[skip:])
+        else:
+            source.seek(skip)
+            shutil.copyfileobj(source, self.io, BinaryJsonWriter.COPY_CHUNK_SIZE)
+
     def getvalue(self):
+        if not self.owns_io:
+            raise Exception('getvalue() is only available for in-memory writer.')
         return self.io.getvalue()
 
@@ -0,0 +1,84 @@
+import mmap
+import struct
+import tempfile
+import zlib
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+
+# blosc1のchunk header
+BLOSC_ZLIB_FORMAT = 3
+BLOSC_MEMCPYED = 0x02
+BLOSC_DONT_SPLIT = 0x10
+BLOSC_MAX_OVERHEAD = 16
+
+
+def decompress_blosc_chunk(chunk):
+    """ blosc1形式のchunkを展開する
+        python-bloscがなければ、shuffleなしでzlibで圧縮されたものだけ扱える """
+
+    _, _, flags, typesize, nbytes, blocksize, cbytes = struct.unpack_from('<BBBBIII', chunk, 0)
+
+    if flags & BLOSC_MEMCPYED:
+        return bytes(chunk[BLOSC_MAX_OVERHEAD:BLOSC_MAX_OVERHEAD+nbytes])
+
+    if blosc is not None:
+        return blosc.decompress(bytes(chunk[:cbytes]))
+
+    if (flags >> 5)!=BLOSC_ZLIB_FORMAT or (flags & 0x05)!=0 or (not (flags & BLOSC_DONT_SPLIT) and typesize>1):
+        raise NotImplementedError("python-blosc is required to read this chunk.")
+
+    nblocks = (nbytes + blocksize - 1) // blocksize
+    block_starts = struct.unpack_from('<{}i'.format(nblocks), chunk, BLOSC_MAX_OVERHEAD)
+
+    data = bytearray()
+    for i, start in enumerate(block_starts):
+        block_size = min(blocksize, nbytes - i*blocksize)
+        compressed_size = struct.unpack_from('<i', chunk, start)[0]
+        compressed = chunk[start+4:start+4+compressed_size]
+        # 圧縮サイズ==元のサイズならそのまま格納されている
+        data += compressed if compressed_size==block_size else zlib.decompress(compressed)
+
+    return bytes(data)
+
+
+def iter_bgeosc_blocks(data):
+    """ .bgeo.sc(bytesやmmapなど)のblockを先頭から一つずつ展開して返す
+        indexは使わず、chunk headerのcbytesをたどる """
+    data = memoryview(data)
+    if bytes(data[:4])!=b"scf1" or bytes(data[-4:])!=b"1fcs":
+        raise ValueError("Not a .bgeo.sc file.")
+
+    # footer: indexのサイズ(>Q) + 1fcs
+    index_length = struct.unpack_from('>Q', data, len(data) - 12)[0]
+    index_offset = len(data) - 12 - index_length
+
+    offset = 12 # scf1 + metadata
+    while offset<index_offset:
+        cbytes = struct.unpack_from('<I', data, offset + 12)[0]
+        if cbytes<BLOSC_MAX_OVERHEAD or offset + cbytes>index_offset:
+            raise ValueError("Broken chunk at {}.".format(offset))
+        yield decompress_blosc_chunk(data[offset:offset+cbytes])
+        offset += cbytes
+
+
+def read_bgeosc(data):
+    """ .bgeo.sc(bytesなど)を展開したbgeoのbytes """
+    return b"".join( iter_bgeosc_blocks(data) )
+
+
+def open_bgeosc(path):
+    """ .bgeo.scのfileを展開したbgeoをmmapで返す
+        入力もmmapし、blockを一つずつ一時ファイルに書き出すので全体をメモリに持たない """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        with tempfile.TemporaryFile() as out:
+            for block in iter_bgeosc_blocks(data):
+                out.write(block)
+            out.flush()
+            if out.tell()==0:
+                return b""
+            # mmapはfileを閉じても残る
+            return mmap.mmap(out.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .geo_info import STORAGE_DTYPES
+
+
+def update_hash(h, values, dtype=None):
+    """ 配列の中身をhashに加える(連続していてdtypeが同じならコピーせずにそのまま渡す) """
+    values = np.ascontiguousarray(values, dtype=dtype)
+    h.update( memoryview(values).cast('B') if values.size>0 else b"" )
+
+
+class ConversionCache:
+    """ 変換済みのbgeoをディレクトリに保存しておき、同じジオメトリなら再利用する
+        合計サイズがmax_bytesを超えたら最後に使われたのが古いものから削除する """
+
+    COPY_CHUNK_SIZE = 1 << 20
+
+    # これより古い一時ファイルは書き込み中に落ちたものとして消す(秒)
+    STALE_TEMP_SECONDS = 60 * 60
+
+    def __init__(self, directory, max_bytes=10 * (1 << 30)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # key -> [最終使用時刻, サイズ]
+        self.entries = dict()
+        stale_time = time.time() - ConversionCache.STALE_TEMP_SECONDS
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith(".bgeo"):
+                self.entries[entry.name[:-5]] = [stat.st_mtime, stat.st_size]
+            elif entry.name.endswith(".tmp") and stat.st_mtime<stale_time:
+                # storeの途中で終了して残ったもの
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def fingerprint(geo_info, *extra):
+        """ GeometryInfoの内容とextra(バージョンや変換行列など)から作るkey """
+        h = hashlib.sha1()
+
+        def update_values(values, dtype):
+            update_hash(h, values, dtype)
+
+        for x in extra:
+            h.update( repr(x).encode('utf-8') )
+
+        h.update( geo_info.primitive_type.encode('utf-8') )
+
+        for attrib_class, attributes in ( ("point", geo_info.point_attributes),
+            ("vertex", geo_info.vertex_attributes), ("primitive", geo_info.primitive_attributes) ):
+
+            for attrib in attributes:
+                h.update( repr( (attrib_class, attrib.type, attrib.name, attrib.options, attrib.size, attrib.storage, attrib.pagesize) ).encode('utf-8') )
+                if attrib.type=="string":
+                    h.update( "\0".join(attrib.values.string_list).encode('utf-8') )
+                    update_values(attrib.values.index_list, np.int64)
+                elif attrib.type=="indexpair":
+                    h.update( "\0".join(attrib.values.bone_names).encode('utf-8') )
+                    update_values(attrib.values.bone_matrices, np.float32)
+                    update_values(attrib.values.indices, np.int32)
+                    update_values(attrib.values.weights, np.float32)
+                    h.update( attrib.values.weight_storage.encode('utf-8') )
+                else:
+                    update_values(attrib.values, STORAGE_DTYPES[attrib.storage])
+
+        update_values(geo_info.loop_counts, np.int64)
+        update_values(geo_info.indices, np.int64)
+
+        for curve in geo_info.curves:
+            h.update( repr( (curve.type, curve.closed, curve.basis, curve.order, curve.endinterpolation) ).encode('utf-8') )
+            update_values(curve.vertices, np.int64)
+            update_values(curve.knots, np.float64)
+
+        for group_class, groups in ( ("point", geo_info.point_groups), ("primitive", geo_info.primitive_groups) ):
+            for group in groups:
+                h.update( repr( (group_class, group.name) ).encode('utf-8') )
+                update_values(group.selection, bool)
+
+        for edge_group in geo_info.edge_groups:
+            h.update( edge_group.name.encode('utf-8') )
+            update_values(edge_group.points, np.int64)
+
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".bgeo")
+
+    def load(self, key, as_file=False):
+        """ keyに対応するbgeo(なければNone)
+            as_fileがTrueなら読み込まずに開いたfileを返す(閉じるのは呼び出し側) """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        path = self.path(key)
+        try:
+            os.utime(path)
+            f = open(path, "rb")
+        except OSError:
+            # 他のプロセスに消された
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        entry[0] = os.fstat(f.fileno()).st_mtime
+        self.hits += 1
+
+        if as_file:
+            return f
+        with f:
+            return f.read()
+
+    def store(self, key, bgeo):
+        """ bgeo(bytesまたは読み込み可能なfile)を保存 """
+
+        # 書きかけのファイルが読まれないように一時ファイルに書いてから置き換える
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(bgeo, (bytes, bytearray, memoryview)):
+                f.write(bgeo)
+            else:
+                bgeo.seek(0)
+                shutil.copyfileobj(bgeo, f, ConversionCache.COPY_CHUNK_SIZE)
+
+        path = self.path(key)
+        os.replace(temp_path, path)
+
+        self.entries[key] = [os.path.getmtime(path), os.path.getsize(path)]
+        self.stores += 1
+
+        self.evict()
+
+    def evict(self):
+        """ 合計サイズがmax_bytesに収まるまで古いものから削除 """
+        total_bytes = sum( size for _, size in self.entries.values() )
+        if total_bytes<=self.max_bytes:
+            return
+
+        for key, (_, size) in sorted( self.entries.items(), key=lambda item: item[1][0] ):
+            if total_bytes<=self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": sum( size for _, size in self.entries.values() ),
+        }
@@ -0,0 +1,56 @@
+import hashlib
+
+
+class EmbedRegistry:
+    """ 同じジオメトリを一つのembed idにまとめるための登録簿
+        元データのkey(datablockなど)と変換後のbgeoの内容の両方で同一か調べる """
+
+    COPY_CHUNK_SIZE = 1 << 20
+
+    def __init__(self):
+        self.next_id = 1
+        self.key_map = dict() # 元データのkey -> embed id
+        self.digest_map = dict() # bgeoのhash -> embed id
+        self.aliases = dict() # 重複していたembed id -> 代わりに使うembed id
+
+    def new_embed_id(self):
+        embed_id = "{:016x}".format(self.next_id)
+        self.next_id += 1
+        return embed_id
+
+    def find(self, key):
+        """ keyに対応するembed id(なければNone) """
+        return self.key_map.get(key)
+
+    def register(self, key, embed_id):
+        self.key_map[key] = embed_id
+
+    def register_bgeo(self, embed_id, bgeo, digest=None):
+        """ bgeoの内容を登録して、同じ内容が登録済みならそちらのembed idを返す
+            digestがわかっていれば(EmbedRegistry.digestの値)bgeoは読まない """
+        if digest is None:
+            digest = EmbedRegistry.digest(bgeo)
+
+        registered_id = self.digest_map.get(digest)
+        if registered_id is None:
+            self.digest_map[digest] = embed_id
+            return embed_id
+
+        self.aliases[embed_id] = registered_id
+        return registered_id
+
+    def resolve(self, embed_id):
+        """ 重複をまとめた後のembed id """
+        return self.aliases.get(embed_id, embed_id)
+
+    @staticmethod
+    def digest(bgeo):
+        """ bgeo(bytesまたは読み込み可能なfile)のhash """
+        h = hashlib.sha1()
+        if isinstance(bgeo, (bytes, bytearray, memoryview)):
+            h.update(bgeo)
+        else:
+            bgeo.seek(0)
+            for chunk in iter(lambda: bgeo.read(EmbedRegistry.COPY_CHUNK_SIZE), b""):
+                h.update(chunk)
+        return h.digest()
@@ -1,25 +1,89 @@
+import itertools
 from collections import OrderedDict
 
+import numpy as np
+
+from .paged_data import PAGE_SIZE
+
+# Attributeのstorageとnumpyのdtypeの対応 
+STORAGE_DTYPES = {
+    "fpreal16": np.dtype("<f2"),
+    "fpreal32": np.dtype("<f4"),
+    "fpreal64": np.dtype("<f8"),
+    "uint8": np.dtype("u1"),
+    "int8": np.dtype("i1"),
+    "int16": np.dtype("<i2"),
+    "int32": np.dtype("<i4"),
+    "int64": np.dtype("<i8"),
+}
+
 class StringList:
     """ 文字列のリストを名前とインデックスで管理するリスト """
 
+    __slots__ = ("string_list", "index_list", "string_map", "first_positions")
+
     def __init__(self):
         self.string_list = list()
         self.index_list = list()
+        self.string_map = dict() # 文字列 -> string_listでの番号 
+        self.first_positions = dict() # string_listでの番号 -> index_listで最初に現れる位置 
 
-    def append(self, string):
+    @staticmethod
+    def from_codes(codes, strings):
+        """ 番号の配列と文字列のテーブルから作成 """
+        string_list = StringList()
+        string_list.extend_codes(codes, strings)
+        return string_list
+
+    def intern(self, string):
+        """ string_listでの番号を返す(なければ追加) """
         if string is None or len(string)==0:
-            self.index_list.append(-1)
-            return
+            return -1
 
         string = self.remove_space(string)
 
-        if string in self.string_list:
-            self.index_list.append( self.string_list.index(string) )
-        else:
+        index = self.string_map.get(string)
+        if index is None:
             index = len(self.string_list)
             self.string_list.append(string)
-            self.index_list.append(index)
+            self.string_map[string] = index
+        return index
+
+    def append(self, string):
+        index = self.intern(string)
+        if index>=0 and index not in self.first_positions:
+            self.first_positions[index] = len(self.index_list)
+        self.index_list.append(index)
+
+    def extend(self, strings):
+        for string in strings:
+            self.append(string)
+
+    def extend_codes(self, codes, strings):
+        """ codesはstringsでの番号の配列(範囲外の番号は空文字列として扱う)
+            string_listには使われている文字列だけを最初に現れた順に追加する(appendを繰り返したのと同じ) """
+        codes = np.asarray(codes, dtype=np.int64).reshape(-1)
+
+        # 範囲外の番号は末尾(len(strings))にまとめる 
+        valid = (0<=codes) & (codes<len(strings))
+        codes = np.where(valid, codes, len(strings))
+
+        # 使われている番号を最初に現れた順に 
+        used_codes, first_positions = np.unique(codes, return_index=True)
+        order = np.argsort(first_positions, kind="stable")
+
+        # stringsの番号 -> string_listでの番号 
+        remap = np.full(len(strings) + 1, -1, dtype=np.int64)
+        offset = len(self.index_list)
+        for code, position in zip(used_codes[order].tolist(), first_positions[order].tolist()):
+            if code==len(strings):
+                continue
+            index = self.intern(strings[code])
+            remap[code] = index
+            if index>=0 and index not in self.first_positions:
+                self.first_positions[index] = offset + position
+
+        self.index_list.extend(remap[codes].tolist())
 
     def index(self, string):
         if string is None or len(string)==0:
@@ -27,16 +91,19 @@ class StringList:
 
         string = self.remove_space(string)
 
-        if string in self.string_list:
-            str_index = self.string_list.index( string )
-            return self.index_list.index(str_index)
-        return -1
+        str_index = self.string_map.get(string)
+        if str_index is None:
+            return -1
+        return self.first_positions[str_index]
 
     def remove_space(self, string):
         return string.replace(" ", "_")
 
 class CurvePrimInfo:
     """ カーブの情報をまとめたもの """
+
+    __slots__ = ("type", "vertices", "closed", "basis", "knots", "order", "endinterpolation")
+
     def __init__(self):
         self.type = "BezierCurve" # or "NURBCurve"
         self.vertices = list()
@@ -49,6 +116,9 @@ class CurvePrimInfo:
 
 class PackedGeoInfo:
     """ PackedGeometryの情報をまとめたもの """
+
+    __slots__ = ("embed_id", "bgeo", "type", "name", "position", "bounds", "pivot", "transform")
+
     def __init__(self):
         self.embed_id = ""
         self.bgeo = None
@@ -60,21 +130,86 @@ class PackedGeoInfo:
         self.transform = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
 
 
+class BoneCaptureInfo:
+    """ boneCaptureの情報をまとめたもの
+        indices, weightsは(point数, influence数)の配列(使わない所はindex -1, weight -1.0) """
+
+    __slots__ = ("bone_names", "bone_matrices", "indices", "weights", "weight_storage")
+
+    def __init__(self):
+        self.bone_names = list()
+        self.bone_matrices = list() # 4x4の行列 
+        self.indices = np.zeros( (0, 0), dtype=np.int32 )
+        self.weights = np.zeros( (0, 0), dtype=np.float32 )
+        self.weight_storage = "fpreal32" # or "fpreal16"
+
+    def set_csr(self, counts, indices, weights):
+        """ pointごとのinfluence数と、それを並べたbone番号, weightから設定 """
+        counts = np.asarray(counts, dtype=np.int64).reshape(-1)
+        point_count = len(counts)
+        influence_count = int(counts.max()) if point_count>0 else 0
+
+        # 各influenceの(point番号, 何番目か) 
+        offsets = np.cumsum(counts) - counts
+        rows = np.repeat(np.arange(point_count), counts)
+        columns = np.arange(len(rows)) - np.repeat(offsets, counts)
+
+        self.indices = np.full( (point_count, influence_count), -1, dtype=np.int32 )
+        self.indices[rows, columns] = indices
+        self.weights = np.full( (point_count, influence_count), -1.0, dtype=np.float32 )
+        self.weights[rows, columns] = weights
+
+    def set_pairs(self, weights):
+        """ 各pointの(bone番号, weight, bone番号, weight...)のリストから設定 """
+        counts = np.fromiter( (len(point_weight)//2 for point_weight in weights), dtype=np.int64, count=len(weights) )
+        pairs = np.fromiter( itertools.chain.from_iterable( point_weight[:2*(len(point_weight)//2)] for point_weight in weights ),
+            dtype=np.float64, count=2*int(counts.sum()) )
+        self.set_csr(counts, pairs[0::2], pairs[1::2])
+
+    def influence_count(self):
+        return self.indices.shape[1]
+
+
 class GeometryAttribute:
-    """ GeometryのAttribute一つを表すもの """
+    """ GeometryのAttribute一つを表すもの
+        valuesはタプルのlistか、(要素数, size)の連続したnumpy配列 """
+
+    __slots__ = ("type", "name", "options", "size", "storage", "pagesize", "values")
 
     def __init__(self):
         self.type = "numeric" # or "string" / "indexpair" / "stringarray" / "arraydata"
         self.name = None
         self.options = None # "point" / "normal" / "texturecoord" /  "indexpair" / "matrix"
+        self.size = 1 # タプルのサイズ 
+        self.storage = "fpreal32" # or STORAGE_DTYPESのstorage("fpreal16" / "int8" / "int64"など)
+        self.pagesize = PAGE_SIZE # 値を区切るpageのサイズ(値がすべて同じpageは一つのタプルで格納される)
         self.values = list()
 
+    def set_array(self, values, storage=None):
+        """ valuesをstorageに合わせた型の連続したバッファとして設定 """
+        if storage is not None:
+            self.storage = storage
+
+        array = np.ascontiguousarray(values, dtype=STORAGE_DTYPES[self.storage])
+        self.values = array.reshape(-1, self.size) if self.size>1 else array.reshape(-1)
+
+    def element_count(self):
+        """ 要素(タプル)の数 """
+        if self.type=="string":
+            return len(self.values.index_list)
+        if self.type=="indexpair":
+            return self.values.indices.shape[0]
+        if isinstance(self.values, np.ndarray):
+            return self.values.size // self.size
+        return len(self.values)
+
     @staticmethod
     def point():
         attrib = GeometryAttribute() 
         attrib.type = "numeric"
         attrib.name = "P"
         attrib.options = "point"
+        attrib.size = 3
         return attrib
 
     @staticmethod
@@ -83,6 +218,7 @@ class GeometryAttribute:
         attrib.type = "numeric"
         attrib.name = "N"
         attrib.options = "normal"
+        attrib.size = 3
         return attrib
 
     @staticmethod
@@ -91,6 +227,7 @@ class GeometryAttribute:
         attrib.type = "numeric"
         attrib.name = name
         attrib.options = "color"
+        attrib.size = 3
         return attrib
 
     @staticmethod
@@ -99,13 +236,16 @@ class GeometryAttribute:
         attrib.type = "numeric"
         attrib.name = name
         attrib.options = "texturecoord"
+        attrib.size = 3
         return attrib
 
     @staticmethod
-    def numeric(name):
+    def numeric(name, size=1, storage="fpreal32"):
         attrib = GeometryAttribute() 
         attrib.type = "numeric"
         attrib.name = name
+        attrib.size = size
+        attrib.storage = storage
         return attrib
 
     @staticmethod
@@ -114,6 +254,7 @@ class GeometryAttribute:
         attrib.type = "numeric"
         attrib.name = name
         attrib.options = "matrix"
+        attrib.size = 9
         return attrib
 
     @staticmethod
@@ -125,31 +266,110 @@ class GeometryAttribute:
         attrib.values = StringList()
         return attrib
 
+    @staticmethod
+    def bonecapture(name="boneCapture"):
+        attrib = GeometryAttribute() 
+        attrib.type = "indexpair"
+        attrib.name = name
+        attrib.options = "indexpair"
+        attrib.values = BoneCaptureInfo()
+        return attrib
+
+class AttributeList:
+    """ 名前で引けるAttributeのリスト(追加順を保持、同名のAttributeは上書き) """
+
+    __slots__ = ("attributes",)
+
+    def __init__(self):
+        self.attributes = OrderedDict()
+
+    def append(self, attrib):
+        self.attributes[attrib.name] = attrib
+
+    def extend(self, attribs):
+        for attrib in attribs:
+            self.append(attrib)
+
+    def remove(self, attrib):
+        del self.attributes[attrib.name]
+
+    def find(self, name):
+        return self.attributes.get(name)
+
+    def __contains__(self, name):
+        return name in self.attributes
+
+    def __iter__(self):
+        return iter(self.attributes.values())
+
+    def __len__(self):
+        return len(self.attributes)
+
+
 class EdgeGroup:
-    """ エッジグループ """
+    """ エッジグループ(pointsはエッジの両端のpoint番号を並べたもの) """
+
+    __slots__ = ("name", "points")
 
     def __init__(self):
         self.name  = ""
         self.points = list()
 
 
+class ElementGroup:
+    """ pointグループ、primitiveグループ(selectionは要素ごとに含まれるかどうかのbool配列) """
+
+    __slots__ = ("name", "selection")
+
+    def __init__(self):
+        self.name = ""
+        self.selection = np.zeros(0, dtype=bool)
+
+
+def promote_values(values, element_indices, element_count, tolerance=0.0):
+    """ vertexごとの値(values)がelement(pointやprimitive)ごとに一定なら、elementごとの値を返す
+        element_indicesはvertexごとのelement番号、tolerance以下の違いは同じ値とみなす
+        一定でなければNone """
+    values = np.asarray(values)
+    element_indices = np.asarray(element_indices).reshape(-1)
+    if len(values)!=element_indices.size:
+        return None
+
+    # 各elementの値はそのelementを参照するvertexのどれか(参照されないelementは0) 
+    element_values = np.zeros( (element_count,) + values.shape[1:], dtype=values.dtype )
+    element_values[element_indices] = values
+    expanded = element_values[element_indices]
+
+    if tolerance>0:
+        same = np.all( np.abs(values - expanded)<=tolerance )
+    else:
+        same = np.array_equal(values, expanded)
+
+    return element_values if same else None
+
+
 class GeometryInfo:
     """ ジオメトリ出力のために必要な情報をまとめたもの """
 
     GEO_FILE_VER = "20.5.410"
 
+    __slots__ = ("point_attributes", "vertex_attributes", "primitive_attributes",
+        "point_groups", "primitive_groups", "edge_groups", "primitive_type", "loop_counts", "indices", "curves")
+
     def __init__(self):
 
         # point
-        self.point_attributes = list()
+        self.point_attributes = AttributeList()
 
         # vertex
-        self.vertex_attributes = list()
+        self.vertex_attributes = AttributeList()
         
         # primitive
-        self.primitive_attributes = list()
+        self.primitive_attributes = AttributeList()
 
-        # edge group
+        # group
+        self.point_groups = list()
+        self.primitive_groups = list()
         self.edge_groups = list()
 
         # p_r:Polygon_Run c_r:PolygonCurve_Run
@@ -161,52 +381,102 @@ class GeometryInfo:
         self.curves = list()
 
     def find_point_attributes(self, name):
-        for attrib in self.point_attributes:
-            if attrib.name == name:
-                return attrib
-        return None
+        return self.point_attributes.find(name)
 
     def find_vertex_attributes(self, name):
-        for attrib in self.vertex_attributes:
-            if attrib.name == name:
-                return attrib
-        return None
+        return self.vertex_attributes.find(name)
 
     def find_primitive_attributes(self, name):
-        for attrib in self.primitive_attributes:
-            if attrib.name == name:
-                return attrib
-        return None
+        return self.primitive_attributes.find(name)
 
 
     def point_count(self):
         """ HoudiniでのPoint数 """
-        return len(self.point_attributes[0].values) if len( self.point_attributes )>0 else 0
+        for attrib in self.point_attributes:
+            return attrib.element_count()
+        return 0
 
     def vertex_count(self):
         """ HoudiniでのVertex数 """
         return len( self.indices )
 
+    def polygon_count(self):
+        """ ポリゴン(loop_counts)の数 """
+        return len( self.loop_counts )
+
     def primitive_count(self):
         """ HoudiniでのPrimitive数 """
-        return len( self.loop_counts ) + len(self.curves)
+        return self.polygon_count() + len(self.curves)
 
     def nvertices_rle(self):
-        """ 頂点数、その頂点数のポリゴン数を並べた配列 """
-        rle = list()
-        count = 0
-        nvertices = 0
-        for loop_count in self.loop_counts:
-            if nvertices != loop_count and count>0:
-                rle.append(nvertices)
-                rle.append(count)
-                count = 0
-
-            nvertices = loop_count
-            count += 1
-
-        if nvertices>0 and count>0:
-            rle.append(nvertices)
-            rle.append(count)
-
-        return rle
\ No newline at end of file
+        """ 頂点数、その頂点数のポリゴン数を並べた配列(int64) """
+        loop_counts = np.asarray(self.loop_counts).reshape(-1)
+        if loop_counts.size==0:
+            return np.zeros(0, dtype=np.int64)
+
+        # 頂点数が変わる位置で区切る(ポリゴン数と同じ大きさのint64の配列を作らないように直接比べる) 
+        run_starts = np.flatnonzero( loop_counts[1:]!=loop_counts[:-1] ) + 1
+        run_starts = np.concatenate( ([0], run_starts) )
+        run_lengths = np.diff( np.append(run_starts, loop_counts.size) )
+
+        rle = np.empty(2*run_starts.size, dtype=np.int64)
+        rle[0::2] = loop_counts[run_starts]
+        rle[1::2] = run_lengths
+        return rle
+
+    def vertex_primitive_indices(self):
+        """ vertexごとのprimitive番号(どのprimitiveにも含まれないvertexは-1) """
+        loop_counts = np.asarray(self.loop_counts, dtype=np.int64).reshape(-1)
+        primitive_indices = np.full(self.vertex_count(), -1, dtype=np.int64)
+
+        polygon_vertex_count = int( loop_counts.sum() )
+        primitive_indices[:polygon_vertex_count] = np.repeat( np.arange(loop_counts.size, dtype=np.int64), loop_counts )
+        for i, curve in enumerate(self.curves):
+            primitive_indices[ np.asarray(curve.vertices, dtype=np.int64) ] = loop_counts.size + i
+
+        return primitive_indices
+
+    def promote_vertex_attributes(self, tolerance=0.0):
+        """ pointごと、primitiveごとに値が一定のvertex attributeをpoint/primitive attributeに移す
+            (要素数の少ない方を優先、移す先に同じ名前のattributeがあれば移さない)
+            移したattributeの(class, 名前)のリストを返す """
+        vertex_count = self.vertex_count()
+        if vertex_count==0:
+            return list()
+
+        # 要素数の少ない方から試す 
+        targets = [ ("primitive", self.primitive_count(), self.primitive_attributes, self.vertex_primitive_indices),
+            ("point", self.point_count(), self.point_attributes, lambda: np.asarray(self.indices).reshape(-1)) ]
+        targets.sort(key=lambda target: target[1])
+        element_indices = dict()
+
+        promoted = list()
+        for attrib in list(self.vertex_attributes):
+            if attrib.type!="numeric" or not isinstance(attrib.values, np.ndarray) or attrib.values.size!=vertex_count*attrib.size:
+                continue
+
+            values = attrib.values.reshape(vertex_count, -1)
+            for attrib_class, element_count, attrib_list, get_element_indices in targets:
+                if attrib.name in attrib_list:
+                    continue
+
+                # どのelementにも属さないvertexがあれば移せない 
+                if attrib_class not in element_indices:
+                    indices = get_element_indices()
+                    valid = indices.size==0 or ( indices.min()>=0 and indices.max()<element_count )
+                    element_indices[attrib_class] = indices if valid else None
+                indices = element_indices[attrib_class]
+                if indices is None:
+                    continue
+
+                element_values = promote_values(values, indices, element_count, tolerance)
+                if element_values is None:
+                    continue
+
+                attrib.values = element_values if attrib.values.ndim>1 else element_values.reshape(-1)
+                self.vertex_attributes.remove(attrib)
+                attrib_list.append(attrib)
+                promoted.append( (attrib_class, attrib.name) )
+                break
+
+        return promoted
\ No newline at end of file
@@ -0,0 +1,187 @@
+import numpy as np
+
+# Attributeの値を区切るpageの既定のサイズ
+PAGE_SIZE = 1024
+
+# 一度にまとめて処理するバイト数の目安(page単位で区切り、attribute全体の一時的なコピーを作らない)
+CHUNK_SIZE = 1 << 20
+
+
+def constant_page_flags(values, pagesize=PAGE_SIZE):
+    """ values((要素数, size)の配列)の各pageがすべて同じ値かどうかのbool配列
+        -0.0と0.0やNaNを区別するためビット列として比較する """
+    count = len(values)
+    if count==0:
+        return np.zeros(0, dtype=bool)
+
+    bits = values.view("u{}".format(values.dtype.itemsize))
+
+    # 直前の要素と同じか(pageの先頭は常にTrue)
+    same = np.ones(count, dtype=bool)
+    same[1:] = (bits[1:]==bits[:-1]).all(axis=1)
+    same[::pagesize] = True
+
+    flags = np.logical_and.reduceat(same, np.arange(0, count, pagesize))
+
+    # タプルが一つしかないpageはまとめても小さくならない
+    if pagesize==1:
+        flags[:] = False
+    elif count % pagesize==1:
+        flags[-1] = False
+
+    return flags
+
+
+def split_packing(size, packing):
+    """ (subvectorの数, subvectorのサイズ) """
+    packing = [size] if packing is None else list(packing)
+    pack_size = packing[0]
+    if any( p!=pack_size for p in packing ) or pack_size*len(packing)!=size:
+        raise ValueError("packing must split size into equal parts")
+    return len(packing), pack_size
+
+
+def chunk_tuple_count(size, pagesize, itemsize):
+    """ 一度に処理するタプル数(pagesizeの倍数) """
+    return max(1, CHUNK_SIZE // max(1, pagesize*size*itemsize)) * pagesize
+
+
+def page_flags(values, size, pagesize=PAGE_SIZE, packing=None, dtype=None):
+    """ subvectorごとのconstantpageflagsのリスト(値がすべて同じpageが一つもなければNone)
+        dtypeを指定するとその型に変換した値で比べる """
+    if size==0:
+        return None
+
+    values = np.asarray(values).reshape(-1, size)
+    dtype = values.dtype if dtype is None else np.dtype(dtype)
+    pack_count, pack_size = split_packing(size, packing)
+
+    count = len(values)
+    flags = np.zeros( (pack_count, (count + pagesize - 1) // pagesize), dtype=bool )
+
+    step = chunk_tuple_count(size, pagesize, dtype.itemsize)
+    for start in range(0, count, step):
+        block = np.asarray(values[start:start+step], dtype=dtype)
+        first = start // pagesize
+        for i in range(0, pack_count):
+            block_flags = constant_page_flags(block[:, i*pack_size:(i+1)*pack_size], pagesize)
+            flags[i, first:first+len(block_flags)] = block_flags
+
+    if not flags.any():
+        return None
+    return list(flags)
+
+
+def packed_length(count, size, pagesize=PAGE_SIZE, packing=None, flags=None):
+    """ count個のタプルを格納したrawpagedataの要素数 """
+    if size==0 or flags is None:
+        return count*size
+
+    _, pack_size = split_packing(size, packing)
+    page_count = (count + pagesize - 1) // pagesize
+    page_lengths = np.minimum(pagesize, count - np.arange(page_count)*pagesize)
+
+    # 値がすべて同じpageは先頭のタプルだけ
+    constant = np.stack(flags)
+    return count*size - int( ((page_lengths - 1)*constant).sum() )*pack_size
+
+
+def iter_packed_pages(values, size, pagesize=PAGE_SIZE, packing=None, flags=None, dtype=None):
+    """ rawpagedataを何pageかずつ区切って返す(つなげるとpack_pagesのrawpagedataになる)
+        dtypeを指定すると区切ったものごとにその型に変換する """
+    if size==0:
+        return
+
+    values = np.asarray(values).reshape(-1, size)
+    dtype = values.dtype if dtype is None else np.dtype(dtype)
+    pack_count, pack_size = split_packing(size, packing)
+
+    # そのまま並べればいい場合
+    if flags is None and pack_count==1 and values.dtype==dtype and values.flags.c_contiguous:
+        yield values.reshape(-1)
+        return
+
+    count = len(values)
+    step = chunk_tuple_count(size, pagesize, dtype.itemsize)
+    for start in range(0, count, step):
+        block = np.asarray(values[start:start+step], dtype=dtype)
+        if flags is None and pack_count==1:
+            yield block.reshape(-1)
+            continue
+
+        block_count = len(block)
+        page_count = (block_count + pagesize - 1) // pagesize
+        first = start // pagesize
+
+        # (page, subvector, page内の番号, pack_size)に並べ替える
+        padded = np.zeros( (page_count*pagesize, size), dtype=dtype )
+        padded[:block_count] = block
+        pages = padded.reshape(page_count, pagesize, pack_count, pack_size).transpose(0, 2, 1, 3)
+
+        # 格納する要素(最後のpageの余りと、値がすべて同じpageの2番目以降を除く)
+        valid = (np.arange(page_count*pagesize) < block_count).reshape(page_count, 1, pagesize)
+        keep = np.repeat(valid, pack_count, axis=1)
+        if flags is not None:
+            constant = np.stack([ f[first:first+page_count] for f in flags ], axis=1) # (page, subvector)
+            keep[:, :, 1:] &= ~constant[:, :, None]
+
+        yield pages[keep].reshape(-1)
+
+
+def pack_pages(values, size, pagesize=PAGE_SIZE, packing=None, constant_pages=True):
+    """ valuesをpageごとに並べたrawpagedataにする
+        packingを指定すると、page内でsubvector(packingのサイズごと)が外側になるように並べる
+        値がすべて同じpageは先頭のタプルだけを格納する
+
+        (subvectorごとのconstantpageflagsのリスト(一つもなければNone), rawpagedata)を返す """
+    # 成分のないタプル(influenceのないboneCaptureなど)は格納するものがない
+    if size==0:
+        return None, np.zeros(0, dtype=np.asarray(values).dtype)
+
+    values = np.ascontiguousarray(values).reshape(-1, size)
+    pack_count, _ = split_packing(size, packing)
+
+    flags = page_flags(values, size, pagesize, packing) if constant_pages else None
+
+    # そのまま並べればいい場合
+    if flags is None and pack_count==1:
+        return None, values.reshape(-1)
+
+    chunks = list( iter_packed_pages(values, size, pagesize, packing, flags) )
+    return flags, np.concatenate(chunks) if len(chunks)>0 else np.zeros(0, dtype=values.dtype)
+
+
+def unpack_pages(rawpagedata, count, size, pagesize=PAGE_SIZE, packing=None, flags=None):
+    """ pack_pagesの逆(rawpagedataから(要素数, size)の配列を作る) """
+    if size==0:
+        return np.zeros( (count, 0), dtype=np.asarray(rawpagedata).dtype )
+
+    packing = [size] if packing is None else list(packing)
+    pack_size = packing[0]
+    pack_count = len(packing)
+
+    rawpagedata = np.asarray(rawpagedata).reshape(-1)
+    if flags is None and pack_count==1:
+        return rawpagedata.reshape(count, size)
+
+    page_count = (count + pagesize - 1) // pagesize
+
+    valid = (np.arange(page_count*pagesize) < count).reshape(page_count, 1, pagesize)
+    keep = np.repeat(valid, pack_count, axis=1)
+    if flags is not None:
+        # subvectorごとのflags(空ならすべてFalse)
+        constant = np.zeros( (page_count, pack_count), dtype=bool )
+        for i, page_flags in enumerate(flags):
+            page_flags = np.asarray(page_flags, dtype=bool)[:page_count]
+            constant[:len(page_flags), i] = page_flags
+        keep[:, :, 1:] &= ~constant[:, :, None]
+
+    pages = np.zeros( (page_count, pack_count, pagesize, pack_size), dtype=rawpagedata.dtype )
+    pages[keep] = rawpagedata.reshape(-1, pack_size)
+
+    # 値がすべて同じpageを先頭のタプルで埋める
+    if flags is not None:
+        pages[constant] = pages[constant][:, :1]
+
+    values = pages.transpose(0, 2, 1, 3).reshape(page_count*pagesize, size)
+    return values[:count]
@@ -0,0 +1,142 @@
+import collections
+import multiprocessing
+import os
+import tempfile
+
+from .bgeo_converter import BgeoConverter
+from .profiler import NULL_PROFILER
+
+
+def convert_geometry(geo_info, spool=False):
+    """ worker processで実行する変換
+        spoolがTrueなら一時ファイルに書き出してそのパスを返す(bgeoをpipeで送らない) """
+    converter = BgeoConverter()
+    if not spool:
+        return converter.convert(geo_info)
+
+    fd, path = tempfile.mkstemp(suffix=".bgeo")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            converter.convert(geo_info, f)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+class ParallelConverter:
+    """ GeometryInfoをworker processでbgeoに変換する
+        結果は登録した順番で返す
+
+        spawnではworkerでexporter.py(bpy)が読み込まれてしまうため、forkが使える環境でのみprocessを使う
+        threadが動いている間にforkしないように、worker processは最初にすべて作っておく
+        jobsが1以下かforkが使えない環境では呼び出し元のprocessでそのまま変換する """
+
+    def __init__(self, jobs=1, spool=False, profiler=None):
+        self.spool = spool # Trueなら結果をメモリに溜めずに一時ファイルに書き出す
+        self.profiler = profiler if profiler is not None else NULL_PROFILER # worker processでの変換は計測しない(待ち時間だけ)
+        self.max_pending = max(1, 2*jobs)
+        self.pending = collections.deque() # (tag, worker processでの変換(AsyncResult、変換済みならNone), 変換済みのbgeo)
+
+        # Poolは作った時点でjobs個のprocessをforkする(ProcessPoolExecutorは必要になってから作る) 
+        self.pool = None
+        if jobs>1 and "fork" in multiprocessing.get_all_start_methods():
+            self.pool = multiprocessing.get_context("fork").Pool(processes=jobs)
+
+    def submit(self, geo_info, tag):
+        """ 変換を登録して、変換済みになったものを(tag, bgeo)のリストで返す """
+
+        if self.pool is None:
+            return [ (tag, self.convert(geo_info)) ]
+
+        result = self.pool.apply_async(convert_geometry, (geo_info, self.spool))
+        self.pending.append( (tag, result, None) )
+        return self.pop_overflow()
+
+    def submit_result(self, bgeo, tag):
+        """ 変換済みのbgeo(キャッシュなど)を登録して、変換済みになったものを(tag, bgeo)のリストで返す
+            登録した順番は保たれる """
+
+        if self.pool is None:
+            return [ (tag, self.store(bgeo)) ]
+
+        self.pending.append( (tag, None, bgeo) )
+        return self.pop_overflow()
+
+    def pop_overflow(self):
+        """ 溜めすぎないように古いものから受け取る """
+        results = list()
+        while len(self.pending)>self.max_pending:
+            results.append( self.pop() )
+        return results
+
+    def flush(self):
+        """ 残りの変換結果をすべて(tag, bgeo)のリストで返す(worker processは残す) """
+        results = list()
+        while len(self.pending)>0:
+            results.append( self.pop() )
+        return results
+
+    def finish(self):
+        """ 残りの変換結果をすべて(tag, bgeo)のリストで返してworker processを終了する """
+        try:
+            return self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def terminate(self):
+        """ 残りの変換を捨ててworker processを終了する(途中で失敗した場合用) """
+        pending = self.pending
+        self.pending = collections.deque()
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        # 書き出し終わっていた一時ファイルを消す 
+        for _, result, _ in pending:
+            if self.spool and result is not None and result.ready() and result.successful():
+                try:
+                    os.remove( result.get() )
+                except OSError:
+                    pass
+
+    def pop(self):
+        tag, result, bgeo = self.pending.popleft()
+        if result is None:
+            return tag, self.store(bgeo)
+
+        with self.profiler.section("wait"):
+            bgeo = result.get()
+        if not self.spool:
+            return tag, bgeo
+
+        # workerが書き出した一時ファイルは開いてから消す(開いている間は読める) 
+        f = open(bgeo, "rb")
+        os.remove(bgeo)
+        return tag, f
+
+    def convert(self, geo_info):
+        converter = BgeoConverter(profiler=self.profiler)
+        if not self.spool:
+            return converter.convert(geo_info)
+
+        f = tempfile.TemporaryFile()
+        converter.convert(geo_info, f)
+        # 後からfstatでサイズを取れるように書き出しておく 
+        f.flush()
+        return f
+
+    def store(self, bgeo):
+        # 既にfileになっているもの(前のフレームの結果など)はそのまま 
+        if not self.spool or not isinstance(bgeo, (bytes, bytearray, memoryview)):
+            return bgeo
+
+        f = tempfile.TemporaryFile()
+        f.write(bgeo)
+        f.flush()
+        return f
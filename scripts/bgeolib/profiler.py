@@ -0,0 +1,173 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+
+class ProfileSection:
+    """ Profiler.sectionで計測する区間(抜けた後はsecondsに秒数が入る) """
+
+    __slots__ = ("profiler", "name", "args", "start", "seconds")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.profiler.enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.exit(self, time.perf_counter())
+
+
+class Profiler:
+    """ 入れ子の区間ごとの時間、カウンタ、オブジェクトごとの記録を集める
+        区間の入れ子はthreadごとに管理する
+        traceがTrueなら区間をすべて記録してChromeのtrace形式で書き出せる
+        memoryがTrueならtracemallocでピークメモリを記録する """
+
+    enabled = True
+
+    def __init__(self, trace=False, memory=False):
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.trace = trace
+        self.events = list() # (名前, 開始時刻, 秒数, thread id, args)
+
+        self.totals = OrderedDict() # 区間のパス -> [回数, 秒数]
+        self.counters = OrderedDict()
+        self.objects = OrderedDict() # オブジェクト名 -> 記録
+
+        self.memory = memory
+        self.owns_tracemalloc = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracemalloc = True
+
+    def section(self, name, **args):
+        """ withで囲んだ区間の時間を計測する """
+        return ProfileSection(self, name, args)
+
+    def stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = list()
+        return stack
+
+    def enter(self, section):
+        self.stack().append(section.name)
+
+    def exit(self, section, end):
+        stack = self.stack()
+        path = "/".join(stack)
+        stack.pop()
+
+        seconds = section.seconds = end - section.start
+        with self.lock:
+            total = self.totals.get(path)
+            if total is None:
+                total = self.totals[path] = [0, 0.0]
+            total[0] += 1
+            total[1] += seconds
+
+            if self.trace:
+                self.events.append( (section.name, section.start - self.origin, seconds, threading.get_ident(), section.args) )
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, key, **values):
+        """ オブジェクトごとの記録(数値は足し合わせる) """
+        with self.lock:
+            entry = self.objects.get(key)
+            if entry is None:
+                entry = self.objects[key] = OrderedDict()
+            for name, value in values.items():
+                if name in entry and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    entry[name] += value
+                else:
+                    entry[name] = value
+
+    def peak_memory(self):
+        if not self.memory or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[1]
+
+    def report(self):
+        """ 集計結果のdict """
+        with self.lock:
+            return {
+                "seconds": time.perf_counter() - self.origin,
+                "sections": [ {"path": path, "count": count, "seconds": seconds} for path, (count, seconds) in self.totals.items() ],
+                "counters": dict(self.counters),
+                "objects": [ dict(name=name, **entry) for name, entry in self.objects.items() ],
+                "peak_memory_bytes": self.peak_memory(),
+            }
+
+    def chrome_trace(self):
+        """ chrome://tracing, Perfettoで読めるtrace """
+        pid = os.getpid()
+        with self.lock:
+            events = [ {"name": name, "ph": "X", "ts": start*1e6, "dur": seconds*1e6, "pid": pid, "tid": tid, "args": args}
+                for name, start, seconds, tid, args in self.events ]
+            for name, value in self.counters.items():
+                events.append( {"name": name, "ph": "C", "ts": (time.perf_counter() - self.origin)*1e6, "pid": pid, "args": {"value": value}} )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path, format="json"):
+        """ formatは"json"(集計結果)か"chrome"(trace) """
+        data = self.chrome_trace() if format=="chrome" else self.report()
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def close(self):
+        if self.owns_tracemalloc:
+            tracemalloc.stop()
+            self.owns_tracemalloc = False
+
+
+class NullProfiler:
+    """ 何も記録しないProfiler(計測しない時に使う)
+        sectionは共有の何もしないcontext managerを返すだけなので、ほぼコストがかからない """
+
+    enabled = False
+
+    NULL_SECTION = contextlib.nullcontext()
+
+    def section(self, name, **args):
+        return NullProfiler.NULL_SECTION
+
+    def count(self, name, value=1):
+        pass
+
+    def record(self, key, **values):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def profiled(name):
+    """ self.profilerで区間を計測するmethodのdecorator """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.section(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+import fnmatch
+import json
+
+import numpy as np
+
+from .geo_info import STORAGE_DTYPES
+
+# 組み込みのプロファイル(ルールのリスト、attributeごとに最初に一致したルールを使う)
+#   kind: attributeの種類("color" / "normal" / "texturecoord" / "point"などのoptions、"capture"(boneCaptureのweight)、"integer" / "float")
+#   name: attribute名のパターン(fnmatch)
+#   storage: 書き出すstorage("auto"なら整数の値が収まる一番小さい型)
+#   size: 成分数をここまで減らす(削る成分がすべてtolerance以内で0の場合だけ)
+#   tolerance: storageを変えた時に許す最大の誤差(超える場合は元のstorageのまま)
+STORAGE_PROFILES = {
+    "full": [],
+    "compact": [
+        {"kind": "color", "storage": "fpreal16", "tolerance": 1e-3},
+        {"kind": "normal", "storage": "fpreal16", "tolerance": 1e-3},
+        {"kind": "capture", "storage": "fpreal16", "tolerance": 1e-3},
+        {"kind": "texturecoord", "size": 2},
+        {"kind": "integer", "storage": "auto"},
+    ],
+}
+
+# "auto"で選ぶ整数のstorage(小さい順)
+INTEGER_STORAGES = ( ("int8", -128, 127), ("uint8", 0, 255), ("int16", -32768, 32767), ("int32", -2147483648, 2147483647) )
+
+
+def attribute_kind(attrib):
+    """ ルールのkindと比べるattributeの種類 """
+    if attrib.type=="indexpair":
+        return "capture"
+    if attrib.type!="numeric":
+        return None
+    if attrib.options is not None:
+        return attrib.options
+    return "float" if attrib.storage.startswith("fpreal") else "integer"
+
+
+def narrow_values(values, storage, target, tolerance=0.0):
+    """ valuesをtargetのstorageに変換した配列(誤差がtoleranceを超える、範囲に収まらない場合はNone)
+        targetが"auto"なら整数の値が収まる一番小さい型にする
+        (変換後のstorage, 配列)を返す """
+    values = np.asarray(values)
+    is_float = storage.startswith("fpreal")
+
+    if target=="auto":
+        if is_float or values.size==0:
+            return None
+        min_value = int( values.min() )
+        max_value = int( values.max() )
+        target = next( (name for name, low, high in INTEGER_STORAGES if low<=min_value and max_value<=high), None )
+        if target is None:
+            return None
+
+    dtype = STORAGE_DTYPES[target]
+    if dtype.itemsize>=values.dtype.itemsize or target.startswith("fpreal")!=is_float:
+        return None
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        converted = values.astype(dtype)
+        error = np.abs( converted.astype(np.float64) - values ) if is_float else None
+
+    # infやnanになったもの(fpreal16の範囲を超えたものなど)もここで外れる
+    if is_float and not np.all(error<=tolerance):
+        return None
+    if not is_float and not np.array_equal(converted, values):
+        return None
+
+    return target, converted
+
+
+class StoragePolicy:
+    """ attributeごとにstorageや成分数を選ぶルール
+        ルールのリストか、組み込みのプロファイル名/JSONファイルから作る """
+
+    def __init__(self, rules=()):
+        self.rules = list()
+        for rule in rules:
+            storage = rule.get("storage")
+            if storage is not None and storage!="auto" and storage not in STORAGE_DTYPES:
+                raise ValueError("Unknown storage {}.".format(storage))
+            self.rules.append( dict(rule) )
+
+    @staticmethod
+    def load(profile):
+        """ profileは組み込みのプロファイル名か、ルールのリスト({"rules": [...]}でもよい)を書いたJSONファイルのパス """
+        if profile in STORAGE_PROFILES:
+            return StoragePolicy(STORAGE_PROFILES[profile])
+
+        with open(profile, "r") as f:
+            data = json.load(f)
+        return StoragePolicy( data["rules"] if isinstance(data, dict) else data )
+
+    def find_rule(self, attrib):
+        kind = attribute_kind(attrib)
+        for rule in self.rules:
+            if "kind" in rule and rule["kind"]!=kind:
+                continue
+            if "name" in rule and not fnmatch.fnmatchcase(attrib.name, rule["name"]):
+                continue
+            return rule
+        return None
+
+    def apply(self, geo_info):
+        """ geo_infoのattributeのstorage, 成分数をルールに合わせて変える
+            変えたattributeの(class, 名前, storage, size)のリストを返す """
+        changed = list()
+        if len(self.rules)==0:
+            return changed
+
+        for attrib_class, attributes in ( ("point", geo_info.point_attributes),
+            ("vertex", geo_info.vertex_attributes), ("primitive", geo_info.primitive_attributes) ):
+
+            for attrib in attributes:
+                rule = self.find_rule(attrib)
+                if rule is None:
+                    continue
+
+                if attrib.type=="indexpair":
+                    storage = self.apply_capture(attrib.values, rule)
+                    if storage is not None:
+                        changed.append( (attrib_class, attrib.name, storage, attrib.values.influence_count()) )
+                elif attrib.type=="numeric" and isinstance(attrib.values, np.ndarray):
+                    if self.apply_numeric(attrib, rule):
+                        changed.append( (attrib_class, attrib.name, attrib.storage, attrib.size) )
+
+        return changed
+
+    def apply_numeric(self, attrib, rule):
+        tolerance = rule.get("tolerance", 0.0)
+        changed = False
+
+        # 後ろの成分が0なら削る(UVの3成分目など)
+        size = rule.get("size")
+        if size is not None and 0<size<attrib.size:
+            values = attrib.values.reshape(-1, attrib.size)
+            if np.all( np.abs(values[:, size:])<=tolerance ):
+                values = np.ascontiguousarray(values[:, :size])
+                attrib.values = values if size>1 else values.reshape(-1)
+                attrib.size = size
+                changed = True
+
+        storage = rule.get("storage")
+        if storage is not None:
+            narrowed = narrow_values(attrib.values, attrib.storage, storage, tolerance)
+            if narrowed is not None:
+                attrib.storage, attrib.values = narrowed
+                changed = True
+
+        return changed
+
+    def apply_capture(self, capture, rule):
+        """ boneCaptureのweightのstorageを変える(変えたらそのstorage、変えなければNone) """
+        storage = rule.get("storage")
+        if storage is None:
+            return None
+
+        narrowed = narrow_values(capture.weights, capture.weight_storage, storage, rule.get("tolerance", 0.0))
+        if narrowed is None:
+            return None
+
+        capture.weight_storage, capture.weights = narrowed
+        return capture.weight_storage
@@ -2,61 +2,130 @@
 # "C:\Program Files\Blender Foundation\Blender 4.3\blender.exe" --background test.blend --python script.py
 
 import bpy
+import bmesh
 from bpy_extras.io_utils import axis_conversion
 from mathutils import Matrix
 
 import numpy as np
 
+import argparse
+import hashlib
+import itertools
+import logging
 import os
+import re
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(__file__))
+from bgeolib.geo_info import BoneCaptureInfo
 from bgeolib.geo_info import CurvePrimInfo
 from bgeolib.geo_info import PackedGeoInfo
 from bgeolib.geo_info import GeometryAttribute
 from bgeolib.geo_info import EdgeGroup
+from bgeolib.geo_info import ElementGroup
 from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import promote_values
 from bgeolib.bgeo_converter import BgeoConverter
-
-def get_outliner_path(ob):
-    """ アウトライナーでのパスを取得 """
-
-    def get_parent_collection(ob):
+from bgeolib.bgeo_writer import BinaryJsonWriter
+from bgeolib.parallel_converter import ParallelConverter
+from bgeolib.embed_registry import EmbedRegistry
+from bgeolib.conversion_cache import ConversionCache
+from bgeolib.conversion_cache import update_hash
+from bgeolib.bgeo_template import BgeoTemplate
+from bgeolib.storage_policy import STORAGE_PROFILES
+from bgeolib.storage_policy import StoragePolicy
+from bgeolib.profiler import NULL_PROFILER
+from bgeolib.profiler import Profiler
+
+# 変換結果が変わる修正をしたら上げる(キャッシュのkeyに使う) 
+EXPORTER_VERSION = "1"
+
+# --profileを指定した時に各段階の時間や数を記録する 
+profiler = NULL_PROFILER
+
+# 進捗やcacheの統計(--verboseの時だけstderrに出す) 
+logger = logging.getLogger("bgeo_exporter")
+
+class OutlinerIndex:
+    """ アウトライナーでの親子関係を一度だけ調べておき、パスを親の数に比例した時間で引けるようにする
+        (object, collection -> それを含む最初のcollection、求めたパスも覚えておく) """
+
+    def __init__(self, scene=None):
+        self.root_collection = (scene if scene is not None else bpy.context.scene).collection
+
+        # as_pointer() -> それを含むcollection(bpy.data.collectionsで最初に見つかるもの)
+        self.parent_collections = dict()
         for collection in bpy.data.collections:
             for obj in collection.objects:
-                if ob == obj:
-                    return collection
+                self.parent_collections.setdefault(obj.as_pointer(), collection)
             for child in collection.children:
-                if child == ob:
-                    return collection
-        
-        return None
+                self.parent_collections.setdefault(child.as_pointer(), collection)
 
+        self.collection_paths = dict()
+        self.object_paths = dict()
 
-    root_collection = bpy.context.scene.collection
-    path = ob.name
-    
-    search_target = ob
-    parent = ob.parent
-    
-    while parent:
-        path = parent.name + "/" + path
-        search_target = parent
-        parent = parent.parent
+    def get_parent_collection(self, ob):
+        return self.parent_collections.get(ob.as_pointer())
+
+    def get_collection_path(self, collection):
+        """ collectionまでのパス(root collectionなら空文字列) """
+        if collection is None or collection==self.root_collection:
+            return ""
+
+        key = collection.as_pointer()
+        path = self.collection_paths.get(key)
+        if path is None:
+            parent_path = self.get_collection_path( self.get_parent_collection(collection) )
+            path = parent_path + "/" + collection.name if parent_path else collection.name
+            self.collection_paths[key] = path
+        return path
+
+    def get_outliner_path(self, ob):
+        """ アウトライナーでのパスを取得 """
+        key = ob.as_pointer()
+        path = self.object_paths.get(key)
+        if path is not None:
+            return path
+
+        path = ob.name
+
+        search_target = ob
+        parent = ob.parent
+
+        while parent:
+            path = parent.name + "/" + path
+            search_target = parent
+            parent = parent.parent
+
+        collection_path = self.get_collection_path( self.get_parent_collection(search_target) )
+        if collection_path:
+            path = collection_path + "/" + path
 
-    collection = get_parent_collection(search_target)
-    while collection and collection!=root_collection:
-        path = collection.name + "/" + path
-        collection = get_parent_collection(collection)
+        self.object_paths[key] = path
+        return path
 
-    return path
+
+def get_outliner_path(ob, outliner_index=None):
+    """ アウトライナーでのパスを取得(たくさん調べる場合はOutlinerIndexを使い回す) """
+    if outliner_index is None:
+        outliner_index = OutlinerIndex()
+    return outliner_index.get_outliner_path(ob)
+
+def get_evaluated_object(ob):
+    """ modifierを適用したオブジェクト(必要ならdepsgraphを評価する) """
+    with profiler.section("evaluate"):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        return ob.evaluated_get(depsgraph)
 
 def get_mesh_from_object(ob):
     """ オブジェクトからメッシュを取得 """
-    try:
-        me = ob.to_mesh()
-    except RuntimeError:
-        me = None
+    with profiler.section("to_mesh"):
+        try:
+            me = ob.to_mesh()
+        except RuntimeError:
+            me = None
 
     return me
 
@@ -244,7 +313,7 @@ def convert_nurbs_curve(geo, spline, axis_conv_matrix):
 
 
 def convert_curve(obj, axis_conv_matrix):
-    """ CURVEをbgeoに変換 """
+    """ CURVEをGeometryInfoに変換 """
     geo = GeometryInfo()
 
     for s in obj.data.splines:
@@ -258,9 +327,8 @@ def convert_curve(obj, axis_conv_matrix):
 
     if len(geo.curves)==0:
         return None
-            
-    converter = BgeoConverter()
-    return converter.convert(geo)
+
+    return geo
 
 def convet_armature(obj, axis_conv_matrix):
     """ ARMATURE """
@@ -307,18 +375,290 @@ def convet_armature(obj, axis_conv_matrix):
     geo.point_attributes.append(transform_attrib)
     geo.point_attributes.append(length_attrib)
 
-    converter = BgeoConverter()
-    return converter.convert(geo)
+    return geo
+
+
+def foreach_get_array(collection, prop, dtype, size=1):
+    """ foreach_getでcollectionのプロパティをまとめてnumpy配列に取得 """
+    values = np.empty(len(collection) * size, dtype=dtype)
+    if len(values)>0:
+        collection.foreach_get(prop, values)
+    return values.reshape(-1, size) if size>1 else values
 
+def get_reversed_loop_order(me):
+    """ 面の向きを逆にしたloopの並び(先頭はそのまま、残りを逆順)とpolygonごとのloop数 """
+    loop_starts = foreach_get_array(me.polygons, "loop_start", np.int32).astype(np.int64)
+    loop_totals = foreach_get_array(me.polygons, "loop_total", np.int32)
 
-def convert_mesh(obj, axis_conv_matrix):
-    """ メッシュとしてbgeoに変換 """
+    # 出力側でのpolygon先頭からの位置 
+    offsets = np.cumsum(loop_totals, dtype=np.int64) - loop_totals
+    local_index = np.arange(loop_totals.sum(dtype=np.int64), dtype=np.int64) - np.repeat(offsets, loop_totals)
+
+    # 0番目はそのまま、1番目以降は loop_total-i 番目を参照する 
+    totals = np.repeat(loop_totals, loop_totals)
+    local_index = np.where(local_index==0, 0, totals - local_index)
+
+    loop_order = np.repeat(loop_starts, loop_totals) + local_index
+    return loop_order, loop_totals
+
+def get_corner_normals(me):
+    """ loopごとの法線 """
+    if hasattr(me, "corner_normals"): # 4.1以降 
+        return foreach_get_array(me.corner_normals, "vector", np.float32, 3)
+    return foreach_get_array(me.loops, "normal", np.float32, 3)
+
+def gather_vertex_group_weights(me):
+    """ 影響のある(point番号, group番号, weight)の組み合わせだけをpoint順に集める
+        MeshのRNA(v.groups)では1要素ずつ属性を読むことになるので、bmeshのdeform layerからpointごとにまとめて読む """
+    bm = bmesh.new()
+    try:
+        bm.from_mesh(me)
+        layer = bm.verts.layers.deform.active
+        items = [ v[layer].items() for v in bm.verts ] if layer is not None else list()
+    finally:
+        bm.free()
+
+    counts = np.fromiter( map(len, items), dtype=np.int64, count=len(items) )
+    total = int(counts.sum())
+
+    # (group番号, weight)の組をまとめて配列にする 
+    pairs = np.fromiter( itertools.chain.from_iterable(itertools.chain.from_iterable(items)), dtype=np.float64, count=2*total ).reshape(-1, 2)
+    point_indices = np.repeat( np.arange(len(items), dtype=np.int64), counts )
+
+    return point_indices, pairs[:, 0].astype(np.int32), pairs[:, 1].astype(np.float32)
+
+def get_deform_group_indices(obj):
+    """ Armature(modifierかArmatureの親)の変形に使うboneと同じ名前のvertex groupの番号 """
+    armatures = [ modifier.object for modifier in obj.modifiers
+        if modifier.type=="ARMATURE" and modifier.object is not None and modifier.use_vertex_groups ]
+    if obj.parent is not None and obj.parent_type=="ARMATURE":
+        armatures.append(obj.parent)
+
+    bone_names = set()
+    for armature in armatures:
+        bone_names.update( bone.name for bone in armature.data.bones if bone.use_deform )
+
+    return [ i for i, group in enumerate(obj.vertex_groups) if group.name in bone_names ]
+
+def select_vertex_groups(obj, gathered, groups):
+    """ gather_vertex_group_weightsの結果からgroupsのgroup番号のものだけにして、番号をgroupsでの位置にする """
+    point_indices, group_indices, group_weights = gathered
+
+    # 範囲外の番号(消されたgroupのもの)も外す 
+    positions = np.full(len(obj.vertex_groups) + 1, -1, dtype=np.int64)
+    positions[ np.asarray(groups, dtype=np.int64) ] = np.arange(len(groups), dtype=np.int64)
+    group_positions = positions[ np.where(group_indices<len(obj.vertex_groups), group_indices, len(obj.vertex_groups)) ]
+
+    selected = group_positions>=0
+    return point_indices[selected], group_positions[selected], group_weights[selected]
+
+def get_vertex_group_weights(obj, me, groups=None, gathered=None):
+    """ vertex groupごとのweightを(group数, point数)の配列で取得
+        groupsを指定するとそのgroup番号のものだけ、gatheredにはgather_vertex_group_weightsの結果を渡せる """
+    if groups is None:
+        groups = range(0, len(obj.vertex_groups))
+    weights = np.zeros( (len(groups), len(me.vertices)), dtype=np.float32 )
+    if len(groups)==0:
+        return weights
+
+    # 影響のある組み合わせだけ集めてからまとめて代入 
+    if gathered is None:
+        gathered = gather_vertex_group_weights(me)
+    point_indices, group_positions, group_weights = select_vertex_groups(obj, gathered, groups)
+    weights[group_positions, point_indices] = group_weights
+    return weights
+
+def get_vertex_group_capture(obj, me, groups, gathered=None):
+    """ groupsのgroup番号のvertex groupのweightをboneCapture(pCaptPathがgroup名)として取得
+        boneに合わせたcaptureの行列は求めていないので単位行列(weightだけ) """
+    capture = BoneCaptureInfo()
+    capture.bone_names = [ obj.vertex_groups[i].name for i in groups ]
+    capture.bone_matrices = np.tile( np.eye(4, dtype=np.float32), (len(groups), 1, 1) )
+
+    if gathered is None:
+        gathered = gather_vertex_group_weights(me)
+    point_indices, group_positions, group_weights = select_vertex_groups(obj, gathered, groups)
+    counts = np.bincount(point_indices, minlength=len(me.vertices))
+    capture.set_csr(counts, group_positions.astype(np.int32), group_weights)
+    return capture
+
+
+def get_houdini_name(name):
+    """ Blenderの名前からHoudiniで使えるグループ名、attribute名を作る """
+    name = re.sub(r"[^0-9A-Za-z_]", "_", name)
+    return "_" + name if name[:1].isdigit() or name=="" else name
+
+def add_element_group(groups, name, selection):
+    """ 一つ以上含まれていればpoint/primitiveグループを追加(同じ名前のグループがあれば追加しない) """
+    if not np.any(selection) or any( group.name==name for group in groups ):
+        return
+    group = ElementGroup()
+    group.name = name
+    group.selection = np.ascontiguousarray(selection, dtype=bool)
+    groups.append(group)
+
+def add_edge_group(groups, name, selection, edge_vertices):
+    """ 一つ以上含まれていればエッジグループを追加(同じ名前のグループがあれば追加しない) """
+    if not np.any(selection) or any( group.name==name for group in groups ):
+        return
+    group = EdgeGroup()
+    group.name = name
+    group.points = edge_vertices[selection].reshape(-1)
+    groups.append(group)
+
+# グループにしないBOOLEANのattribute(ほかの方法で出力するもの) 
+GROUP_EXCLUDED_ATTRIBUTES = ("sharp_edge", "sharp_face")
+
+def convert_mesh_groups(geo, obj, me, selection_groups=False):
+    """ meのseam/sharpのエッジ、BOOLEANのattribute、face mapをグループにして追加する
+        selection_groupsがTrueなら選択されたpoint/primitive/エッジを"selected"グループにする """
+    edge_vertices = foreach_get_array(me.edges, "vertices", np.int32, 2)
+
+    add_edge_group(geo.edge_groups, "seams", foreach_get_array(me.edges, "use_seam", bool), edge_vertices)
+    add_edge_group(geo.edge_groups, "sharp", foreach_get_array(me.edges, "use_edge_sharp", bool), edge_vertices)
+
+    if selection_groups:
+        add_element_group(geo.point_groups, "selected", foreach_get_array(me.vertices, "select", bool))
+        add_element_group(geo.primitive_groups, "selected", foreach_get_array(me.polygons, "select", bool))
+        add_edge_group(geo.edge_groups, "selected", foreach_get_array(me.edges, "select", bool), edge_vertices)
+
+    # BOOLEANのattribute("."で始まるのはBlender内部のもの) 
+    for attribute in me.attributes:
+        if attribute.data_type!="BOOLEAN" or attribute.name.startswith(".") or attribute.name in GROUP_EXCLUDED_ATTRIBUTES:
+            continue
+
+        name = get_houdini_name(attribute.name)
+        if attribute.domain=="POINT":
+            add_element_group(geo.point_groups, name, foreach_get_array(attribute.data, "value", bool))
+        elif attribute.domain=="FACE":
+            add_element_group(geo.primitive_groups, name, foreach_get_array(attribute.data, "value", bool))
+        elif attribute.domain=="EDGE":
+            add_edge_group(geo.edge_groups, name, foreach_get_array(attribute.data, "value", bool), edge_vertices)
+
+    # face map(4.0より前、以降はFACEのBOOLEANのattributeになっている) 
+    face_maps = getattr(obj, "face_maps", None)
+    if face_maps is not None and len(face_maps)>0 and len(getattr(me, "face_maps", []))>0:
+        face_map_indices = foreach_get_array(me.face_maps[0].data, "value", np.int32)
+        for i, face_map in enumerate(face_maps):
+            add_element_group(geo.primitive_groups, get_houdini_name(face_map.name), face_map_indices==i)
+
+
+# me.attributesのdata_typeごとの(foreach_getするproperty, 成分数, 取得する型, storage, options)
+# FLOAT_COLOR, BYTE_COLORはcolor_attributes、FLOAT2のUVはuv_layersとして出力する
+MESH_ATTRIBUTE_TYPES = {
+    "FLOAT": ("value", 1, np.float32, "fpreal32", None),
+    "INT": ("value", 1, np.int32, "int32", None),
+    "INT8": ("value", 1, np.int32, "int8", None),
+    "INT32_2D": ("value", 2, np.int32, "int32", None),
+    "FLOAT2": ("vector", 2, np.float32, "fpreal32", None),
+    "FLOAT_VECTOR": ("vector", 3, np.float32, "fpreal32", "vector"),
+    "QUATERNION": ("value", 4, np.float32, "fpreal32", "quaternion"),
+    "BOOLEAN": ("value", 1, bool, "int8", None),
+    "STRING": ("value", 1, object, None, None), # foreach_getは使えない 
+}
+
+# 別に出力しているので汎用のattributeとしては出力しないもの 
+MESH_ATTRIBUTE_EXCLUDED = ("position", "material_index", "sharp_edge", "sharp_face")
+
+def get_corner_edge_indices(me, loop_order, loop_totals):
+    """ 出力するvertexごとの、polygon内で次のvertexへ向かうエッジの番号
+        (面の向きを逆にしているので、元のloopでは一つ後ろの出力vertexのloopのedge_indexになる) """
+    edge_indices = foreach_get_array(me.loops, "edge_index", np.int32)
+
+    totals = np.repeat(loop_totals, loop_totals).astype(np.int64)
+    offsets = np.repeat( np.cumsum(loop_totals, dtype=np.int64) - loop_totals, loop_totals )
+    local_index = np.arange(len(loop_order), dtype=np.int64) - offsets
+    next_positions = offsets + (local_index + 1) % totals
+
+    return edge_indices[ loop_order[next_positions] ]
+
+def quaternion_multiply(a, b):
+    """ (w, x, y, z)のクォータニオンの配列同士の積 """
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([
+        aw*bw - ax*bx - ay*by - az*bz,
+        aw*bx + ax*bw + ay*bz - az*by,
+        aw*by - ax*bz + ay*bw + az*bx,
+        aw*bz + ax*by - ay*bx + az*bw ], axis=-1)
+
+def convert_mesh_attributes(geo, me, axis_conv_matrix, loop_order, loop_totals):
+    """ me.attributesのうち、ほかで出力していないものをdata_typeに合わせたattributeとして追加する
+        POINT -> point、CORNER -> vertex(loop_orderで並べ替え)、FACE -> primitive
+        EDGE -> vertex(vertexから次のvertexへ向かうエッジの値)
+        BOOLEANはCORNERのものだけ(ほかはconvert_mesh_groupsでグループにする) """
+    excluded = set(MESH_ATTRIBUTE_EXCLUDED)
+    excluded.update( uv_layer.name for uv_layer in me.uv_layers )
+    excluded.update( color_attribute.name for color_attribute in me.color_attributes )
+
+    # ベクトルはPと同じようにY-upに回転する 
+    matrix = np.array(axis_conv_matrix, dtype=np.float64)
+    rotation = matrix[:3, :3].T
+    axis_quaternion = np.array(axis_conv_matrix.to_quaternion(), dtype=np.float64)
+    axis_quaternion_inverse = axis_quaternion * np.array([1.0, -1.0, -1.0, -1.0])
+
+    corner_edge_indices = None
+
+    for attribute in me.attributes:
+        if attribute.name.startswith(".") or attribute.name in excluded:
+            continue
+
+        attribute_type = MESH_ATTRIBUTE_TYPES.get(attribute.data_type)
+        if attribute_type is None or (attribute.data_type=="BOOLEAN" and attribute.domain!="CORNER"):
+            continue
+        prop, size, dtype, storage, options = attribute_type
+
+        if attribute.domain=="POINT":
+            attrib_list, order = geo.point_attributes, None
+        elif attribute.domain=="CORNER":
+            attrib_list, order = geo.vertex_attributes, loop_order
+        elif attribute.domain=="FACE":
+            attrib_list, order = geo.primitive_attributes, None
+        elif attribute.domain=="EDGE":
+            if corner_edge_indices is None:
+                corner_edge_indices = get_corner_edge_indices(me, loop_order, loop_totals)
+            attrib_list, order = geo.vertex_attributes, corner_edge_indices
+        else:
+            continue
+
+        name = get_houdini_name(attribute.name)
+        if name in attrib_list:
+            continue
+
+        # 文字列はforeach_getで取れないので、値の種類ごとの番号にしてから並べ替える 
+        if attribute.data_type=="STRING":
+            strings, codes = np.unique( np.array([ getattr(data, prop) for data in attribute.data ], dtype=dtype), return_inverse=True )
+            attrib = GeometryAttribute.string(name)
+            attrib.values.extend_codes(codes if order is None else codes[order], strings.tolist())
+            attrib_list.append(attrib)
+            continue
+
+        values = foreach_get_array(attribute.data, prop, dtype, size)
+        if order is not None:
+            values = values[order]
+
+        if attribute.data_type=="FLOAT_VECTOR":
+            values = values @ rotation
+        elif attribute.data_type=="QUATERNION":
+            # 座標系を変換して、Houdiniの(x, y, z, w)の順にする 
+            values = quaternion_multiply( quaternion_multiply(axis_quaternion, values), axis_quaternion_inverse )
+            values = values[:, [1, 2, 3, 0]]
+
+        attrib = GeometryAttribute.numeric(name, size, storage)
+        attrib.options = options
+        attrib.set_array(values)
+        attrib_list.append(attrib)
+
+
+def convert_mesh(obj, axis_conv_matrix, vertex_group_mode="dense", selection_groups=False):
+    """ メッシュとしてGeometryInfoに変換
+        vertex_group_mode: "capture"ならboneCaptureにまとめる、"dense"ならgroupごとのfloat attribute、"none"なら出力しない
+        selection_groups: Trueなら選択状態を"selected"グループとして出力する """
 
     geo = GeometryInfo()
 
     # modifierを適用 
-    depsgraph = bpy.context.evaluated_depsgraph_get()  
-    eval_ob = obj.evaluated_get(depsgraph)
+    eval_ob = get_evaluated_object(obj)
     me = get_mesh_from_object(eval_ob)
     if me is None:
         return None
@@ -327,60 +667,61 @@ def convert_mesh(obj, axis_conv_matrix):
     
     # P
     p_attrib = GeometryAttribute.point() 
-    p_attrib.values = [ v.co[:] for v in me.vertices]
+    p_attrib.values = foreach_get_array(me.vertices, "co", np.float32, 3)
 
     geo.point_attributes.append(p_attrib)
 
     # vertex_group
-    vg_attribs = list()
-    for group in obj.vertex_groups:
-        vg_attrib = GeometryAttribute.numeric(group.name) 
-        vg_attrib.values = np.zeros(geo.point_count())
-        vg_attribs.append(vg_attrib)
+    if len(obj.vertex_groups)>0 and vertex_group_mode!="none":
+        gathered = gather_vertex_group_weights(me)
+
+        # captureでもboneの変形に使わないgroupはgroupごとのfloat attributeにする 
+        capture_groups = get_deform_group_indices(obj) if vertex_group_mode=="capture" else list()
+        dense_groups = sorted( set(range(0, len(obj.vertex_groups))) - set(capture_groups) )
+
+        vg_weights = get_vertex_group_weights(obj, me, dense_groups, gathered)
+        for i, weights in zip(dense_groups, vg_weights):
+            vg_attrib = GeometryAttribute.numeric(obj.vertex_groups[i].name) 
+            vg_attrib.values = weights
+            geo.point_attributes.append(vg_attrib)
+
+        # weightのあるpointが一つもなければboneCaptureは書き出さない 
+        if len(capture_groups)>0:
+            capture = get_vertex_group_capture(obj, me, capture_groups, gathered)
+            if capture.influence_count()>0:
+                capture_attrib = GeometryAttribute.bonecapture()
+                capture_attrib.values = capture
+                geo.point_attributes.append(capture_attrib)
+
+    # 面の向きを逆にした並び順で取得 
+    loop_order, loop_totals = get_reversed_loop_order(me)
+    loop_vertex_indices = foreach_get_array(me.loops, "vertex_index", np.int32)
+
+    geo.indices = loop_vertex_indices[loop_order]
+    geo.loop_counts = loop_totals
 
-    for i, v in enumerate(me.vertices):
-        for g in v.groups:
-            vg_attribs[g.group].values[i] = g.weight
-
-    geo.point_attributes.extend(vg_attribs)
-    
     n_attrib = GeometryAttribute.normal()
-    uv_attribs = [ GeometryAttribute.texturecoord(uv_layer.name) for uv_layer in me.uv_layers ]
-    material_name_attrib = GeometryAttribute.string("material_name") 
-
-    materials = me.materials[:]
-    for polygon in me.polygons:
-        loop_start = polygon.loop_start
-        loop_total = polygon.loop_total
-        # 面の向きを逆に
-        loop_indices = list()
-        if loop_total>0:
-            loop_indices.append(loop_start)
-        for i in range(loop_total-1, 0, -1):
-            loop_indices.append(loop_start+i)
-
-        for loop_index in loop_indices:
-            loop = me.loops[loop_index]
-
-            geo.indices.append(loop.vertex_index)
-            n_attrib.values.append(loop.normal[:])
+    n_attrib.values = get_corner_normals(me)[loop_order]
 
-            for i, uv_layer in enumerate(me.uv_layers):
-                uv = uv_layer.data[loop_index].uv[:] if uv_layer.data else [ 0.0, 0.0 ]
-                uv_attribs[i].values.append( [ uv[0], uv[1], 0.0 ] )
+    for uv_layer in me.uv_layers:
+        uv_attrib = GeometryAttribute.texturecoord(uv_layer.name)
+        uv_values = np.zeros( (len(loop_order), 3), dtype=np.float32 )
+        if uv_layer.data:
+            uv_values[:, :2] = foreach_get_array(uv_layer.data, "uv", np.float32, 2)[loop_order]
+        uv_attrib.values = uv_values
+        geo.vertex_attributes.append(uv_attrib)
 
-        geo.loop_counts.append(loop_total)
-
-        # material 
-        material = materials[polygon.material_index] if 0<=polygon.material_index and polygon.material_index<len(materials) else None 
-        material_name = material.name if material is not None else None
-
-        material_name_attrib.values.append(material_name)
-
-    geo.vertex_attributes.extend(uv_attribs)
     if len(n_attrib.values)>0:
         geo.vertex_attributes.append(n_attrib)
 
+    # material 
+    materials = me.materials[:]
+    material_names = [ material.name if material is not None else None for material in materials ]
+    material_indices = foreach_get_array(me.polygons, "material_index", np.int32)
+
+    material_name_attrib = GeometryAttribute.string("material_name") 
+    material_name_attrib.values.extend_codes(material_indices, material_names)
+
     if len(material_name_attrib.values.string_list)>0:
         geo.primitive_attributes.append(material_name_attrib)
 
@@ -388,48 +729,121 @@ def convert_mesh(obj, axis_conv_matrix):
     # print(me.color_attributes)
     for color_attribute in me.color_attributes:
         color_attrib = GeometryAttribute.color(color_attribute.name)
-        color_attrib.values = [ d.color[:3] for d in color_attribute.data ]
-        # color_attrib.values = [ d.color_srgb[:3] for d in color_attribute.data ]
+        color_values = foreach_get_array(color_attribute.data, "color", np.float32, 4)[:, :3]
+        # color_values = foreach_get_array(color_attribute.data, "color_srgb", np.float32, 4)[:, :3]
         if color_attribute.domain=="POINT":
+            color_attrib.values = np.ascontiguousarray(color_values)
             geo.point_attributes.append(color_attrib)
         elif color_attribute.domain=="CORNER":
+            color_attrib.values = color_values[loop_order]
             geo.vertex_attributes.append(color_attrib)
 
-    # Edge group
-    seams_edges = [ edge for edge in me.edges if edge.use_seam ]
-    if len(seams_edges)>0:
-        seams_group = EdgeGroup()
-        seams_group.name = "seams"
-        for edge in seams_edges:
-            seams_group.points.extend(edge.vertices)
-        geo.edge_groups.append(seams_group)
-    
-    sharp_edges = [ edge for edge in me.edges if edge.use_edge_sharp ]
-    if len(sharp_edges)>0:
-        sharp_group = EdgeGroup()
-        sharp_group.name = "sharp"
-        for edge in sharp_edges:
-            sharp_group.points.extend(edge.vertices)
-        geo.edge_groups.append(sharp_group)
+    # そのほかのattribute(geometry nodesなどで作ったもの) 
+    convert_mesh_attributes(geo, me, axis_conv_matrix, loop_order, loop_totals)
 
+    # point/primitive/edge group
+    convert_mesh_groups(geo, obj, me, selection_groups)
 
     eval_ob.to_mesh_clear()
 
     if geo.primitive_count()==0:
         return None
 
-    converter = BgeoConverter()
-    return converter.convert(geo)
+    return geo
+
+
+def get_topology_key(me):
+    """ 頂点数、polygonごとのloop数、loopの頂点番号から作るトポロジーのhash """
+    h = hashlib.sha1()
+    h.update( np.int64(len(me.vertices)).tobytes() )
+    h.update( foreach_get_array(me.polygons, "loop_total", np.int32).tobytes() )
+    h.update( foreach_get_array(me.loops, "vertex_index", np.int32).tobytes() )
+    return h.hexdigest()
+
+
+def get_delta_values(me, template, promote_tolerance=None):
+    """ テンプレートに差し込むP, Nの値((attribute class, 名前) -> 配列)
+        テンプレートでNをpoint/primitiveに移している場合、そのclassで一定でなくなっていたらNone """
+    values = dict()
+    values[("point", "P")] = foreach_get_array(me.vertices, "co", np.float32, 3)
+
+    n_key = next( (key for key in ( ("vertex", "N"), ("point", "N"), ("primitive", "N") ) if key in template.slots), None )
+    if n_key is None:
+        return values
+
+    loop_order, loop_totals = get_reversed_loop_order(me)
+    normals = get_corner_normals(me)[loop_order]
+
+    if n_key[0]=="vertex":
+        values[n_key] = normals
+        return values
+
+    if n_key[0]=="point":
+        element_indices = foreach_get_array(me.loops, "vertex_index", np.int32)[loop_order]
+        element_count = len(me.vertices)
+    else:
+        element_indices = np.repeat( np.arange(len(loop_totals), dtype=np.int64), loop_totals )
+        element_count = len(loop_totals)
+
+    element_normals = promote_values(normals, element_indices, element_count, promote_tolerance or 0.0)
+    if element_normals is None:
+        return None
+
+    values[n_key] = element_normals
+    return values
+
+
+def convert_mesh_delta(obj, axis_conv_matrix, templates, vertex_group_mode="dense", promote_tolerance=None, storage_policy=None, selection_groups=False):
+    """ 形だけが変わるメッシュ用の変換
+        前のフレームとトポロジーが同じならP, Nだけを取得してtemplatesに覚えたテンプレートに差し込む
+        promote_toleranceを指定するとテンプレートを作る時にvertex attributeをpoint/primitiveに移す
+        storage_policyを指定するとテンプレートを作る時にstorageを選ぶ(差し込む値はそのstorageに変換される)
+        (BgeoTemplate, (attribute class, 名前) -> 配列)を返す """
+
+    # modifierを適用 
+    eval_ob = get_evaluated_object(obj)
+    me = get_mesh_from_object(eval_ob)
+    if me is None:
+        templates.pop(obj.name_full, None)
+        return None
+
+    topology_key = get_topology_key(me)
+    template_entry = templates.get(obj.name_full)
+
+    values = None
+    if template_entry is not None and template_entry[0]==topology_key:
+        template = template_entry[1]
+        me.transform(axis_conv_matrix)
+        values = get_delta_values(me, template, promote_tolerance)
+
+    eval_ob.to_mesh_clear()
+
+    if values is not None:
+        return template, values
+
+    # トポロジーが変わったら(Nを移したclassで一定でなくなった場合も)すべて変換し直してテンプレートを作る 
+    geo = convert_mesh(obj, axis_conv_matrix, vertex_group_mode, selection_groups)
+    if geo is None:
+        templates.pop(obj.name_full, None)
+        return None
+
+    if promote_tolerance is not None:
+        geo.promote_vertex_attributes(promote_tolerance)
+    if storage_policy is not None:
+        storage_policy.apply(geo)
+
+    template = BgeoTemplate(geo)
+    templates[obj.name_full] = (topology_key, template)
+    return template, dict()
 
 
 def convert_mesh_shapekey(obj, axis_conv_matrix):
-    """ メッシュとしてbgeoに変換(ブレンドシェイプ用に最小構成) """
+    """ メッシュとしてGeometryInfoに変換(ブレンドシェイプ用に最小構成) """
 
     geo = GeometryInfo()
 
     # modifierを適用 
-    depsgraph = bpy.context.evaluated_depsgraph_get()  
-    eval_ob = obj.evaluated_get(depsgraph)
+    eval_ob = get_evaluated_object(obj)
     me = get_mesh_from_object(eval_ob)
     if me is None:
         return None
@@ -438,29 +852,18 @@ def convert_mesh_shapekey(obj, axis_conv_matrix):
     
     # P
     p_attrib = GeometryAttribute.point() 
-    p_attrib.values = [ v.co[:] for v in me.vertices]
+    p_attrib.values = foreach_get_array(me.vertices, "co", np.float32, 3)
     geo.point_attributes.append(p_attrib)
 
-    n_attrib = GeometryAttribute.normal()
-    
-    for polygon in me.polygons:
-        loop_start = polygon.loop_start
-        loop_total = polygon.loop_total
-        # 面の向きを逆に
-        loop_indices = list()
-        if loop_total>0:
-            loop_indices.append(loop_start)
-        for i in range(loop_total-1, 0, -1):
-            loop_indices.append(loop_start+i)
+    # 面の向きを逆にした並び順で取得 
+    loop_order, loop_totals = get_reversed_loop_order(me)
+    loop_vertex_indices = foreach_get_array(me.loops, "vertex_index", np.int32)
 
-        for loop_index in loop_indices:
-            loop = me.loops[loop_index]
-
-            geo.indices.append(loop.vertex_index)
-            n_attrib.values.append(loop.normal[:])
-
-        geo.loop_counts.append(loop_total)
+    geo.indices = loop_vertex_indices[loop_order]
+    geo.loop_counts = loop_totals
 
+    n_attrib = GeometryAttribute.normal()
+    n_attrib.values = get_corner_normals(me)[loop_order]
     geo.vertex_attributes.append(n_attrib)
 
     eval_ob.to_mesh_clear()
@@ -468,10 +871,244 @@ def convert_mesh_shapekey(obj, axis_conv_matrix):
     if geo.primitive_count()==0:
         return None
 
-    converter = BgeoConverter()
-    return converter.convert(geo)    
+    return geo
+
+def can_extract_shape_keys(obj):
+    """ shape keyの座標をそのまま使えるか(評価しなくても1.0にした時と同じ形になるか) """
+    if obj.type!="MESH" or len(obj.modifiers)>0:
+        return False
+
+    shape_keys = obj.data.shape_keys
+    if not shape_keys.use_relative:
+        return False
+
+    for key_block in shape_keys.key_blocks[1:]:
+        if key_block.relative_key!=shape_keys.reference_key or key_block.vertex_group:
+            return False
+
+    return True
+
+
+def get_shape_key_attribute_name(key_name):
+    """ shape keyの名前からHoudiniで使える差分のattribute名を作る """
+    return "delta_" + re.sub(r"[^0-9A-Za-z_]", "_", key_name)
+
+
+def convert_mesh_shapekeys(obj, axis_conv_matrix, vertex_group_mode="dense", shape_key_mode="full", selection_groups=False):
+    """ shape keyの座標をまとめて取得して変換(can_extract_shape_keysがTrueのメッシュ用)
+        shape_key_mode: "full"ならshape keyごとのGeometryInfo(P, N)、"delta"ならbasisに差分をpoint attributeとして追加する
+        変位のないshape keyは出力しない
+        (shape keyの名前, GeometryInfo)のリストを返す(先頭はbasis) """
+
+    key_blocks = obj.data.shape_keys.key_blocks
+
+    # shape keyをすべてクリアしたものがbasis 
+    for shape_key in key_blocks:
+        shape_key.value = 0.0
+
+    basis_geo = convert_mesh(obj, axis_conv_matrix, vertex_group_mode, selection_groups)
+    if basis_geo is None:
+        return list()
+    geo_list = [ (key_blocks[0].name, basis_geo) ]
+
+    matrix = np.array(axis_conv_matrix, dtype=np.float64)
+    rotation = matrix[:3, :3].T
+    translation = matrix[:3, 3]
+
+    basis_co = foreach_get_array(obj.data.shape_keys.reference_key.data, "co", np.float32, 3)
+
+    # 法線はBlenderに計算させる(作業用のメッシュに座標を入れて更新する) 
+    work_mesh = None
+    loop_order = None
+    if shape_key_mode=="full":
+        work_mesh = obj.data.copy()
+        loop_order, _ = get_reversed_loop_order(work_mesh)
+
+    try:
+        for shape_key in key_blocks[1:]:
+            if shape_key.mute:
+                continue
+
+            co = foreach_get_array(shape_key.data, "co", np.float32, 3)
+            if np.array_equal(co, basis_co):
+                continue
+
+            if shape_key_mode=="delta":
+                delta_attrib = GeometryAttribute.numeric(get_shape_key_attribute_name(shape_key.name), 3)
+                delta_attrib.options = "vector"
+                delta_attrib.values = ( (co - basis_co) @ rotation ).astype(np.float32)
+                basis_geo.point_attributes.append(delta_attrib)
+                continue
+
+            positions = (co @ rotation + translation).astype(np.float32)
+            work_mesh.vertices.foreach_set("co", positions.reshape(-1))
+            work_mesh.update()
+            if hasattr(work_mesh, "calc_normals_split"): # 4.1より前 
+                work_mesh.calc_normals_split()
+
+            geo = GeometryInfo()
+
+            p_attrib = GeometryAttribute.point()
+            p_attrib.values = positions
+            geo.point_attributes.append(p_attrib)
+
+            geo.indices = basis_geo.indices
+            geo.loop_counts = basis_geo.loop_counts
+
+            n_attrib = GeometryAttribute.normal()
+            n_attrib.values = get_corner_normals(work_mesh)[loop_order]
+            geo.vertex_attributes.append(n_attrib)
+
+            geo_list.append( (shape_key.name, geo) )
+
+    finally:
+        if work_mesh is not None:
+            # copy()でshape keyのKeyも複製されるので、残らないように一緒に消す
+            work_ids = [work_mesh]
+            if work_mesh.shape_keys is not None:
+                work_ids.append(work_mesh.shape_keys)
+            bpy.data.batch_remove(work_ids)
+
+    return geo_list
+
+
+def get_instance_key(obj):
+    """ 同じデータを持つオブジェクト同士でジオメトリを共有できる場合はそのkeyを返す
+        modifierやshape keyで形が変わる場合、オブジェクト側の設定を参照する場合はNone """
+    if obj.type!="MESH" or obj.data is None:
+        return None
+    if len(obj.modifiers)>0 or obj.data.shape_keys is not None:
+        return None
+    if any( slot.link!="DATA" for slot in obj.material_slots ):
+        return None
+
+    # vertex groupの名前はオブジェクト側にある 
+    vertex_group_names = tuple( group.name for group in obj.vertex_groups )
+    return ("MESH", obj.data.name_full, vertex_group_names)
+
+
+# source keyで扱えるme.attributesのdata_typeごとの(foreach_getするproperty, 成分数, 型) 
+SOURCE_ATTRIBUTE_TYPES = {
+    "FLOAT": ("value", 1, np.float32),
+    "INT": ("value", 1, np.int32),
+    "INT8": ("value", 1, np.int32),
+    "INT32_2D": ("value", 2, np.int32),
+    "FLOAT2": ("vector", 2, np.float32),
+    "FLOAT_VECTOR": ("vector", 3, np.float32),
+    "FLOAT_COLOR": ("color", 4, np.float32),
+    "BYTE_COLOR": ("color", 4, np.float32),
+    "QUATERNION": ("value", 4, np.float32),
+    "BOOLEAN": ("value", 1, bool),
+}
+
+def get_object_state(obj):
+    """ modifierから参照されているオブジェクトの状態(Armature、Emptyのように変換行列とポーズだけで決まるもの以外はNone) """
+    if obj.type not in ("ARMATURE", "EMPTY"):
+        return None
+
+    h = hashlib.sha1()
+    update_hash(h, np.array(obj.matrix_world, dtype=np.float32))
+    if obj.type=="ARMATURE":
+        update_hash(h, foreach_get_array(obj.pose.bones, "matrix", np.float32, 16))
+    return (obj.name_full, h.hexdigest())
+
+def get_rna_state(struct):
+    """ modifierなどの設定値をまとめたtuple(設定値だけで状態が決まらないものを参照していればNone) """
+    state = list()
+    for prop in struct.bl_rna.properties:
+        if prop.identifier=="rna_type":
+            continue
+
+        value = getattr(struct, prop.identifier)
+        if prop.type=="POINTER":
+            if value is not None:
+                value = get_object_state(value) if isinstance(value, bpy.types.Object) else None
+                if value is None:
+                    return None
+        elif prop.type=="COLLECTION":
+            return None
+        elif prop.type=="ENUM" and prop.is_enum_flag:
+            value = tuple(sorted(value))
+        elif getattr(prop, "is_array", False):
+            value = tuple( np.array(value).ravel().tolist() )
+
+        state.append( (prop.identifier, value) )
+    return tuple(state)
+
+def get_source_key(args, obj, axis_conv_matrix):
+    """ 評価、変換する前のBlender側の状態(メッシュのデータ、modifierの設定、vertex groupなど)から作るcacheのkey
+        shape keyのあるもの、custom normal、geometry nodesなど参照先の状態で形が変わるmodifierがあるものはNone """
+    if obj.type!="MESH" or obj.data is None or obj.data.shape_keys is not None:
+        return None
 
-def convert(obj, axis_conv_matrix, for_shape_key):
+    me = obj.data
+    if getattr(me, "has_custom_normals", False):
+        return None
+
+    modifier_states = list()
+    for modifier in obj.modifiers:
+        state = get_rna_state(modifier)
+        if state is None:
+            return None
+        modifier_states.append(state)
+
+    h = hashlib.sha1()
+    settings = (EXPORTER_VERSION, GeometryInfo.GEO_FILE_VER, [ row[:] for row in axis_conv_matrix ],
+        args.vertex_groups, args.selection_groups, args.promote, args.promote_tolerance, args.storage_policy.rules,
+        modifier_states,
+        [ slot.material.name_full if slot.material is not None else None for slot in obj.material_slots ],
+        [ group.name for group in obj.vertex_groups ], get_deform_group_indices(obj) if args.vertex_groups=="capture" else None,
+        getattr(me, "use_auto_smooth", None), getattr(me, "auto_smooth_angle", None),
+        len(me.vertices), len(me.edges), len(me.loops), len(me.polygons))
+    h.update( repr(settings).encode('utf-8') )
+
+    # modifierで使われるのでオブジェクトの変換行列も含める 
+    if len(modifier_states)>0:
+        update_hash(h, np.array(obj.matrix_world, dtype=np.float32))
+
+    update_hash(h, foreach_get_array(me.vertices, "co", np.float32, 3))
+    update_hash(h, foreach_get_array(me.edges, "vertices", np.int32, 2))
+    update_hash(h, foreach_get_array(me.loops, "vertex_index", np.int32))
+    update_hash(h, foreach_get_array(me.polygons, "loop_total", np.int32))
+    update_hash(h, foreach_get_array(me.polygons, "material_index", np.int32))
+    update_hash(h, foreach_get_array(me.polygons, "use_smooth", bool))
+    update_hash(h, foreach_get_array(me.edges, "use_seam", bool))
+    update_hash(h, foreach_get_array(me.edges, "use_edge_sharp", bool))
+
+    if args.selection_groups:
+        update_hash(h, foreach_get_array(me.vertices, "select", bool))
+        update_hash(h, foreach_get_array(me.edges, "select", bool))
+        update_hash(h, foreach_get_array(me.polygons, "select", bool))
+
+    # 4.xではUV、color attributeもme.attributesに含まれるが、それより前のものも読めるように別に加える 
+    for uv_layer in me.uv_layers:
+        h.update( uv_layer.name.encode('utf-8') )
+        update_hash(h, foreach_get_array(uv_layer.data, "uv", np.float32, 2))
+
+    for attribute in me.attributes:
+        h.update( repr( (attribute.name, attribute.data_type, attribute.domain) ).encode('utf-8') )
+        if attribute.data_type=="STRING":
+            h.update( "\0".join( data.value for data in attribute.data ).encode('utf-8') )
+            continue
+        attribute_type = SOURCE_ATTRIBUTE_TYPES.get(attribute.data_type)
+        if attribute_type is None:
+            return None
+        prop, size, dtype = attribute_type
+        update_hash(h, foreach_get_array(attribute.data, prop, dtype, size))
+
+    face_maps = getattr(me, "face_maps", None)
+    if face_maps is not None and len(face_maps)>0:
+        update_hash(h, foreach_get_array(face_maps[0].data, "value", np.int32))
+        h.update( repr([ face_map.name for face_map in obj.face_maps ]).encode('utf-8') )
+
+    if len(obj.vertex_groups)>0 and args.vertex_groups!="none":
+        for values in gather_vertex_group_weights(me):
+            update_hash(h, values)
+
+    return h.hexdigest()
+
+
+def convert(obj, axis_conv_matrix, for_shape_key, vertex_group_mode="dense", selection_groups=False):
     if obj.type in ("CAMERA", "LIGHT", "EMPTY"):
         return None
     elif obj.type == "CURVE":
@@ -481,10 +1118,71 @@ def convert(obj, axis_conv_matrix, for_shape_key):
     elif for_shape_key:
         return convert_mesh_shapekey(obj, axis_conv_matrix)
     else:
-        return convert_mesh(obj, axis_conv_matrix)
+        return convert_mesh(obj, axis_conv_matrix, vertex_group_mode, selection_groups)
+
+
+def parse_args(argv):
+    """ "--"以降のコマンドライン引数を解析 """
+
+    if "--" not in argv:
+        raise RuntimeError("export bgeo required. add \"--\" \"[bgeo path]\"")
+
+    argv = argv[argv.index("--") + 1:]
+    if len(argv)<1:
+        raise RuntimeError("export bgeo required. add \"--\" \"[bgeo path]\"")
+
+    parser = argparse.ArgumentParser(prog="exporter.py")
+    parser.add_argument("export_path", help="bgeo path (.bgeo / .bgeo.sc). $F4 is replaced with the frame number")
+    parser.add_argument("--stream", action="store_true",
+        help="write bgeo directly to the file instead of building it in memory")
+    parser.add_argument("--frame-start", type=int, default=None,
+        help="first frame to export (default: scene start when --frame-end is given)")
+    parser.add_argument("--frame-end", type=int, default=None,
+        help="last frame to export (default: scene end when --frame-start is given)")
+    parser.add_argument("--step", type=int, default=1,
+        help="frame step of the exported sequence")
+    parser.add_argument("--shape-keys", choices=("full", "delta"), default="full",
+        help="export each shape key as its own geometry (full) or as delta_<key> point attributes on the basis (delta). "
+            "For meshes whose shape keys can be read without evaluating (no modifiers, relative to the basis, no vertex group), "
+            "muted keys and keys without displacement are left out")
+    parser.add_argument("--delta", action="store_true",
+        help="for frame ranges, keep each mesh's first export as a template and only rewrite P and N while its topology stays the same "
+            "(other attributes such as uv and materials are assumed not to be animated)")
+    parser.add_argument("--index", action="store_true",
+        help="write an index of embedded objects so each one can be read without parsing the whole file")
+    parser.add_argument("--jobs", type=int, default=1,
+        help="number of worker processes converting objects to bgeo")
+    parser.add_argument("--vertex-groups", choices=("dense", "capture", "none"), default="dense",
+        help="export vertex groups as one float point attribute per group (dense), "
+            "or put the groups of deforming armature bones into one boneCapture attribute holding only the non-zero weights (capture; "
+            "the capture matrices are identity, other groups stay dense)")
+    parser.add_argument("--selection-groups", action="store_true",
+        help="export the selected points, primitives and edges of meshes as groups named 'selected'")
+    parser.add_argument("--no-promote", dest="promote", action="store_false",
+        help="always write N, UVs and colors as vertex attributes (by default they become point/primitive attributes when constant per point/primitive)")
+    parser.add_argument("--promote-tolerance", type=float, default=0.0,
+        help="values differing by at most this much count as constant when promoting vertex attributes")
+    parser.add_argument("--storage-profile", dest="storage_policy", type=StoragePolicy.load, default="full",
+        help="attribute storage rules: {} or a JSON file with a list of rules ".format(" / ".join(sorted(STORAGE_PROFILES))) +
+            "(full keeps fpreal32; compact uses fpreal16 for colors, normals and capture weights within 1e-3, 2-component UVs and the smallest integer types)")
+    parser.add_argument("--cache-dir", default=None,
+        help="directory caching converted bgeo of each object between exports")
+    parser.add_argument("--cache-size", type=int, default=10240,
+        help="maximum size of the cache directory in MB")
+    parser.add_argument("--verbose", action="store_true",
+        help="log progress and cache statistics to stderr")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+        help="write timings of each stage, counters and per-object statistics to PATH")
+    parser.add_argument("--profile-format", choices=("json", "chrome"), default="json",
+        help="json: aggregated report, chrome: trace for chrome://tracing or Perfetto")
+    parser.add_argument("--profile-memory", action="store_true",
+        help="record peak memory with tracemalloc (slows down the export)")
+    return parser.parse_args(argv)
 
 
 def save_bgeosc_file(data, path):
+    """ bgeoデータ(bytes、またはfile)を.bgeo.scとして保存
+        fileの場合はCOPY_CHUNK_SIZEずつ読んで圧縮する """
     import struct
     from bgeolib.blosc_compression_filter import BloscCompressionFilter
 
@@ -498,7 +1196,11 @@ def save_bgeosc_file(data, path):
         
         # compressed bgeo data 
         sc_filter = BloscCompressionFilter()
-        sc_filter.write( f, data )
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            sc_filter.write( f, data )
+        else:
+            for chunk in iter(lambda: data.read(BinaryJsonWriter.COPY_CHUNK_SIZE), b""):
+                sc_filter.write( f, chunk )
         sc_filter.close( f )
         
         # index 
@@ -509,78 +1211,207 @@ def save_bgeosc_file(data, path):
 
 
 
-if __name__=="__main__":
+def frame_path(path, frame):
+    """ pathの$F, $F4などをフレーム番号に置き換える
+        フレームを指定していてpathに$Fがなければ拡張子の前に4桁のフレーム番号を入れる """
+    if frame is None:
+        return path
 
-    argv = sys.argv
+    if re.search(r"\$F\d*", path) is None:
+        base, ext = (path[:-len(".bgeo.sc")], ".bgeo.sc") if path.endswith(".bgeo.sc") else os.path.splitext(path)
+        return "{}.{:04d}{}".format(base, frame, ext)
 
-    if "--" not in argv:
-        raise RuntimeError("export bgeo required. add \"--\" \"[bgeo path]\"")
-        
-    argv = argv[argv.index("--") + 1:]
-    if len(argv)<1:
-        raise RuntimeError("export bgeo required. add \"--\" \"[bgeo path]\"")
+    return re.sub(r"\$F(\d*)", lambda m: str(frame).zfill(int(m.group(1) or 0)), path)
 
-    export_path = argv[0]
-    
-    # activeがあればオブジェクトモードにする
-    if bpy.context.view_layer.objects.active is not None:
-        bpy.ops.object.mode_set(mode = "OBJECT")
 
-    # Armatureのポーズをリセット 
-    for obj in bpy.context.scene.objects:
-        if obj.type == "ARMATURE":
-            for pose_bone in obj.pose.bones:
-                pose_bone.matrix_basis.identity()
+def get_frames(args, scene):
+    """ 書き出すフレームのリスト(範囲を指定していなければ現在のフレームだけ書き出すので[None]) """
+    if args.frame_start is None and args.frame_end is None:
+        return [None]
 
+    frame_start = args.frame_start if args.frame_start is not None else scene.frame_start
+    frame_end = args.frame_end if args.frame_end is not None else scene.frame_end
+    return list(range(frame_start, frame_end + 1, max(1, args.step)))
 
-    packed_geo_list = list()
-    embed_id = 1
 
-    # BlenderのZ-upをY-upに変換する行列 
-    axis_conv_matrix = axis_conversion(
-        from_forward="-Y", from_up="Z", 
-        to_forward="Z",to_up="Y",).to_4x4()
+def extract_geometry(args, obj, name, axis_conv_matrix, templates=None):
+    """ オブジェクトを(名前, type, GeometryInfo(テンプレートの場合は(BgeoTemplate, 値)))のリストに変換する """
 
+    geo_list = list()
 
-    for obj in bpy.context.scene.objects:
+    if hasattr(obj.data, "shape_keys") and obj.data.shape_keys is not None and can_extract_shape_keys(obj):
 
-        bgeo_list = list() # name, type, bgeoのリスト 
-        name = get_outliner_path(obj) 
+        # shape keyの座標をまとめて取得する 
+        for key_name, geo in convert_mesh_shapekeys(obj, axis_conv_matrix, args.vertex_groups, args.shape_keys, args.selection_groups):
+            geo_list.append( (name+"." + key_name, obj.type, geo) )
 
-        if hasattr(obj.data, "shape_keys") and obj.data.shape_keys is not None:
+    elif hasattr(obj.data, "shape_keys") and obj.data.shape_keys is not None:
 
-            # shape keyを一旦すべてクリア 
-            for shape_key in obj.data.shape_keys.key_blocks:
-                shape_key.value = 0.0
-            
-            # shape keyを有効にしながらすべて回す 
-            for i, shape_key in enumerate(obj.data.shape_keys.key_blocks):
-                shape_key.value = 1.0
+        # 差分にできるのはメッシュだけ 
+        delta = args.shape_keys=="delta" and obj.type=="MESH"
+        if args.shape_keys=="delta" and not delta:
+            logger.warning("%s: --shape-keys delta supports meshes only, exporting each shape key as its own geometry", name)
 
-                bgeo = convert(obj, axis_conv_matrix, i>0) # 0番目以外は最小情報で出力されるように 
-                if bgeo is not None:
-                    bgeo_list.append( (name+"." + shape_key.name, obj.type, bgeo) )
+        # shape keyを一旦すべてクリア 
+        for shape_key in obj.data.shape_keys.key_blocks:
+            shape_key.value = 0.0
+        
+        # shape keyを有効にしながらすべて回す 
+        basis_geo = None
+        for i, shape_key in enumerate(obj.data.shape_keys.key_blocks):
+            shape_key.value = 1.0
+
+            geo = convert(obj, axis_conv_matrix, i>0, args.vertex_groups, args.selection_groups) # 0番目以外は最小情報で出力されるように 
+
+            # 評価した座標とbasisの差分をbasisのpoint attributeにする(modifierで点の数が変わる場合はそのまま出力する) 
+            if delta and geo is not None:
+                if i==0:
+                    basis_geo = geo
+                elif basis_geo is not None:
+                    positions = np.asarray(geo.find_point_attributes("P").values, dtype=np.float32)
+                    basis_positions = np.asarray(basis_geo.find_point_attributes("P").values, dtype=np.float32)
+                    if positions.shape==basis_positions.shape:
+                        delta_attrib = GeometryAttribute.numeric(get_shape_key_attribute_name(shape_key.name), 3)
+                        delta_attrib.options = "vector"
+                        delta_attrib.values = positions - basis_positions
+                        basis_geo.point_attributes.append(delta_attrib)
+                        geo = None
+                    else:
+                        logger.warning("%s: shape key %s changes the point count, exporting it as its own geometry", name, shape_key.name)
+
+            if geo is not None:
+                geo_list.append( (name+"." + shape_key.name, obj.type, geo) )
+
+            # curveだったらMeshに変換可能かテスト 
+            if obj.type == "CURVE":
+                geo = convert_mesh(obj, axis_conv_matrix, args.vertex_groups, args.selection_groups)
+                if geo is not None:
+                    geo_list.append( (name+"." + shape_key.name, "MESH", geo) )
+
+            shape_key.value = 0.0
+
+    elif templates is not None and obj.type == "MESH":
+        geo = convert_mesh_delta(obj, axis_conv_matrix, templates, args.vertex_groups,
+            args.promote_tolerance if args.promote else None, args.storage_policy, args.selection_groups)
+        if geo is not None:
+            geo_list.append( (name, obj.type, geo) )
+
+    else:
+        geo = convert(obj, axis_conv_matrix, False, args.vertex_groups, args.selection_groups)
+        if geo is not None:
+            geo_list.append( (name, obj.type, geo) )
+
+        # curveだったらMeshに変換可能かテスト 
+        if obj.type == "CURVE":
+            geo = convert_mesh(obj, axis_conv_matrix, args.vertex_groups, args.selection_groups)
+            if geo is not None:
+                geo_list.append( (name, "MESH", geo) )
+
+    # pointごと、primitiveごとに一定のvertex attribute(N, UV, Cdなど)を移して小さくする 
+    if args.promote:
+        with profiler.section("promote"):
+            for _, _, geo in geo_list:
+                if isinstance(geo, GeometryInfo):
+                    geo.promote_vertex_attributes(args.promote_tolerance)
+
+    # attributeごとのstorage(fpreal16, 2成分のUVなど) 
+    with profiler.section("storage"):
+        for _, _, geo in geo_list:
+            if isinstance(geo, GeometryInfo):
+                args.storage_policy.apply(geo)
+
+    return geo_list
+
+
+def get_bgeo_size(bgeo):
+    """ bgeo(bytesまたはfile)のバイト数
+        fileは書き出しのthreadが読んでいる最中かもしれないので、位置を動かさずにfstatで取得する """
+    if isinstance(bgeo, (bytes, bytearray)):
+        return len(bgeo)
+    if isinstance(bgeo, memoryview):
+        return bgeo.nbytes
+    return os.fstat(bgeo.fileno()).st_size
+
+
+def export_scene(args, axis_conv_matrix, parallel_converter, cache, previous_bgeo=None, templates=None, outliner_index=None):
+    """ sceneのオブジェクトをPackedGeoInfoのリストに変換する
+        previous_bgeo(fingerprint、またはsource key -> (bgeo, digest))に同じものがあれば変換せずに再利用する
+        (source keyが作れるオブジェクトは評価も変換もしない)
+        templates(オブジェクト名 -> (トポロジーのhash, BgeoTemplate))を渡すとメッシュはP, Nだけを差し替えて書き出す
+        outliner_indexを渡すとフレーム間でオブジェクトのパスを使い回す
+        (PackedGeoInfoのリスト, このフレームのfingerprint、またはsource key -> (bgeo, digest))を返す """
+
+    packed_geo_list = list()
+    current_bgeo = dict()
+
+    if outliner_index is None:
+        outliner_index = OutlinerIndex()
+
+    # 同じジオメトリは一つのembed idにまとめる 
+    embed_registry = EmbedRegistry()
+
+    def store_bgeo(tag, bgeo):
+        """ 変換済みのbgeoを設定(既に同じ内容があればそちらを参照する) """
+        packed_geo, cache_key, cached, fingerprint, digest = tag
+        if cache_key is not None and not cached:
+            with profiler.section("cache"):
+                cache.store(cache_key, bgeo)
+
+        if digest is None:
+            with profiler.section("digest"):
+                digest = EmbedRegistry.digest(bgeo)
+        if profiler.enabled:
+            profiler.record(packed_geo.name, bytes=get_bgeo_size(bgeo))
+        if fingerprint is not None:
+            current_bgeo[fingerprint] = (bgeo, digest)
+
+        embed_id = embed_registry.register_bgeo(packed_geo.embed_id, bgeo, digest)
+        if embed_id==packed_geo.embed_id:
+            packed_geo.bgeo = bgeo
+        elif fingerprint is None and hasattr(bgeo, "close"):
+            bgeo.close()
 
-                # curveだったらMeshに変換可能かテスト 
-                if obj.type == "CURVE":
-                    bgeo = convert_mesh(obj, axis_conv_matrix)
+    for obj in bpy.context.scene.objects:
+
+        geo_list = list() # name, type, GeometryInfo(共有する場合はembed id)のリスト 
+        name = outliner_index.get_outliner_path(obj)
+
+        # 同じメッシュを共有しているオブジェクトは変換済みのものを参照する 
+        instance_key = get_instance_key(obj)
+        shared_embed_id = embed_registry.find(instance_key) if instance_key is not None else None
+
+        # 変換前の状態から作るkey(前のフレームかcacheにあれば評価も変換もしない) 
+        source_key = None
+        reused = None # 前のフレームかcacheにあったもの(bgeo, digest) 
+        if shared_embed_id is None and templates is None and (cache is not None or previous_bgeo is not None):
+            with profiler.section("source_key"):
+                source_key = get_source_key(args, obj, axis_conv_matrix)
+            if source_key is not None:
+                reused = previous_bgeo.get(source_key) if previous_bgeo is not None else None
+                if reused is None and cache is not None:
+                    with profiler.section("cache"):
+                        bgeo = cache.load(source_key, args.stream)
                     if bgeo is not None:
-                        bgeo_list.append( (name+"." + shape_key.name, "MESH", bgeo) )
+                        reused = (bgeo, None)
+
+        if shared_embed_id is not None:
+            geo_list.append( (name, obj.type, shared_embed_id) )
 
-                shape_key.value = 0.0
+        elif reused is not None:
+            geo_list.append( (name, obj.type, None) )
 
         else:
-            bgeo = convert(obj, axis_conv_matrix, False)
-            if bgeo is not None:
-                bgeo_list.append( (name, obj.type, bgeo) )
+            with profiler.section("extract") as section:
+                geo_list = extract_geometry(args, obj, name, axis_conv_matrix, templates)
 
-            # curveだったらMeshに変換可能かテスト 
-            if obj.type == "CURVE":
-                bgeo = convert_mesh(obj, axis_conv_matrix)
-                if bgeo is not None:
-                    bgeo_list.append( (name, "MESH", bgeo) )
+            if profiler.enabled:
+                profiler.record(name, seconds=section.seconds)
 
-        for name, obj_type, bgeo in bgeo_list:
+            # source keyはオブジェクトが一つのジオメトリになる場合だけ使う 
+            if len(geo_list)!=1:
+                source_key = None
+
+        for name, obj_type, geo in geo_list:
             
             # 確認用に個別でbgeo出力 
             # filepath = os.path.join(os.path.dirname(__file__), "..", "geo", name+".bgeo")
@@ -596,30 +1427,229 @@ if __name__=="__main__":
             matrix = Matrix.LocRotScale(loc, rot, scale)
 
             packed_geo = PackedGeoInfo()
-            packed_geo.embed_id = "{:016x}".format(embed_id)
-            packed_geo.bgeo = bgeo
             packed_geo.type = obj_type
             packed_geo.name = name
             packed_geo.position = loc[:]
             packed_geo.transform = [ matrix[i%3][i//3] for i in range(0, 9)]
             packed_geo_list.append(packed_geo)
 
-            embed_id += 1
+            if profiler.enabled and isinstance(geo, GeometryInfo):
+                profiler.record(name, points=geo.point_count(), vertices=geo.vertex_count(), primitives=geo.primitive_count())
+
+            if isinstance(geo, str):
+                packed_geo.embed_id = geo
+                continue
+
+            packed_geo.embed_id = embed_registry.new_embed_id()
+            if instance_key is not None:
+                embed_registry.register(instance_key, packed_geo.embed_id)
+
+            # 前のフレームかcacheにあったものはそのまま使う 
+            if reused is not None:
+                bgeo, digest = reused
+                for tag, bgeo in parallel_converter.submit_result(bgeo, (packed_geo, None, True, source_key, digest)):
+                    store_bgeo(tag, bgeo)
+                continue
+
+            # テンプレートの値を差し替えて書き出す 
+            if isinstance(geo, tuple):
+                template, values = geo
+                fingerprint = template.fingerprint(values)
+                previous = previous_bgeo.get(fingerprint) if previous_bgeo is not None else None
+                if previous is not None:
+                    bgeo, digest = previous
+                    converted = parallel_converter.submit_result(bgeo, (packed_geo, None, True, fingerprint, digest))
+                else:
+                    with profiler.section("render"):
+                        bgeo = template.render(values)
+                    converted = parallel_converter.submit_result(bgeo, (packed_geo, None, True, fingerprint, None))
+
+                for tag, bgeo in converted:
+                    store_bgeo(tag, bgeo)
+                continue
+
+            # source keyがあれば変換後のジオメトリのfingerprintは作らない 
+            fingerprint = None
+            if source_key is None and (cache is not None or previous_bgeo is not None):
+                with profiler.section("fingerprint"):
+                    fingerprint = ConversionCache.fingerprint(geo, EXPORTER_VERSION, GeometryInfo.GEO_FILE_VER, [ row[:] for row in axis_conv_matrix ])
+
+            # 前のフレームから変わっていなければ変換済みのものを使う 
+            previous = previous_bgeo.get(fingerprint) if previous_bgeo is not None else None
+            if previous is not None:
+                bgeo, digest = previous
+                converted = parallel_converter.submit_result(bgeo, (packed_geo, None, True, fingerprint, digest))
+            elif source_key is not None:
+                # 前のフレームにもcacheにもなかったので変換してsource keyで保存する 
+                cache_key = source_key if cache is not None else None
+                converted = parallel_converter.submit(geo, (packed_geo, cache_key, False, source_key, None))
+            elif cache is not None:
+                with profiler.section("cache"):
+                    bgeo = cache.load(fingerprint, args.stream)
+                if bgeo is not None:
+                    converted = parallel_converter.submit_result(bgeo, (packed_geo, fingerprint, True, fingerprint, None))
+                else:
+                    converted = parallel_converter.submit(geo, (packed_geo, fingerprint, False, fingerprint, None))
+            else:
+                converted = parallel_converter.submit(geo, (packed_geo, None, False, fingerprint, None))
+
+            for tag, bgeo in converted:
+                store_bgeo(tag, bgeo)
+
+    for tag, bgeo in parallel_converter.flush():
+        store_bgeo(tag, bgeo)
+
+    # 重複していたものをまとめた後のembed idに付け替える 
+    for packed_geo in packed_geo_list:
+        packed_geo.embed_id = embed_registry.resolve(packed_geo.embed_id)
 
+    return packed_geo_list, current_bgeo
 
-    # PackedGeometryにまとめる 
-    converter = BgeoConverter()
-    packed_data = converter.pack(packed_geo_list)
 
-    # bgeo出力 
+def write_packed(args, packed_geo_list, export_path):
+    """ PackedGeometryにまとめて書き出す """
     export_dir = os.path.dirname(export_path)
-    if not os.path.exists(export_dir):
-        os.makedirs(export_dir)
+    if export_dir and not os.path.exists(export_dir):
+        os.makedirs(export_dir, exist_ok=True)
 
-    if export_path.endswith(".bgeo.sc"):
-        save_bgeosc_file(packed_data, export_path)
+    # 失敗した時に途中までのファイルが残らないように、同じディレクトリの一時ファイルに書いてから置き換える 
+    # (mkstempだとパーミッションが0600になるので、プロセスごとの名前で普通に作る) 
+    temp_path = "{}.{}.tmp".format(export_path, os.getpid())
+    try:
+        with profiler.section("write", path=export_path):
+            write_packed_file(args, packed_geo_list, temp_path, export_path.endswith(".bgeo.sc"))
+        os.replace(temp_path, export_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if profiler.enabled:
+        profiler.count("written_bytes", os.path.getsize(export_path))
+
+
+def write_packed_file(args, packed_geo_list, path, compress):
+    """ PackedGeometryにまとめてpathに書き込む(compressがTrueなら.bgeo.scにする) """
+    converter = BgeoConverter(index=args.index, profiler=profiler)
+    if compress:
+        # --streamならbgeoを一時ファイルに書いてから少しずつ圧縮する 
+        if args.stream:
+            with tempfile.TemporaryFile() as packed_data:
+                converter.pack(packed_geo_list, packed_data)
+                packed_data.seek(0)
+                with profiler.section("compress"):
+                    save_bgeosc_file(packed_data, path)
+        else:
+            packed_data = converter.pack(packed_geo_list)
+            with profiler.section("compress"):
+                save_bgeosc_file(packed_data, path)
+    elif args.stream:
+        with open(path, "wb") as f:
+            converter.pack(packed_geo_list, f)
     else:
-        with open(export_path, "wb") as f:
-            f.write(packed_data)
+        packed_data = converter.pack(packed_geo_list)
+        with profiler.section("file"):
+            with open(path, "wb") as f:
+                f.write(packed_data)
+
+
+def close_bgeo(bgeo_list, keep_bgeo):
+    """ 一時ファイルを片付ける(keep_bgeoに入っているものは次のフレームで使うので残す) """
+    keep_ids = set( id(bgeo) for bgeo, _ in keep_bgeo.values() )
+    for bgeo in bgeo_list:
+        if hasattr(bgeo, "close") and id(bgeo) not in keep_ids:
+            bgeo.close()
+
+
+if __name__=="__main__":
+
+    args = parse_args(sys.argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+
+    if args.profile is not None:
+        profiler = Profiler(trace=args.profile_format=="chrome", memory=args.profile_memory)
+
+    scene = bpy.context.scene
+
+    # activeがあればオブジェクトモードにする
+    if bpy.context.view_layer.objects.active is not None:
+        bpy.ops.object.mode_set(mode = "OBJECT")
+
+    # Armatureのポーズをリセット 
+    for obj in scene.objects:
+        if obj.type == "ARMATURE":
+            for pose_bone in obj.pose.bones:
+                pose_bone.matrix_basis.identity()
+
+    # bgeoへの変換はworker processに任せる(結果はembed_id順に受け取る) 
+    parallel_converter = ParallelConverter(args.jobs, args.stream, profiler)
+
+    # 前回のexportで変換したものを再利用する 
+    cache = None
+    if args.cache_dir is not None:
+        cache = ConversionCache(args.cache_dir, args.cache_size * (1 << 20))
+
+    # BlenderのZ-upをY-upに変換する行列 
+    axis_conv_matrix = axis_conversion(
+        from_forward="-Y", from_up="Z", 
+        to_forward="Z",to_up="Y",).to_4x4()
+
+    frames = get_frames(args, scene)
+
+    # アウトライナーでのパスは全フレームで共通 
+    outliner_index = OutlinerIndex(scene)
+
+    # フレームNの書き出しはthreadで行い、その間にフレームN+1を評価する 
+    write_executor = ThreadPoolExecutor(max_workers=1)
+    pending_write = None
+    pending_bgeo = list()
+
+    # 差分出力用のテンプレート 
+    templates = dict() if args.delta and frames!=[None] else None
+
+    # 途中で失敗してもworker processと書き出しのthreadは必ず終了する 
+    previous_bgeo = None
+    completed = False
+    try:
+        for frame in frames:
+            with profiler.section("frame", frame=frame):
+                if frame is not None:
+                    with profiler.section("frame_set"):
+                        scene.frame_set(frame)
+
+                packed_geo_list, current_bgeo = export_scene(args, axis_conv_matrix, parallel_converter, cache,
+                    previous_bgeo if frame is not None else None, templates, outliner_index)
+
+                # 前のフレームの書き出しが終わってから、使わなくなった一時ファイルを片付ける 
+                if pending_write is not None:
+                    with profiler.section("wait_write"):
+                        pending_write.result()
+                    close_bgeo(pending_bgeo, current_bgeo)
+
+            pending_write = write_executor.submit(write_packed, args, packed_geo_list, frame_path(args.export_path, frame))
+            pending_bgeo = [ packed_geo.bgeo for packed_geo in packed_geo_list ] + [ bgeo for bgeo, _ in current_bgeo.values() ]
+            previous_bgeo = current_bgeo
+
+            if frame is not None:
+                logger.info("frame %s: %d objects", frame, len(packed_geo_list))
+
+        if pending_write is not None:
+            pending_write.result()
+            close_bgeo(pending_bgeo, dict())
+        completed = True
+
+    finally:
+        write_executor.shutdown()
+        if completed:
+            parallel_converter.finish()
+        else:
+            parallel_converter.terminate()
 
+    if cache is not None:
+        logger.info("bgeo cache: %s", cache.stats())
 
+    if args.profile is not None:
+        profiler.dump(args.profile, args.profile_format)
+        profiler.close()
+        logger.info("profile: %s", args.profile)
@@ -0,0 +1,115 @@
+
+# python validate.py cache.bgeo --roundtrip
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import read_document
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import check_geometry
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.bgeo_reader import to_dict
+from bgeolib.bgeosc_reader import open_bgeosc
+
+
+def load_source(path):
+    """ .bgeoはpathのまま(read_documentがmmapする)、.bgeo.scは一時ファイルに展開してmmapしたものを返す """
+    if path.endswith(".sc"):
+        return open_bgeosc(path)
+    return path
+
+
+def is_packed(doc):
+    for header, _ in to_dict(doc).get("primitives", []):
+        if to_dict(header)["type"]=="PackedGeometry":
+            return True
+    return False
+
+
+def roundtrip_geometry(geo_info):
+    """ 書き出して読み込み直したものとの違い """
+    bgeo = BgeoConverter().convert(geo_info)
+    return compare_geometry(geo_info, BgeoLoader().load(bgeo))
+
+
+def roundtrip_packed(packed_geo_list, embedded):
+    """ 書き出して読み込み直したものとの違い """
+    converter = BgeoConverter()
+
+    embedded_bgeo = { embed_id: converter.convert(geo_info) for embed_id, geo_info in embedded.items() }
+    for packed_geo in packed_geo_list:
+        packed_geo.bgeo = embedded_bgeo.get(packed_geo.embed_id)
+
+    loaded_geo_list, loaded_embedded = BgeoLoader().load_packed( converter.pack(packed_geo_list) )
+
+    differences = list()
+    for i, (expected, actual) in enumerate(zip(packed_geo_list, loaded_geo_list)):
+        if (expected.embed_id, expected.type, expected.name)!=(actual.embed_id, actual.type, actual.name):
+            differences.append("packed primitive {}: {} != {}".format(i, (expected.embed_id, expected.type, expected.name), (actual.embed_id, actual.type, actual.name)))
+        for key in ("position", "pivot", "transform"):
+            if not np.array_equal( np.asarray(getattr(expected, key), dtype=np.float32), np.asarray(getattr(actual, key), dtype=np.float32) ):
+                differences.append("packed primitive {}: {} differs".format(i, key))
+    if len(packed_geo_list)!=len(loaded_geo_list):
+        differences.append("packed primitives: {} != {}".format(len(packed_geo_list), len(loaded_geo_list)))
+
+    for embed_id, geo_info in embedded.items():
+        if embed_id not in loaded_embedded:
+            differences.append("embed {} is missing".format(embed_id))
+            continue
+        differences += [ "embed {}: {}".format(embed_id, d) for d in compare_geometry(geo_info, loaded_embedded[embed_id]) ]
+
+    return differences
+
+
+def validate(path, roundtrip):
+    """ 問題の説明のリストを返す """
+    doc = read_document( load_source(path) )
+    loader = BgeoLoader()
+
+    if not is_packed(doc):
+        geo_info, _ = loader.geometry(doc)
+        print("{}: {} points, {} vertices, {} primitives".format(path, geo_info.point_count(), geo_info.vertex_count(), geo_info.primitive_count()))
+
+        problems = check_geometry(geo_info)
+        if roundtrip:
+            problems += roundtrip_geometry(geo_info)
+        return problems
+
+    packed_geo_list, embedded = loader.packed(doc)
+    print("{}: {} packed primitives, {} embedded geometries".format(path, len(packed_geo_list), len(embedded)))
+
+    problems = list()
+    for packed_geo in packed_geo_list:
+        if packed_geo.embed_id not in embedded:
+            problems.append("embed {} is missing".format(packed_geo.embed_id))
+    for embed_id, geo_info in embedded.items():
+        problems += [ "embed {}: {}".format(embed_id, problem) for problem in check_geometry(geo_info) ]
+    if roundtrip:
+        problems += roundtrip_packed(packed_geo_list, embedded)
+    return problems
+
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="check .bgeo/.bgeo.sc files without Houdini")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--roundtrip", action="store_true", help="write the loaded geometry again and compare it with the original")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.paths:
+        try:
+            problems = validate(path, args.roundtrip)
+        except Exception as e:
+            problems = [ "{}: {}".format(type(e).__name__, e) ]
+
+        for problem in problems:
+            print("  " + problem, file=sys.stderr)
+        failed = failed or len(problems)>0
+
+    sys.exit(1 if failed else 0)
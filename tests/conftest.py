@@ -0,0 +1,5 @@
+import os
+import sys
+
+# scripts/のbgeolibを読み込めるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir, "scripts"))
@@ -0,0 +1,22 @@
+import benchmark
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import check_geometry
+from bgeolib.bgeo_loader import compare_geometry
+
+
+def test_benchmark_inputs_are_valid():
+    # 計測しているものが正しいジオメトリであること
+    for geo in ( benchmark.make_grid(100), benchmark.make_polygon_soup(20), benchmark.make_curves(3) ):
+        assert check_geometry(geo)==[]
+        assert compare_geometry(geo, BgeoLoader().load( BgeoConverter().convert(geo) ))==[]
+
+    packed_geo_list, embedded = BgeoLoader().load_packed( BgeoConverter().pack( benchmark.make_packed(3) ) )
+    assert len(packed_geo_list)==3 and len(embedded)==3
+
+
+def test_run_benchmark(monkeypatch):
+    monkeypatch.setitem(benchmark.PRESETS, "tiny", {"grid_points": 100, "soup_triangles": 100, "curves": 5, "skin_points": 100, "packed": 5})
+    results = benchmark.run_benchmark("tiny", 1, True)
+    assert [ result["case"] for result in results ]==["convert/grid", "convert/polygon_soup", "convert/curves", "bonecapture/skin", "pack/packed"]
+    assert all( result["bytes"]>0 and result["seconds"]>=0.0 for result in results )
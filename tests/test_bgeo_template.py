@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.bgeo_template import BgeoTemplate
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def make_geometry(offset):
+    """ 平らな所(値がすべて同じpageになるN)を持つ四角形の列 """
+    count = 600
+    positions = np.zeros( (count*4, 3), dtype=np.float32 )
+    positions[:, 0] = np.arange(count*4) // 2
+    positions[:, 2] = np.arange(count*4) % 2
+    positions[:, 1] = offset
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+
+    n_attrib = GeometryAttribute.normal()
+    normals = np.zeros( (count*4, 3), dtype=np.float32 )
+    normals[:, 1] = 1.0
+    n_attrib.set_array(normals)
+    geo.vertex_attributes.append(n_attrib)
+
+    uv_attrib = GeometryAttribute.texturecoord("uv")
+    uv_attrib.set_array(positions)
+    geo.vertex_attributes.append(uv_attrib)
+
+    geo.indices = np.arange(count*4, dtype=np.int32)
+    geo.loop_counts = np.full(count, 4, dtype=np.int32)
+    return geo
+
+
+def deform(geo, t):
+    """ P, Nだけ動かした値 """
+    positions = geo.find_point_attributes("P").values.copy()
+    positions[:, 1] = np.sin(positions[:, 0] + t)
+    normals = geo.find_vertex_attributes("N").values.copy()
+    normals[::3, 0] = t
+    return { ("point", "P"): positions, ("vertex", "N"): normals }
+
+
+def test_render_replaces_values():
+    geo = make_geometry(0.0)
+    template = BgeoTemplate(geo)
+    assert sorted(template.slots)==[ ("point", "P"), ("vertex", "N") ]
+
+    values = deform(geo, 0.5)
+    rendered = template.render(values)
+    assert len(rendered)==len(template.data)
+
+    # P, Nを差し替えたジオメトリと同じものが読める(uvはそのまま)
+    geo.find_point_attributes("P").set_array( values[("point", "P")] )
+    geo.find_vertex_attributes("N").set_array( values[("vertex", "N")] )
+    assert compare_geometry(geo, BgeoLoader().load(rendered))==[]
+
+    stream = io.BytesIO()
+    assert template.render(values, stream) is None
+    assert stream.getvalue()==rendered
+
+
+def test_render_without_values():
+    template = BgeoTemplate( make_geometry(1.0) )
+    assert template.render(dict())==template.data
+    assert compare_geometry(make_geometry(1.0), BgeoLoader().load(template.data))==[]
+
+
+def test_render_wrong_size():
+    geo = make_geometry(0.0)
+    template = BgeoTemplate(geo)
+    with pytest.raises(ValueError):
+        template.render({ ("point", "P"): np.zeros( (3, 3) ) })
+
+
+def test_fingerprint():
+    geo = make_geometry(0.0)
+    template = BgeoTemplate(geo)
+    assert template.fingerprint( deform(geo, 0.5) )==template.fingerprint( deform(geo, 0.5) )
+    assert template.fingerprint( deform(geo, 0.5) )!=template.fingerprint( deform(geo, 0.25) )
+    # 別のテンプレート(トポロジー)なら同じ値でも違う
+    assert BgeoTemplate( make_geometry(1.0) ).fingerprint( deform(geo, 0.5) )!=template.fingerprint( deform(geo, 0.5) )
@@ -0,0 +1,94 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.bgeosc_reader import BLOSC_DONT_SPLIT
+from bgeolib.bgeosc_reader import BLOSC_MAX_OVERHEAD
+from bgeolib.bgeosc_reader import BLOSC_MEMCPYED
+from bgeolib.bgeosc_reader import BLOSC_ZLIB_FORMAT
+from bgeolib.bgeosc_reader import iter_bgeosc_blocks
+from bgeolib.bgeosc_reader import open_bgeosc
+from bgeolib.bgeosc_reader import read_bgeosc
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def memcpyed_chunk(data):
+    """ 圧縮せずに格納したblosc1のchunk """
+    header = struct.pack('<BBBBIII', 2, 1, BLOSC_MEMCPYED, 1, len(data), len(data), BLOSC_MAX_OVERHEAD + len(data))
+    return header + data
+
+
+def zlib_chunk(data, blocksize):
+    """ shuffleなしでzlibで圧縮したblosc1のchunk """
+    blocks = [ data[i:i+blocksize] for i in range(0, len(data), blocksize) ]
+    offset = BLOSC_MAX_OVERHEAD + 4*len(blocks)
+    starts = list()
+    body = b""
+    for block in blocks:
+        starts.append(offset + len(body))
+        compressed = zlib.compress(block)
+        body += struct.pack('<i', len(compressed)) + compressed
+    cbytes = offset + len(body)
+    header = struct.pack('<BBBBIII', 2, 1, (BLOSC_ZLIB_FORMAT << 5) | BLOSC_DONT_SPLIT, 1, len(data), blocksize, cbytes)
+    return header + struct.pack('<{}i'.format(len(starts)), *starts) + body
+
+
+def make_bgeosc(chunks):
+    """ scf1 + metadata + chunk + index + footer
+        indexの中身は読まないので適当なもの """
+    index = b"\0"*24
+    return b"scf1" + b"\0"*8 + b"".join(chunks) + index + struct.pack('>Q', len(index)) + b"1fcs"
+
+
+def make_grid_bgeo():
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(300, dtype=np.float32).reshape(-1, 3) )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(99, dtype=np.int32)
+    geo.loop_counts = np.full(33, 3, dtype=np.int32)
+    return geo, BgeoConverter().convert(geo)
+
+
+def test_blocks_are_decompressed_one_by_one():
+    _, bgeo = make_grid_bgeo()
+    chunks = [ memcpyed_chunk(bgeo[:100]), zlib_chunk(bgeo[100:900], 256), memcpyed_chunk(bgeo[900:]) ]
+    blocks = iter_bgeosc_blocks( make_bgeosc(chunks) )
+    assert next(blocks)==bgeo[:100]
+    assert next(blocks)==bgeo[100:900]
+    assert next(blocks)==bgeo[900:]
+    assert next(blocks, None) is None
+
+
+def test_open_bgeosc(tmp_path):
+    geo, bgeo = make_grid_bgeo()
+    path = tmp_path / "grid.bgeo.sc"
+    path.write_bytes( make_bgeosc([ zlib_chunk(bgeo[:512], 128), memcpyed_chunk(bgeo[512:]) ]) )
+
+    data = open_bgeosc(str(path))
+    assert data[:]==bgeo
+    assert compare_geometry(geo, BgeoLoader().load(data))==[]
+
+    path.write_bytes( make_bgeosc([]) )
+    assert open_bgeosc(str(path))==b""
+
+
+def test_broken_chunk():
+    _, bgeo = make_grid_bgeo()
+    data = make_bgeosc([ memcpyed_chunk(bgeo) ])
+    with pytest.raises(ValueError):
+        read_bgeosc(data[:-30] + data[-24:])
+    with pytest.raises(ValueError):
+        read_bgeosc(bgeo)
+
+
+def test_blosc_chunk():
+    blosc = pytest.importorskip("blosc")
+    _, bgeo = make_grid_bgeo()
+    assert read_bgeosc( make_bgeosc([ blosc.compress(bgeo, typesize=1) ]) )==bgeo
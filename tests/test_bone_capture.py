@@ -0,0 +1,82 @@
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import BoneCaptureInfo
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+# pointごとの(bone番号, weight, ...) influenceの数がばらばらで、無いものも含む
+PAIRS = [ [0, 1.0], [], [1, 0.25, 2, 0.75], [2, 0.5, 0, 0.5, 1, 0.0], [1, 1.0] ]
+
+
+def make_capture_geometry(capture):
+    """ PAIRSと同じ数のpointを持つポリゴン一つとboneCapture """
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(len(PAIRS)*3, dtype=np.float32).reshape(-1, 3) )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(len(PAIRS), dtype=np.int32)
+    geo.loop_counts = np.array([len(PAIRS)], dtype=np.int32)
+
+    attrib = GeometryAttribute.bonecapture()
+    attrib.values = capture
+    geo.point_attributes.append(attrib)
+    return geo
+
+
+def make_bones(capture):
+    capture.bone_names = [ "root", "spine", "head" ]
+    matrices = np.tile(np.eye(4), (3, 1, 1))
+    matrices[:, 3, :3] = np.arange(9).reshape(3, 3)
+    capture.bone_matrices = matrices
+
+
+def test_set_pairs_matches_set_csr():
+    pairs = BoneCaptureInfo()
+    pairs.set_pairs(PAIRS)
+
+    csr = BoneCaptureInfo()
+    csr.set_csr([1, 0, 2, 3, 1], [0, 1, 2, 2, 0, 1, 1], [1.0, 0.25, 0.75, 0.5, 0.5, 0.0, 1.0])
+
+    assert pairs.influence_count()==3
+    assert np.array_equal(pairs.indices, csr.indices)
+    assert np.array_equal(pairs.weights, csr.weights)
+    # 使わない所は-1
+    assert pairs.indices[1].tolist()==[-1, -1, -1]
+    assert pairs.weights[0].tolist()==[1.0, -1.0, -1.0]
+
+
+def test_bone_capture_roundtrip():
+    capture = BoneCaptureInfo()
+    make_bones(capture)
+    capture.set_pairs(PAIRS)
+    geo = make_capture_geometry(capture)
+
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert loaded.find_point_attributes("boneCapture").values.bone_names==capture.bone_names
+
+
+def test_bonecapture_attrib_values_matches_capture():
+    capture = BoneCaptureInfo()
+    make_bones(capture)
+    capture.set_pairs(PAIRS)
+
+    # pairsのリストから書いても同じ
+    writer = BgeoConverter.MeshWriter()
+    writer.bonecapture_attrib_values(capture.bone_names, capture.bone_matrices, PAIRS)
+    expected = BgeoConverter.MeshWriter()
+    expected.capture_attrib_values(capture)
+    assert writer.getvalue()==expected.getvalue()
+
+
+def test_empty_capture():
+    capture = BoneCaptureInfo()
+    make_bones(capture)
+    capture.set_pairs([ [] for _ in PAIRS ])
+    assert capture.indices.shape==(len(PAIRS), 0)
+
+    geo = make_capture_geometry(capture)
+    assert compare_geometry(geo, BgeoLoader().load( BgeoConverter().convert(geo) ))==[]
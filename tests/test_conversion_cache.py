@@ -0,0 +1,89 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.conversion_cache import ConversionCache
+from bgeolib.conversion_cache import update_hash
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def make_quad(offset=0.0):
+    """ 四角形一つのジオメトリ """
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.array([ [0, 0, 0], [1, 0, 0], [1, 0, 1], [0, 0, 1] ], dtype=np.float32) + offset )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(4, dtype=np.int32)
+    geo.loop_counts = np.array([4], dtype=np.int32)
+    return geo
+
+
+def test_update_hash_matches_bytes():
+    values = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+    h = hashlib.sha1()
+    update_hash(h, values[:, :2], np.float64) # 連続していない、型の違うもの
+    update_hash(h, np.zeros(0, dtype=np.int32))
+    update_hash(h, [True, False])
+
+    expected = hashlib.sha1()
+    expected.update( np.ascontiguousarray(values[:, :2], dtype=np.float64).tobytes() )
+    expected.update( np.array([True, False]).tobytes() )
+    assert h.hexdigest()==expected.hexdigest()
+
+
+def test_fingerprint_follows_content():
+    assert ConversionCache.fingerprint(make_quad(), "1")==ConversionCache.fingerprint(make_quad(), "1")
+    assert ConversionCache.fingerprint(make_quad(), "1")!=ConversionCache.fingerprint(make_quad(), "2")
+    assert ConversionCache.fingerprint(make_quad())!=ConversionCache.fingerprint(make_quad(1.0))
+
+
+def test_store_and_load(tmp_path):
+    cache = ConversionCache(str(tmp_path))
+    bgeo = BgeoConverter().convert(make_quad())
+    key = ConversionCache.fingerprint(make_quad())
+
+    assert cache.load(key) is None
+    cache.store(key, bgeo)
+    assert cache.load(key)==bgeo
+
+    # as_fileなら読み込まずに開いたfileを返す
+    with cache.load(key, as_file=True) as f:
+        assert f.read()==bgeo
+
+    # 別のインスタンスからも読める
+    assert ConversionCache(str(tmp_path)).load(key)==bgeo
+    assert cache.stats()["hits"]==2 and cache.stats()["misses"]==1
+
+
+def test_stale_temporary_files_are_removed(tmp_path):
+    stale_path = tmp_path / "stale.tmp"
+    stale_path.write_bytes(b"partial")
+    old_time = time.time() - 2*ConversionCache.STALE_TEMP_SECONDS
+    os.utime(stale_path, (old_time, old_time))
+
+    # 書き込み中かもしれない新しいものは残す
+    fresh_path = tmp_path / "fresh.tmp"
+    fresh_path.write_bytes(b"partial")
+
+    ConversionCache(str(tmp_path))
+    assert not stale_path.exists()
+    assert fresh_path.exists()
+
+
+def test_evict_oldest(tmp_path):
+    bgeo = BgeoConverter().convert(make_quad())
+    cache = ConversionCache(str(tmp_path), max_bytes=2*len(bgeo))
+
+    for i, key in enumerate( ("a", "b", "c") ):
+        cache.store(key, bgeo)
+        os.utime(cache.path(key), (i, i))
+        cache.entries[key][0] = i
+
+    cache.store("d", bgeo)
+    assert sorted(cache.entries)==["c", "d"]
+    assert not os.path.exists(cache.path("a"))
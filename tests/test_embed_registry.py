@@ -0,0 +1,71 @@
+import tempfile
+
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.embed_registry import EmbedRegistry
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import PackedGeoInfo
+
+
+def make_triangle(offset):
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.array([ [0, 0, 0], [1, 0, 0], [0, 1, 0] ], dtype=np.float32) + offset )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(3, dtype=np.int32)
+    geo.loop_counts = np.array([3], dtype=np.int32)
+    return geo
+
+
+def test_digest_of_file_matches_bytes():
+    bgeo = BgeoConverter().convert( make_triangle(0.0) )
+    with tempfile.TemporaryFile() as f:
+        f.write(bgeo)
+        assert EmbedRegistry.digest(f)==EmbedRegistry.digest(bgeo)
+
+
+def test_register():
+    registry = EmbedRegistry()
+    first_id = registry.new_embed_id()
+    second_id = registry.new_embed_id()
+    assert first_id!=second_id
+
+    registry.register("mesh", first_id)
+    assert registry.find("mesh")==first_id and registry.find("other") is None
+
+    bgeo = BgeoConverter().convert( make_triangle(0.0) )
+    assert registry.register_bgeo(first_id, bgeo)==first_id
+    # 同じ内容は先に登録したものにまとめる
+    assert registry.register_bgeo(second_id, bytes(bgeo))==first_id
+    assert registry.resolve(second_id)==first_id
+    assert registry.resolve(first_id)==first_id
+
+
+def test_duplicates_are_packed_once():
+    geos = [ make_triangle(0.0), make_triangle(1.0), make_triangle(0.0) ]
+    registry = EmbedRegistry()
+
+    packed_geo_list = list()
+    for i, geo in enumerate(geos):
+        packed_geo = PackedGeoInfo()
+        packed_geo.embed_id = registry.new_embed_id()
+        packed_geo.type = "MESH"
+        packed_geo.name = "/obj{}".format(i)
+
+        bgeo = BgeoConverter().convert(geo)
+        if registry.register_bgeo(packed_geo.embed_id, bgeo)==packed_geo.embed_id:
+            packed_geo.bgeo = bgeo
+        packed_geo_list.append(packed_geo)
+
+    for packed_geo in packed_geo_list:
+        packed_geo.embed_id = registry.resolve(packed_geo.embed_id)
+
+    loaded_geo_list, embedded = BgeoLoader().load_packed( BgeoConverter().pack(packed_geo_list) )
+    assert len(embedded)==2
+    assert [ packed_geo.embed_id for packed_geo in loaded_geo_list ]==[ packed_geo.embed_id for packed_geo in packed_geo_list ]
+    for geo, packed_geo in zip(geos, loaded_geo_list):
+        assert compare_geometry(geo, embedded[packed_geo.embed_id])==[]
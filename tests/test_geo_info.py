@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import STORAGE_DTYPES
+from bgeolib.geo_info import AttributeList
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def make_quads(count):
+    """ 点を共有しないcount個の四角形 """
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(count*12, dtype=np.float64).reshape(-1, 3) )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(count*4, dtype=np.int32)
+    geo.loop_counts = np.full(count, 4, dtype=np.int32)
+    return geo
+
+
+def test_set_array():
+    attrib = GeometryAttribute.texturecoord("uv")
+    attrib.set_array( [ (0, 1, 0), (1, 1, 0) ] )
+    assert attrib.values.dtype==np.float32 and attrib.values.shape==(2, 3)
+    assert attrib.values.flags.c_contiguous
+    assert attrib.element_count()==2
+
+    # 連続していないものも連続したものにする
+    attrib = GeometryAttribute.numeric("id", 1, "int32")
+    attrib.set_array( np.arange(10)[::2] )
+    assert attrib.values.dtype==np.int32 and attrib.values.flags.c_contiguous
+    assert attrib.values.tolist()==[0, 2, 4, 6, 8]
+
+    attrib.set_array( np.arange(3), "int8" )
+    assert attrib.storage=="int8" and attrib.values.dtype==np.int8
+
+
+def test_attribute_list():
+    attribs = AttributeList()
+    attribs.extend( [ GeometryAttribute.numeric("a"), GeometryAttribute.numeric("b") ] )
+    replaced = GeometryAttribute.numeric("a", 3)
+    attribs.append(replaced)
+
+    # 同名のものは順番を変えずに上書き
+    assert [ attrib.name for attrib in attribs ]==["a", "b"]
+    assert attribs.find("a") is replaced and "b" in attribs and "c" not in attribs
+    attribs.remove(replaced)
+    assert len(attribs)==1 and attribs.find("a") is None
+
+
+@pytest.mark.parametrize("storage", [ storage for storage in STORAGE_DTYPES if storage!="fpreal16" ])
+def test_numeric_attribute_roundtrip(storage):
+    geo = make_quads(50)
+    point_count = geo.point_count()
+
+    scalar = GeometryAttribute.numeric("scalar", 1, storage)
+    scalar.set_array( np.arange(point_count) % 100 )
+    geo.point_attributes.append(scalar)
+
+    vector = GeometryAttribute.numeric("vector", 2, storage)
+    vector.set_array( np.arange(geo.vertex_count()*2).reshape(-1, 2) % 100 )
+    geo.vertex_attributes.append(vector)
+
+    matrix = GeometryAttribute.matrix("transform")
+    matrix.set_array( np.tile(np.eye(3), (geo.primitive_count(), 1, 1)) )
+    geo.primitive_attributes.append(matrix)
+
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert loaded.find_point_attributes("scalar").values.dtype==STORAGE_DTYPES[storage]
+
+
+def test_tuple_list_values_roundtrip():
+    # 配列にしていないタプルのlistも書き出せる
+    geo = make_quads(2)
+    cd = GeometryAttribute.color("Cd")
+    cd.values = [ (1.0, 0.5, 0.25) ]*geo.point_count()
+    geo.point_attributes.append(cd)
+
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert loaded.find_point_attributes("Cd").values.tolist()==[ [1.0, 0.5, 0.25] ]*geo.point_count()
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import check_geometry
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.bgeo_reader import BinaryJsonReader
+from bgeolib.bgeo_reader import to_dict
+from bgeolib.geo_info import EdgeGroup
+from bgeolib.geo_info import ElementGroup
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def make_strip(count):
+    """ count個の四角形を並べた帯(点は共有する) """
+    positions = np.zeros( (2*(count + 1), 3), dtype=np.float32 )
+    positions[:, 0] = np.arange(2*(count + 1)) // 2
+    positions[:, 2] = np.arange(2*(count + 1)) % 2
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+
+    start = 2*np.arange(count)
+    geo.indices = np.stack([start, start + 1, start + 3, start + 2], axis=1).ravel()
+    geo.loop_counts = np.full(count, 4, dtype=np.int32)
+    return geo
+
+
+def element_group(name, selection):
+    group = ElementGroup()
+    group.name = name
+    group.selection = np.asarray(selection, dtype=bool)
+    return group
+
+
+def edge_group(name, points):
+    group = EdgeGroup()
+    group.name = name
+    group.points = np.asarray(points, dtype=np.int64)
+    return group
+
+
+@pytest.mark.parametrize("count", [1, 31, 32, 100])
+def test_groups_roundtrip(count):
+    geo = make_strip(count)
+    rng = np.random.default_rng(count)
+    geo.point_groups.append( element_group("pinned", rng.random(geo.point_count())>0.5) )
+    geo.point_groups.append( element_group("empty", np.zeros(geo.point_count())) )
+    geo.primitive_groups.append( element_group("front", np.arange(geo.primitive_count())%3==0) )
+    geo.primitive_groups.append( element_group("all", np.ones(geo.primitive_count())) )
+    geo.edge_groups.append( edge_group("seam", [0, 1, 2, 3]) )
+    geo.edge_groups.append( edge_group("border", np.arange(geo.point_count() - 2)) )
+    assert check_geometry(geo)==[]
+
+    bgeo = BgeoConverter().convert(geo)
+    loaded = BgeoLoader().load(bgeo)
+    assert compare_geometry(geo, loaded)==[]
+
+    # selectionは要素ごとのbitを詰めたもの
+    doc = to_dict( BinaryJsonReader(bgeo).read() )
+    selection = to_dict( to_dict(doc["pointgroups"][0][1])["selection"] )
+    assert to_dict(selection["unordered"])["i8"].dtype==bool
+
+
+def test_group_loader_encodings():
+    # Houdiniが書くboolRLE、orderedも読める
+    def group_data(selection):
+        return [ ["name", "g"], ["selection", selection] ]
+
+    loader = BgeoLoader()
+    rle = ["unordered", ["boolRLE", np.array([2, 0, 3, 1])]]
+    assert loader.element_group(group_data(rle), 5).selection.tolist()==[False, False, True, True, True]
+    ordered = ["ordered", np.array([4, 1])]
+    assert loader.element_group(group_data(ordered), 5).selection.tolist()==[False, True, False, False, True]
+
+
+def test_check_groups():
+    geo = make_strip(2)
+    geo.point_groups.append( element_group("short", [True]) )
+    geo.edge_groups.append( edge_group("odd", [0, 1, 2]) )
+    geo.edge_groups.append( edge_group("outside", [0, geo.point_count()]) )
+    assert len( check_geometry(geo) )==3
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_converter import INDEX_EMBED_PREFIX
+from bgeolib.bgeo_converter import INDEX_NAME_PREFIX
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import IndexedBgeoFile
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import PackedGeoInfo
+
+
+def make_triangle(offset):
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.array([ [0, 0, 0], [1, 0, 0], [0, 1, 0] ], dtype=np.float32) + offset )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(3, dtype=np.int32)
+    geo.loop_counts = np.array([3], dtype=np.int32)
+    return geo
+
+
+def make_packed(geos, names):
+    """ geos[i]を参照するPackedGeometry(最後の名前は最初のgeoを共有する) """
+    packed_geo_list = list()
+    for i, name in enumerate(names):
+        embed_index = i if i<len(geos) else 0
+        packed_geo = PackedGeoInfo()
+        packed_geo.embed_id = "{:016x}".format(embed_index + 1)
+        packed_geo.bgeo = BgeoConverter().convert(geos[embed_index])
+        packed_geo.type = "MESH"
+        packed_geo.name = name
+        packed_geo.position = (0.0, 0.0, 0.0)
+        packed_geo.transform = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+        packed_geo_list.append(packed_geo)
+    return packed_geo_list
+
+
+def test_index_reads_each_embed():
+    geos = [ make_triangle(float(i)) for i in range(0, 3) ]
+    names = [ "/Collection/a", "/Collection/b", "/c", "/Collection/shared" ]
+    bgeo = BgeoConverter(index=True).pack( make_packed(geos, names) )
+
+    indexed = IndexedBgeoFile(bgeo)
+    assert indexed.embed_ids()==[ "{:016x}".format(i + 1) for i in range(0, 3) ]
+    assert indexed.names()==names
+
+    # 自分で書き込むkeyはすべて名前空間つき
+    assert all( key.startswith( (INDEX_EMBED_PREFIX, INDEX_NAME_PREFIX) ) for key in indexed.entries )
+
+    for name, geo in zip(names, geos + geos[:1]):
+        assert compare_geometry(geo, indexed.load(name))==[]
+        assert compare_geometry(geo, BgeoLoader().load( indexed.bgeo(name) ))==[]
+    assert compare_geometry(geos[1], indexed.load("{:016x}".format(2)))==[]
+
+    with pytest.raises(KeyError):
+        indexed.position("embed:0000000000000001")
+
+    # indexがあっても全体を読める
+    packed_geo_list, embedded = BgeoLoader().load_packed(bgeo)
+    assert [ packed_geo.name for packed_geo in packed_geo_list ]==names
+    assert sorted(embedded)==indexed.embed_ids()
+
+
+def test_no_index():
+    bgeo = BgeoConverter().pack( make_packed([ make_triangle(0.0) ], [ "/a" ]) )
+    with pytest.raises(ValueError):
+        IndexedBgeoFile(bgeo)
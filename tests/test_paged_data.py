@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from bgeolib import paged_data
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import BoneCaptureInfo
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.paged_data import pack_pages
+from bgeolib.paged_data import unpack_pages
+
+
+def make_values(count, size, pagesize, seed=0):
+    """ 値がすべて同じpageとランダムなpageが混ざった(count, size)の配列 """
+    rng = np.random.default_rng(seed)
+    values = rng.random((count, size)).astype(np.float32)
+
+    # 1つおきのpageを同じ値にする(subvectorごとに違うpageも作る)
+    for start in range(0, count, 2*pagesize):
+        values[start:start+pagesize] = values[start]
+    if size>1:
+        values[pagesize:2*pagesize, :1] = -0.0
+    return values
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 63, 64, 65, 1000, 3*64+1])
+@pytest.mark.parametrize("pagesize", [1, 7, 64])
+@pytest.mark.parametrize("size, packing", [ (1, None), (3, None), (3, [1, 1, 1]), (4, [2, 2]) ])
+def test_pack_pages_roundtrip(count, pagesize, size, packing):
+    values = make_values(count, size, pagesize)
+
+    flags, rawpagedata = pack_pages(values, size, pagesize, packing)
+    restored = unpack_pages(rawpagedata, count, size, pagesize, packing, flags)
+
+    assert restored.shape==(count, size)
+    # -0.0と0.0も区別する
+    assert np.array_equal(restored.view(np.uint32), values.view(np.uint32))
+    assert rawpagedata.size==paged_data.packed_length(count, size, pagesize, packing, flags)
+
+
+def test_constant_pages_store_one_tuple():
+    values = np.zeros((3*1024, 3), dtype=np.float32)
+    values[1024:2048] = np.random.default_rng(0).random((1024, 3))
+
+    flags, rawpagedata = pack_pages(values, 3)
+    assert len(flags)==1
+    assert flags[0].tolist()==[True, False, True]
+    assert rawpagedata.size==(1 + 1024 + 1)*3
+
+    # packingを指定するとsubvectorごとに調べる
+    values[:1024, 1] = np.arange(1024)
+    flags, rawpagedata = pack_pages(values, 3, packing=[1, 1, 1])
+    assert [ f.tolist() for f in flags ]==[ [True, False, True], [False, False, True], [True, False, True] ]
+    assert np.array_equal(unpack_pages(rawpagedata, len(values), 3, packing=[1, 1, 1], flags=flags), values)
+
+
+def test_single_tuple_page_is_not_constant():
+    values = np.random.default_rng(0).random((1025, 3)).astype(np.float32)
+
+    flags, rawpagedata = pack_pages(values, 3)
+    assert flags is None
+    assert rawpagedata.size==1025*3
+
+
+def test_chunked_pages_match(monkeypatch):
+    values = make_values(5000, 3, 64)
+    expected = pack_pages(values, 3, 64, [1, 1, 1])
+
+    # 1pageずつ処理しても同じになる
+    monkeypatch.setattr(paged_data, "CHUNK_SIZE", 1)
+    flags, rawpagedata = pack_pages(values, 3, 64, [1, 1, 1])
+
+    assert [ f.tolist() for f in flags ]==[ f.tolist() for f in expected[0] ]
+    assert np.array_equal(rawpagedata, expected[1])
+
+
+def make_grid(side):
+    """ side x sideの点の四角ポリゴンのグリッド """
+    x, z = np.meshgrid(np.arange(side, dtype=np.float32), np.arange(side, dtype=np.float32))
+    positions = np.stack([x.ravel(), np.zeros(side*side, dtype=np.float32), z.ravel()], axis=1)
+
+    corner = (np.arange(side-1)[None, :] + side*np.arange(side-1)[:, None]).ravel()
+    indices = np.stack([corner, corner+side, corner+side+1, corner+1], axis=1).ravel()
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+
+    uv_attrib = GeometryAttribute.texturecoord("uv")
+    uv_attrib.set_array(positions[indices] / side)
+    geo.vertex_attributes.append(uv_attrib)
+
+    geo.indices = indices
+    geo.loop_counts = np.full(len(corner), 4, dtype=np.int32)
+    return geo
+
+
+def make_skin_capture(point_count, influence_count, bone_count):
+    """ 各pointがinfluence_count個のboneに影響されるBoneCaptureInfo """
+    rng = np.random.default_rng(0)
+    weights = rng.random((point_count, influence_count))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    capture = BoneCaptureInfo()
+    capture.bone_names = [ "bone{}".format(i) for i in range(bone_count) ]
+    capture.bone_matrices = np.tile(np.eye(4), (bone_count, 1, 1))
+    capture.set_csr(np.full(point_count, influence_count), rng.integers(0, bone_count, point_count*influence_count), weights.ravel())
+    return capture
+
+
+def make_paged_geometry():
+    """ 値がすべて同じpageを含むattribute、pagesizeを変えたattribute、boneCaptureを持つジオメトリ """
+    geo = make_grid(70)
+    point_count = geo.point_count()
+
+    density = GeometryAttribute.numeric("density")
+    density.pagesize = 256
+    density.set_array( make_values(point_count, 1, 256, seed=1) )
+    geo.point_attributes.append(density)
+
+    cd = GeometryAttribute.color("Cd")
+    cd.set_array( np.tile(np.array([1.0, 0.5, 0.25], dtype=np.float32), (point_count, 1)) )
+    geo.point_attributes.append(cd)
+
+    material = GeometryAttribute.numeric("material", 1, "int32")
+    material.pagesize = 512
+    material.set_array( np.arange(geo.primitive_count()) // 2000 )
+    geo.primitive_attributes.append(material)
+
+    # influenceが外側になるpackingで書き出される
+    capture = GeometryAttribute.bonecapture()
+    capture.values = make_skin_capture(point_count, 4, 8)
+    capture.values.indices[:2048] = capture.values.indices[0]
+    capture.values.weights[:2048] = capture.values.weights[0]
+    geo.point_attributes.append(capture)
+
+    return geo
+
+
+def test_convert_roundtrip():
+    geo = make_paged_geometry()
+
+    compact = BgeoConverter().convert(geo)
+    full = BgeoConverter(constant_pages=False).convert(geo)
+    assert len(compact)<len(full)
+    assert b"constantpageflags" in compact and b"constantpageflags" not in full
+
+    for bgeo in (compact, full):
+        assert compare_geometry(geo, BgeoLoader().load(bgeo))==[]
@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.parallel_converter import ParallelConverter
+
+needs_fork = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="fork is not available")
+
+
+def make_triangles(count, offset=0.0):
+    """ count個の三角形のジオメトリ """
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(count*9, dtype=np.float32).reshape(-1, 3) + offset )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(count*3, dtype=np.int32)
+    geo.loop_counts = np.full(count, 3, dtype=np.int32)
+    return geo
+
+
+def read_bgeo(bgeo):
+    if isinstance(bgeo, bytes):
+        return bgeo
+    bgeo.seek(0)
+    data = bgeo.read()
+    bgeo.close()
+    return data
+
+
+def run(converter, geos):
+    """ 変換済みのもの(cacheの代わり)と変換するものを交互に登録して(tag, bgeo)をすべて受け取る """
+    results = list()
+    for i, geo in enumerate(geos):
+        if i % 3==0:
+            results.extend( converter.submit_result(BgeoConverter().convert(geo), i) )
+        else:
+            results.extend( converter.submit(geo, i) )
+    results.extend( converter.finish() )
+    return [ (tag, read_bgeo(bgeo)) for tag, bgeo in results ]
+
+
+@pytest.mark.parametrize("jobs", [1, pytest.param(3, marks=needs_fork)])
+@pytest.mark.parametrize("spool", [False, True])
+def test_results_keep_order(jobs, spool):
+    geos = [ make_triangles(10 + i, float(i)) for i in range(0, 10) ]
+    expected = [ (i, BgeoConverter().convert(geo)) for i, geo in enumerate(geos) ]
+
+    converter = ParallelConverter(jobs, spool)
+    assert (converter.pool is not None)==(jobs>1)
+    assert run(converter, geos)==expected
+    assert converter.pool is None
+
+
+@needs_fork
+def test_spooled_worker_files_are_removed(monkeypatch, tmp_path):
+    # workerが作る一時ファイルの場所
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    converter = ParallelConverter(2, spool=True)
+    results = list()
+    for i in range(0, 4):
+        results.extend( converter.submit(make_triangles(5), i) )
+    results.extend( converter.finish() )
+
+    # 開いたまま消してあるので読める
+    assert all( len(read_bgeo(bgeo))>0 for _, bgeo in results )
+    assert os.listdir(tmp_path)==[]
+
+    converter = ParallelConverter(2, spool=True)
+    for i in range(0, 2):
+        converter.submit(make_triangles(5), i)
+    # 書き出し終わったものが残っている状態で終了する
+    for _, result, _ in converter.pending:
+        result.wait()
+    converter.terminate()
+    assert converter.pool is None and len(converter.pending)==0
+    assert os.listdir(tmp_path)==[]
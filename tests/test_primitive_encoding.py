@@ -0,0 +1,101 @@
+import io
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.bgeo_reader import BinaryJsonReader
+from bgeolib.bgeo_reader import to_dict
+from bgeolib.bgeo_writer import BinaryJsonWriter
+from bgeolib.geo_info import CurvePrimInfo
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+
+
+def write_and_read(values):
+    """ write_auto_int_uniform_arrayで書いた配列を読み込む """
+    stream = io.BytesIO()
+    BinaryJsonWriter(stream, magic=False).write_auto_int_uniform_array(values)
+    return BinaryJsonReader(stream.getvalue()).read()
+
+
+@pytest.mark.parametrize("values, dtype", [
+    ([], np.int8),
+    ([0, 127, -128], np.int8),
+    ([-1, 128], np.int16),
+    ([-32769, 5], np.int32),
+    ([0, 40000], np.int32),
+    ([-5, 2**31], np.int64),
+    ([-2**31 - 1, 3], np.int64),
+    ([-2**63, 2**63 - 1], np.int64),
+])
+def test_auto_int_uniform_array(values, dtype):
+    actual = write_and_read( np.array(values, dtype=np.int64) )
+    assert actual.dtype==np.dtype(dtype).newbyteorder("<")
+    assert actual.tolist()==values
+
+
+def test_auto_int_uniform_array_unsigned_overflow():
+    with pytest.raises(OverflowError):
+        write_and_read( np.array([0, 2**63], dtype=np.uint64) )
+
+
+def make_mixed_geometry():
+    """ 頂点数の違うポリゴンが混ざったものとカーブ2本のジオメトリ """
+    loop_counts = np.array([3, 3, 4, 4, 4, 5, 3, 3, 6], dtype=np.int32)
+    polygon_vertex_count = int(loop_counts.sum())
+    curve_vertex_counts = (4, 5)
+    point_count = polygon_vertex_count + sum(curve_vertex_counts)
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(point_count*3, dtype=np.float32).reshape(-1, 3) )
+    geo.point_attributes.append(p_attrib)
+    geo.loop_counts = loop_counts
+    geo.indices = np.arange(point_count, dtype=np.int32)
+
+    start = polygon_vertex_count
+    for count in curve_vertex_counts:
+        curve = CurvePrimInfo()
+        curve.type = "NURBCurve"
+        curve.vertices = list( range(start, start + count) )
+        curve.closed = False
+        curve.basis = "NURBS"
+        curve.order = 4
+        curve.endinterpolation = True
+        curve.knots = [0.0]*4 + [ (i+1.0)/(count-3) for i in range(0, count-4) ] + [1.0]*4
+        geo.curves.append(curve)
+        start += count
+
+    return geo
+
+
+def test_nvertices_rle_mixed_sizes():
+    geo = make_mixed_geometry()
+    assert geo.nvertices_rle().tolist()==[3, 2, 4, 3, 5, 1, 3, 2, 6, 1]
+    assert geo.nvertices_rle().dtype==np.int64
+
+    geo.loop_counts = np.array([4], dtype=np.int32)
+    assert geo.nvertices_rle().tolist()==[4, 1]
+    geo.loop_counts = list()
+    assert geo.nvertices_rle().tolist()==[]
+
+
+def test_polygon_block_excludes_curves():
+    geo = make_mixed_geometry()
+    assert geo.polygon_count()==9
+    assert geo.primitive_count()==11
+
+    bgeo = BgeoConverter().convert(geo)
+    doc = to_dict( BinaryJsonReader(bgeo).read() )
+    assert doc["primitivecount"]==11
+
+    primitives = [ (to_dict(header)["type"], to_dict(data)) for header, data in doc["primitives"] ]
+    assert [ primitive_type for primitive_type, _ in primitives ]==["p_r", "NURBCurve", "NURBCurve"]
+    # n_pはポリゴンだけの数
+    assert primitives[0][1]["n_p"]==9
+    assert primitives[0][1]["r_v"].tolist()==geo.nvertices_rle().tolist()
+
+    assert compare_geometry(geo, BgeoLoader().load(bgeo))==[]
@@ -0,0 +1,79 @@
+import json
+import threading
+
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.profiler import NULL_PROFILER
+from bgeolib.profiler import Profiler
+
+
+def make_triangle():
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.array([ [0, 0, 0], [1, 0, 0], [0, 1, 0] ], dtype=np.float32) )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(3, dtype=np.int32)
+    geo.loop_counts = np.array([3], dtype=np.int32)
+    return geo
+
+
+def sections(profiler):
+    return { section["path"]: section["count"] for section in profiler.report()["sections"] }
+
+
+def test_nested_sections():
+    profiler = Profiler()
+    with profiler.section("frame"):
+        with profiler.section("extract") as section:
+            pass
+        with profiler.section("extract"):
+            pass
+
+    # 別のthreadの区間は入れ子にならない
+    def work():
+        with profiler.section("write"):
+            pass
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+
+    assert sections(profiler)=={ "frame/extract": 2, "frame": 1, "write": 1 }
+    assert section.seconds>=0.0
+
+
+def test_counters_and_records():
+    profiler = Profiler()
+    profiler.count("written_bytes", 10)
+    profiler.count("written_bytes", 5)
+    profiler.record("/a", points=3, bytes=100)
+    profiler.record("/a", bytes=20, type="MESH")
+
+    report = profiler.report()
+    assert report["counters"]=={ "written_bytes": 15 }
+    assert report["objects"]==[ { "name": "/a", "points": 3, "bytes": 120, "type": "MESH" } ]
+    assert report["peak_memory_bytes"] is None
+
+
+def test_converter_sections(tmp_path):
+    profiler = Profiler(trace=True, memory=True)
+    bgeo = BgeoConverter(profiler=profiler).convert( make_triangle() )
+    profiler.close()
+
+    assert sections(profiler)=={ "convert": 1 }
+    assert profiler.report()["counters"]["convert_bytes"]==len(bgeo)
+
+    path = tmp_path / "trace.json"
+    profiler.dump(str(path), "chrome")
+    events = json.loads( path.read_text() )["traceEvents"]
+    assert [ event["name"] for event in events if event["ph"]=="X" ]==["convert"]
+
+
+def test_null_profiler():
+    assert not NULL_PROFILER.enabled
+    with NULL_PROFILER.section("convert", path="a"):
+        NULL_PROFILER.count("bytes")
+    # 何も記録しないのでconvertの結果も変わらない
+    assert BgeoConverter(profiler=NULL_PROFILER).convert( make_triangle() )==BgeoConverter().convert( make_triangle() )
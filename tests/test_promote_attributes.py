@@ -0,0 +1,87 @@
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import promote_values
+
+SIDE = 4 # 4x4点、3x3個の四角形
+
+
+def make_grid():
+    x, z = np.meshgrid(np.arange(SIDE, dtype=np.float32), np.arange(SIDE, dtype=np.float32))
+    positions = np.stack([x.ravel(), np.zeros(SIDE*SIDE, dtype=np.float32), z.ravel()], axis=1)
+
+    corner = (np.arange(SIDE-1)[None, :] + SIDE*np.arange(SIDE-1)[:, None]).ravel()
+    indices = np.stack([corner, corner+SIDE, corner+SIDE+1, corner+1], axis=1).ravel()
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+    geo.indices = indices
+    geo.loop_counts = np.full(len(corner), 4, dtype=np.int32)
+    return geo
+
+
+def add_vertex_attribute(geo, attrib, values):
+    attrib.set_array(values)
+    geo.vertex_attributes.append(attrib)
+
+
+def test_promote_values():
+    values = np.array([ [1, 2], [3, 4], [1, 2] ], dtype=np.float32)
+    assert promote_values(values, [0, 1, 0], 3).tolist()==[ [1, 2], [3, 4], [0, 0] ]
+    assert promote_values(values, [0, 0, 1], 2) is None
+    assert promote_values(values + [ [0, 0], [0, 0], [0.001, 0] ], [0, 1, 0], 2, 0.01) is not None
+    assert promote_values(values, [0, 1], 2) is None
+
+
+def test_promote_vertex_attributes():
+    geo = make_grid()
+    indices = np.asarray(geo.indices)
+    positions = geo.find_point_attributes("P").values
+    primitive_indices = np.repeat(np.arange(geo.primitive_count()), 4)
+
+    # 面ごとに一定 -> primitive
+    normals = np.zeros( (geo.vertex_count(), 3), dtype=np.float32 )
+    normals[:, 1] = 1.0
+    normals[:, 0] = primitive_indices * 0.1
+    add_vertex_attribute(geo, GeometryAttribute.normal(), normals)
+
+    # pointごとに一定 -> point
+    uvs = positions[indices] / SIDE
+    add_vertex_attribute(geo, GeometryAttribute.texturecoord("uv"), uvs)
+
+    # seamがある(同じpointでも値が違う) -> vertexのまま
+    seam = uvs.copy()
+    seam[ np.flatnonzero(indices==SIDE + 1)[0], 0 ] = 5.0
+    add_vertex_attribute(geo, GeometryAttribute.texturecoord("uv2"), seam)
+
+    # 移す先に同じ名前がある -> vertexのまま
+    density = GeometryAttribute.numeric("density")
+    density.set_array( np.zeros(geo.point_count()) )
+    geo.point_attributes.append(density)
+    add_vertex_attribute(geo, GeometryAttribute.numeric("density"), positions[indices, 0])
+
+    promoted = geo.promote_vertex_attributes()
+    assert promoted==[ ("primitive", "N"), ("point", "uv") ]
+    assert [ attrib.name for attrib in geo.vertex_attributes ]==["uv2", "density"]
+
+    # 読み込んだものを展開すると元のvertexごとの値になる
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert np.array_equal( loaded.find_primitive_attributes("N").values[primitive_indices], normals )
+    assert np.array_equal( loaded.find_point_attributes("uv").values[indices], uvs )
+
+
+def test_promote_with_tolerance():
+    geo = make_grid()
+    uvs = geo.find_point_attributes("P").values[ np.asarray(geo.indices) ] / SIDE
+    uvs[::2] += 1e-5
+    add_vertex_attribute(geo, GeometryAttribute.texturecoord("uv"), uvs)
+
+    assert geo.promote_vertex_attributes()==[]
+    assert geo.promote_vertex_attributes(tolerance=1e-4)==[ ("point", "uv") ]
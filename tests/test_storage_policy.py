@@ -0,0 +1,112 @@
+import json
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import STORAGE_DTYPES
+from bgeolib.geo_info import BoneCaptureInfo
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.storage_policy import StoragePolicy
+from bgeolib.storage_policy import narrow_values
+
+
+@pytest.mark.parametrize("values, storage, target, expected", [
+    ([0, 100, -100], "int32", "auto", "int8"),
+    ([0, 200], "int32", "auto", "uint8"),
+    ([-1, 200], "int32", "auto", "int16"),
+    ([0, 2**40], "int64", "auto", None),
+    ([0, 300], "int32", "int8", None),
+    ([0.5, 0.25], "fpreal32", "fpreal16", "fpreal16"),
+    ([1e6], "fpreal32", "fpreal16", None),
+    ([0.1], "fpreal32", "auto", None),
+    ([1, 2], "int8", "int32", None),
+])
+def test_narrow_values(values, storage, target, expected):
+    narrowed = narrow_values(np.array(values, dtype=STORAGE_DTYPES[storage]), storage, target)
+    if expected is None:
+        assert narrowed is None
+    else:
+        assert narrowed[0]==expected
+        assert narrowed[1].tolist()==values
+
+
+def test_narrow_values_tolerance():
+    values = np.array([0.1, 0.2], dtype=np.float32)
+    assert narrow_values(values, "fpreal32", "fpreal16") is None
+    storage, converted = narrow_values(values, "fpreal32", "fpreal16", 1e-3)
+    assert storage=="fpreal16" and converted.dtype==np.float16
+
+
+def make_geometry():
+    """ compactで小さくなるattributeと、変わらないものを持つ三角形二つ """
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.arange(18, dtype=np.float32).reshape(-1, 3) * 0.1 )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(6, dtype=np.int32)
+    geo.loop_counts = np.array([3, 3], dtype=np.int32)
+
+    cd = GeometryAttribute.color("Cd")
+    cd.set_array( np.linspace(0.0, 1.0, 18).reshape(-1, 3) )
+    geo.point_attributes.append(cd)
+
+    capture = GeometryAttribute.bonecapture()
+    capture.values = BoneCaptureInfo()
+    capture.values.bone_names = [ "root" ]
+    capture.values.bone_matrices = np.eye(4)[None]
+    capture.values.set_pairs([ [0, 0.5] ]*6)
+    geo.point_attributes.append(capture)
+
+    uv = GeometryAttribute.texturecoord("uv")
+    uv.set_array( np.concatenate( (np.random.default_rng(0).random((6, 2)), np.zeros((6, 1))), axis=1 ) )
+    geo.vertex_attributes.append(uv)
+
+    # 3成分目が0でないので削らない
+    uvw = GeometryAttribute.texturecoord("uvw")
+    uvw.set_array( np.ones((6, 3)) )
+    geo.vertex_attributes.append(uvw)
+
+    material = GeometryAttribute.numeric("material", 1, "int32")
+    material.set_array( [3, 70000] )
+    geo.primitive_attributes.append(material)
+
+    layer = GeometryAttribute.numeric("layer", 1, "int64")
+    layer.set_array( [0, 5] )
+    geo.primitive_attributes.append(layer)
+    return geo
+
+
+def test_compact_profile_roundtrip():
+    geo = make_geometry()
+    changed = StoragePolicy.load("compact").apply(geo)
+    assert changed==[ ("point", "Cd", "fpreal16", 3), ("point", "boneCapture", "fpreal16", 1),
+        ("vertex", "uv", "fpreal32", 2), ("primitive", "layer", "int8", 1) ]
+    assert geo.find_vertex_attributes("uvw").size==3
+    assert geo.find_primitive_attributes("material").storage=="int32"
+
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert loaded.find_point_attributes("Cd").values.dtype==np.float16
+    assert loaded.find_point_attributes("boneCapture").values.weight_storage=="fpreal16"
+    assert loaded.find_primitive_attributes("layer").values.dtype==np.int8
+
+
+def test_full_profile_changes_nothing():
+    geo = make_geometry()
+    assert StoragePolicy.load("full").apply(geo)==[]
+    assert BgeoConverter().convert(geo)==BgeoConverter().convert( make_geometry() )
+
+
+def test_rules_from_file(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text( json.dumps({ "rules": [ {"name": "C*", "storage": "fpreal16", "tolerance": 1e-2} ] }) )
+
+    geo = make_geometry()
+    assert StoragePolicy.load(str(path)).apply(geo)==[ ("point", "Cd", "fpreal16", 3) ]
+
+    with pytest.raises(ValueError):
+        StoragePolicy([ {"storage": "fpreal8"} ])
@@ -0,0 +1,110 @@
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_writer import CountingStream
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import PackedGeoInfo
+
+# 出力が16倍になる2つの規模
+SMALL_POINTS = 20000
+LARGE_POINTS = 320000
+
+
+def make_grid(point_count):
+    """ 四角ポリゴンのグリッド(P, N, uv) """
+    side = max(2, int(np.sqrt(point_count)))
+
+    x, z = np.meshgrid(np.arange(side, dtype=np.float32), np.arange(side, dtype=np.float32))
+    positions = np.stack([x.ravel(), np.zeros(side*side, dtype=np.float32), z.ravel()], axis=1)
+
+    corner = (np.arange(side-1)[None, :] + side*np.arange(side-1)[:, None]).ravel()
+    indices = np.stack([corner, corner+side, corner+side+1, corner+1], axis=1).ravel()
+
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array(positions)
+    geo.point_attributes.append(p_attrib)
+
+    n_attrib = GeometryAttribute.normal()
+    n_attrib.set_array(np.tile(np.array([0.0, 1.0, 0.0], dtype=np.float32), (len(indices), 1)))
+    geo.vertex_attributes.append(n_attrib)
+
+    uv_attrib = GeometryAttribute.texturecoord("uv")
+    uv_attrib.set_array(positions[indices] / side)
+    geo.vertex_attributes.append(uv_attrib)
+
+    geo.indices = indices
+    geo.loop_counts = np.full(len(corner), 4, dtype=np.int32)
+    return geo
+
+
+class NullStream:
+    """ 書き込まれたものを捨てる出力先 """
+
+    def write(self, data):
+        return memoryview(data).nbytes
+
+
+def measure_peak(func):
+    """ funcを実行した間のtracemallocでのピークメモリ """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def convert_peak(point_count):
+    """ streamへconvertした時の(ピークメモリ, 書き出したバイト数) """
+    geo = make_grid(point_count)
+    sink = CountingStream(NullStream())
+    peak = measure_peak(lambda: BgeoConverter().convert(geo, sink))
+    return peak, sink.size
+
+
+def pack_peak(point_count, packed_count=4):
+    """ fileに書き出したbgeoをstreamへpackした時の(ピークメモリ, 書き出したバイト数) """
+    files = list()
+    packed_geo_list = list()
+    for i in range(0, packed_count):
+        f = tempfile.TemporaryFile()
+        BgeoConverter().convert(make_grid(point_count), f)
+        files.append(f)
+
+        packed_geo = PackedGeoInfo()
+        packed_geo.embed_id = "{:016x}".format(i+1)
+        packed_geo.bgeo = f
+        packed_geo.type = "MESH"
+        packed_geo.name = "/obj{}".format(i)
+        packed_geo_list.append(packed_geo)
+
+    try:
+        sink = CountingStream(NullStream())
+        peak = measure_peak(lambda: BgeoConverter().pack(packed_geo_list, sink))
+        return peak, sink.size
+    finally:
+        for f in files:
+            f.close()
+
+
+def assert_flat(small, large):
+    small_peak, small_size = small
+    large_peak, large_size = large
+
+    assert large_size > 10*small_size
+    # ジオメトリが大きくなってもピークメモリはほとんど増えない(出力のサイズにも比例しない)
+    assert large_peak < 2*small_peak
+    assert large_peak < large_size // 4
+
+
+def test_convert_peak_memory_is_flat():
+    assert_flat( convert_peak(SMALL_POINTS), convert_peak(LARGE_POINTS) )
+
+
+def test_pack_peak_memory_is_flat():
+    assert_flat( pack_peak(SMALL_POINTS), pack_peak(LARGE_POINTS) )
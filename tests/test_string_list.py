@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_converter import BgeoConverter
+from bgeolib.bgeo_loader import BgeoLoader
+from bgeolib.bgeo_loader import compare_geometry
+from bgeolib.geo_info import GeometryAttribute
+from bgeolib.geo_info import GeometryInfo
+from bgeolib.geo_info import StringList
+
+
+def append_codes(string_list, codes, strings):
+    """ 一つずつappendする(extend_codesと同じ結果になるはずのもの) """
+    for code in codes:
+        string_list.append(strings[code] if 0<=code<len(strings) else None)
+
+
+def assert_same(actual, expected):
+    assert actual.string_list==expected.string_list
+    assert list(actual.index_list)==list(expected.index_list)
+    assert actual.first_positions==expected.first_positions
+
+
+@pytest.mark.parametrize("seed", range(0, 5))
+def test_extend_codes_matches_append(seed):
+    rng = np.random.default_rng(seed)
+    # 使われないもの、重複、空文字列、None、空白を含むものが混ざったテーブル
+    strings = [ "b", "a", None, "", "a", "with space", "with_space", "unused" ]
+    codes = rng.integers(-2, len(strings) + 2, 500)
+    codes[codes==len(strings) - 1] = 0
+
+    expected = StringList()
+    expected.append("a")
+    append_codes(expected, codes, strings)
+
+    actual = StringList()
+    actual.append("a")
+    actual.extend_codes(codes, strings)
+
+    assert_same(actual, expected)
+    assert "unused" not in actual.string_list
+
+
+def test_extend_codes_twice():
+    strings = [ "x", "y", "z" ]
+
+    expected = StringList()
+    append_codes(expected, [2, 2, 0], strings)
+    append_codes(expected, [1, 0, 1], strings)
+
+    actual = StringList()
+    actual.extend_codes(np.array([2, 2, 0]), strings)
+    actual.extend_codes(np.array([1, 0, 1]), strings)
+
+    assert_same(actual, expected)
+    assert actual.string_list==[ "z", "x", "y" ]
+    assert actual.index("y")==3
+
+
+def test_extend_codes_empty():
+    string_list = StringList.from_codes(np.zeros(0, dtype=np.int64), [ "a" ])
+    assert string_list.string_list==[]
+    assert list(string_list.index_list)==[]
+
+
+def test_string_attribute_roundtrip():
+    geo = GeometryInfo()
+    p_attrib = GeometryAttribute.point()
+    p_attrib.set_array( np.zeros( (6, 3), dtype=np.float32 ) )
+    geo.point_attributes.append(p_attrib)
+    geo.indices = np.arange(6, dtype=np.int32)
+    geo.loop_counts = np.array([3, 3], dtype=np.int32)
+
+    name_attrib = GeometryAttribute.string("name")
+    name_attrib.values.extend_codes(np.array([3, 0, 3, -1, 1, 0]), [ "a", "b", "unused", "d" ])
+    geo.point_attributes.append(name_attrib)
+
+    loaded = BgeoLoader().load( BgeoConverter().convert(geo) )
+    assert compare_geometry(geo, loaded)==[]
+    assert loaded.find_point_attributes("name").values.string_list==[ "d", "a", "b" ]
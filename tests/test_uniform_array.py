@@ -0,0 +1,69 @@
+import array
+import io
+
+import numpy as np
+import pytest
+
+from bgeolib.bgeo_reader import BinaryJsonReader
+from bgeolib.bgeo_writer import BinaryJsonWriter
+
+
+def write_and_read(write):
+    """ writeでBinaryJsonWriterに書いたものを読み込む """
+    stream = io.BytesIO()
+    write( BinaryJsonWriter(stream, magic=False) )
+    return BinaryJsonReader(stream.getvalue()).read()
+
+
+@pytest.mark.parametrize("method, dtype", [
+    ("write_int8_uniform_array", np.int8),
+    ("write_int16_uniform_array", np.int16),
+    ("write_int32_uniform_array", np.int32),
+    ("write_int64_uniform_array", np.int64),
+    ("write_fpreal32_uniform_array", np.float32),
+    ("write_fpreal64_uniform_array", np.float64),
+])
+def test_uniform_array_inputs(method, dtype):
+    expected = np.arange(-6, 6).astype(dtype)
+    # numpy(型の違うもの、多次元、連続していないもの), list, array.array, memoryview
+    inputs = [
+        expected,
+        expected.astype(np.float64 if dtype!=np.float64 else np.float32),
+        expected.reshape(4, 3),
+        np.repeat(expected, 2)[::2],
+        expected.tolist(),
+        array.array("d", expected.tolist()),
+        memoryview(expected),
+    ]
+    for values in inputs:
+        actual = write_and_read( lambda writer: getattr(writer, method)(values) )
+        assert actual.dtype==np.dtype(dtype).newbyteorder("<")
+        assert actual.tolist()==expected.tolist()
+
+
+def test_uniform_array_is_written_in_chunks(monkeypatch):
+    values = np.arange(1000, dtype=np.float64).reshape(-1, 4)
+    expected = write_and_read( lambda writer: writer.write_fpreal32_uniform_array(values) )
+
+    # 変換が要るものは少しずつ変換する
+    monkeypatch.setattr(BinaryJsonWriter, "COPY_CHUNK_SIZE", 40)
+    assert len( list( BinaryJsonWriter.array_chunks(values, np.float32) ) )==values.shape[0] // 2
+    actual = write_and_read( lambda writer: writer.write_fpreal32_uniform_array(values) )
+    assert np.array_equal(actual, expected)
+
+
+def test_uniform_array_chunks_length():
+    chunks = [ np.arange(3), [3, 4], np.zeros(0) ]
+    actual = write_and_read( lambda writer: writer.write_uniform_array_chunks(0x13, '<i4', 5, chunks) )
+    assert actual.tolist()==[0, 1, 2, 3, 4]
+
+    with pytest.raises(ValueError):
+        write_and_read( lambda writer: writer.write_uniform_array_chunks(0x13, '<i4', 6, [ np.arange(3) ]) )
+
+
+@pytest.mark.parametrize("count", [0, 1, 31, 32, 33, 100])
+def test_bool_uniform_array(count):
+    values = np.random.default_rng(count).random(count)>0.5
+    actual = write_and_read( lambda writer: writer.write_bool_uniform_array(values) )
+    assert actual.dtype==bool
+    assert actual.tolist()==values.tolist()